@@ -44,6 +44,47 @@ def _ensure_users_schema():
     db.session.commit()
 
 
+def _ensure_channels_schema():
+    """兼容旧库：为 channels 表补充新增列"""
+    inspector = inspect(db.engine)
+    if 'channels' not in set(inspector.get_table_names()):
+        return
+
+    columns = {column['name'] for column in inspector.get_columns('channels')}
+    missing_columns = {
+        'backup_urls': 'TEXT NULL',
+        'bitrate_kbps': 'INTEGER NULL',
+        'first_byte_ms': 'INTEGER NULL',
+        'content_type': 'VARCHAR(100) NULL'
+    }
+    for column_name, column_ddl in missing_columns.items():
+        if column_name in columns:
+            continue
+        db.session.execute(text(f"ALTER TABLE channels ADD COLUMN {column_name} {column_ddl}"))
+        db.session.commit()
+        logger.info(f"已为 channels 表补充列: {column_name}")
+
+
+def _ensure_watch_history_schema():
+    """兼容旧库：为 watch_history 表补充日汇总标记列（已有记录由 history-worker 分批补汇总）与分页索引"""
+    inspector = inspect(db.engine)
+    if 'watch_history' not in set(inspector.get_table_names()):
+        return
+
+    columns = {column['name'] for column in inspector.get_columns('watch_history')}
+    if 'rolled_up' not in columns:
+        db.session.execute(text("ALTER TABLE watch_history ADD COLUMN rolled_up BOOLEAN NOT NULL DEFAULT 0"))
+        db.session.execute(text("CREATE INDEX ix_watch_history_rolled_up ON watch_history (rolled_up)"))
+        db.session.commit()
+        logger.info("已为 watch_history 表补充列: rolled_up")
+
+    indexes = {index['name'] for index in inspector.get_indexes('watch_history')}
+    if 'idx_watch_history_start_id' not in indexes:
+        db.session.execute(text("CREATE INDEX idx_watch_history_start_id ON watch_history (start_time, id)"))
+        db.session.commit()
+        logger.info("已为 watch_history 表补充索引: idx_watch_history_start_id")
+
+
 def _quote_mysql_identifier(identifier):
     """为 MySQL 标识符添加安全引用"""
     return f"`{identifier.replace('`', '``')}`"
@@ -124,9 +165,13 @@ def create_app():
     # 初始化扩展
     db.init_app(app)
     CORS(app, supports_credentials=True)
+
+    # 数据库语句计时（按接口统计，供 /metrics 输出）
+    from .services.metrics import instrument_sqlalchemy
+    instrument_sqlalchemy()
     
     # 注册蓝图
-    from .api import auth, channels, groups, settings, subscription, proxy, health, dashboard, history
+    from .api import auth, channels, groups, settings, subscription, proxy, health, dashboard, history, metrics
     from .services import import_export
     app.register_blueprint(auth.bp)
     app.register_blueprint(channels.bp)
@@ -137,6 +182,7 @@ def create_app():
     app.register_blueprint(health.bp)
     app.register_blueprint(dashboard.bp)
     app.register_blueprint(history.bp)
+    app.register_blueprint(metrics.bp)
     app.register_blueprint(import_export.bp)
     
     # 创建数据库表
@@ -144,6 +190,8 @@ def create_app():
         db.create_all()
         _drop_mysql_foreign_keys()
         _ensure_users_schema()
+        _ensure_channels_schema()
+        _ensure_watch_history_schema()
 
         # 初始化默认管理员用户
         from .models.users import Users
@@ -10,6 +10,7 @@ from flask import Blueprint, request, jsonify
 from app import db
 from app.models.users import Users
 from app.models.refresh_token import RefreshToken
+from app.services.token_cache import invalidate_token_cache
 from app.utils.auth import login_required, get_current_user as get_authenticated_user
 from app.utils.datetime_utils import to_utc_naive
 from app.utils.jwt import (
@@ -154,6 +155,8 @@ def reset_token():
     """重置订阅 Token"""
     user = get_authenticated_user()
     new_token = user.generate_token()
+    # 旧 Token 立即失效：清空本进程缓存，其他进程按版本号清空
+    invalidate_token_cache()
     db.session.commit()
     
     return jsonify({
@@ -227,6 +230,7 @@ def change_username():
         return jsonify({'error': '用户名已存在'}), 400
     
     user.username = new_username
+    invalidate_token_cache()
     db.session.commit()
     
     return jsonify({
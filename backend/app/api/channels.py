@@ -7,10 +7,20 @@ from flask import Blueprint, request, jsonify
 from app import db
 from app.models.channel import Channel
 from app.models.channel_group import ChannelGroup
+from app.services.channel_catalog import bump_catalog_version
 from app.utils.auth import login_required
 
 bp = Blueprint('channels', __name__, url_prefix='/api/channels')
 
+# 频道列表支持的排序字段
+CHANNEL_SORT_COLUMNS = {
+    'sort_order': Channel.sort_order,
+    'name': Channel.name,
+    'last_check': Channel.last_check,
+    'bitrate_kbps': Channel.bitrate_kbps,
+    'first_byte_ms': Channel.first_byte_ms
+}
+
 
 @bp.route('', methods=['GET'])
 @login_required
@@ -24,6 +34,14 @@ def get_channels():
     search = request.args.get('search', '')
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
+    sort_by = request.args.get('sort_by', 'sort_order')
+    sort_dir = request.args.get('sort_dir', 'asc').lower()
+
+    sort_column = CHANNEL_SORT_COLUMNS.get(sort_by)
+    if sort_column is None:
+        return jsonify({'error': f'不支持的排序字段: {sort_by}'}), 400
+    if sort_dir not in ('asc', 'desc'):
+        return jsonify({'error': 'sort_dir 只能为 asc 或 desc'}), 400
 
     query = Channel.query
 
@@ -42,8 +60,12 @@ def get_channels():
     if search:
         query = query.filter(Channel.name.contains(search))
 
-    # 排序
-    query = query.order_by(Channel.sort_order, Channel.id)
+    # 排序（未测量的频道排在最后）
+    query = query.order_by(
+        sort_column.is_(None),
+        sort_column.desc() if sort_dir == 'desc' else sort_column.asc(),
+        Channel.id
+    )
 
     # 分页
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
@@ -84,6 +106,10 @@ def create_channel():
     is_valid, error_msg = Channel.validate_url(url)
     if not is_valid:
         return jsonify({'error': error_msg}), 400
+
+    backup_urls, error_msg = Channel.parse_backup_urls(data.get('backup_urls'))
+    if error_msg:
+        return jsonify({'error': error_msg}), 400
     
     channel = Channel(
         name=name,
@@ -95,8 +121,10 @@ def create_channel():
         is_active=data.get('is_active', True)
     )
     channel.detect_protocol()
+    channel.set_backup_urls(backup_urls)
     
     db.session.add(channel)
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({
@@ -124,6 +152,16 @@ def update_channel(channel_id):
             return jsonify({'error': error_msg}), 400
         channel.url = data['url']
         channel.detect_protocol()
+        # 学到的 Content-Type 属于旧地址
+        channel.content_type = None
+    if 'backup_urls' in data:
+        backup_urls, error_msg = Channel.parse_backup_urls(data['backup_urls'])
+        if error_msg:
+            return jsonify({'error': error_msg}), 400
+        channel.set_backup_urls(backup_urls)
+    elif 'url' in data:
+        # 主地址变更后去掉与其重复的备用源
+        channel.set_backup_urls(channel.get_backup_urls())
     if 'logo' in data:
         channel.logo = data['logo']
     if 'tvg_id' in data:
@@ -135,6 +173,7 @@ def update_channel(channel_id):
     if 'is_active' in data:
         channel.is_active = data['is_active']
     
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({
@@ -150,6 +189,7 @@ def delete_channel(channel_id):
     channel = Channel.query.get_or_404(channel_id)
     
     db.session.delete(channel)
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({'message': '频道删除成功'})
@@ -166,6 +206,7 @@ def batch_delete_channels():
         return jsonify({'error': '请提供要删除的频道 ID'}), 400
     
     Channel.query.filter(Channel.id.in_(ids)).delete(synchronize_session=False)
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({'message': f'已删除 {len(ids)} 个频道'})
@@ -187,6 +228,7 @@ def update_sort_order():
         if channel:
             channel.sort_order = item['sort_order']
     
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({'message': '排序更新成功'})
@@ -6,6 +6,7 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models.channel_group import ChannelGroup
+from app.services.channel_catalog import bump_catalog_version
 from app.utils.auth import login_required
 
 bp = Blueprint('groups', __name__, url_prefix='/api/groups')
@@ -49,6 +50,7 @@ def create_group():
     )
     
     db.session.add(group)
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({
@@ -72,6 +74,7 @@ def update_group(group_id):
     if 'sort_order' in data:
         group.sort_order = data['sort_order']
     
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({
@@ -92,6 +95,7 @@ def delete_group(group_id):
         return jsonify({'error': f'无法删除：该分组下有 {channel_count} 个频道，请先移除或修改这些频道的分组'}), 400
     
     db.session.delete(group)
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({'message': '分组删除成功'})
@@ -113,6 +117,7 @@ def update_sort_order():
         if group:
             group.sort_order = item['sort_order']
     
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({'message': '排序更新成功'})
@@ -137,6 +142,7 @@ def delete_empty_groups():
     for group in empty_groups:
         db.session.delete(group)
     
+    bump_catalog_version()
     db.session.commit()
     
     return jsonify({
@@ -38,7 +38,8 @@ def check_all():
         'message': '健康检测完成',
         'total': results['total'],
         'healthy': results['healthy'],
-        'unhealthy': results['unhealthy']
+        'unhealthy': results['unhealthy'],
+        'changed': results['changed']
     })
 
 
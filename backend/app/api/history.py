@@ -3,12 +3,17 @@
 观看历史管理 API
 """
 
-from flask import Blueprint, request, jsonify
+from datetime import datetime
+
+from flask import Blueprint, current_app, request, jsonify
 from loguru import logger
-from sqlalchemy import func, select
+from sqlalchemy import and_, func, or_, select
 from app import db
+from app.models.channel import Channel
+from app.models.users import Users
 from app.models.watch_history import WatchHistory
 from app.models.settings import Settings
+from app.services.history_cleanup import MODE_ALL, get_history_cleanup_status, start_history_cleanup
 from app.utils.auth import login_required
 from app.utils.datetime_utils import to_iso8601_utc, to_iso8601_date
 
@@ -20,33 +25,18 @@ MIN_HISTORY_DURATION_SECONDS = WatchHistory.MIN_VALID_DURATION_SECONDS
 @login_required
 def cleanup_history():
     """
-    清空已结束的观看历史
+    清空已结束的观看历史（后台分批执行，通过 /cleanup/status 查询进度）
     """
     try:
-        ended_filter = WatchHistory.end_time.isnot(None)
-
-        # 查询要删除的记录数量（仅已结束记录）
-        count_before = db.session.scalar(
-            select(func.count()).select_from(WatchHistory).where(ended_filter)
-        )
-
-        # 仅删除已结束记录
-        deleted_count = WatchHistory.query.filter(ended_filter).delete(synchronize_session=False)
-
-        db.session.commit()
-
-        count_after = db.session.scalar(
-            select(func.count()).select_from(WatchHistory).where(ended_filter)
-        )
-
-        logger.info(f"手动清空观看历史: 删除了 {deleted_count} 条已结束记录")
+        started, status = start_history_cleanup(current_app._get_current_object(), mode=MODE_ALL)
+        if not started:
+            return jsonify({'error': '已有观看历史清理任务在运行', 'status': status}), 409
 
+        logger.info("手动清空观看历史: 已启动后台分批清理")
         return jsonify({
-            'message': f'成功清空 {deleted_count} 条已结束观看历史记录',
-            'deleted_count': deleted_count,
-            'count_before': count_before,
-            'count_after': count_after
-        })
+            'message': '已开始清空已结束观看历史记录',
+            'status': status
+        }), 202
 
     except Exception as e:
         db.session.rollback()
@@ -54,53 +44,114 @@ def cleanup_history():
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/cleanup/status', methods=['GET'])
+@login_required
+def get_cleanup_status():
+    """
+    获取观看历史清理任务进度（手动清空与自动保留策略共用）
+    """
+    return jsonify({'status': get_history_cleanup_status()})
+
+
+def _encode_history_cursor(start_time, record_id):
+    """游标：上一页最后一条记录的 (start_time, id)"""
+    return f"{start_time.isoformat()}_{record_id}"
+
+
+def _decode_history_cursor(cursor):
+    """
+    解析游标
+    返回:
+        tuple: (start_time, id)，格式错误时抛出 ValueError
+    """
+    start_time_text, record_id_text = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(start_time_text), int(record_id_text)
+
+
 @bp.route('/list', methods=['GET'])
 @login_required
 def get_history_list():
     """
-    获取历史连接列表
+    获取历史连接列表（按开始时间倒序的游标分页）
     只显示已结束且观看时长 >= 5 秒的记录
+    参数:
+        cursor: 上一页返回的 next_cursor，缺省时返回第一页
+        per_page: 每页条数（1-100）
+        with_total: 为 true 时额外统计总记录数
     """
     try:
-        # 获取分页参数
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        cursor = request.args.get('cursor')
+        with_total = request.args.get('with_total', 'false').lower() == 'true'
 
-        # 查询已结束且观看时长 >= 5 秒的记录
-        query = WatchHistory.query.filter(
+        valid_filter = (
             WatchHistory.end_time.isnot(None),
             WatchHistory.duration >= MIN_HISTORY_DURATION_SECONDS
-        ).order_by(WatchHistory.start_time.desc())
-
-        # 分页
-        pagination = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
         )
 
-        # 构建返回数据
-        items = []
-        for record in pagination.items:
-            item = {
-                'id': record.id,
-                'user_id': record.user_id,
-                'username': record.user.username if record.user else '未知用户',
-                'channel_id': record.channel_id,
-                'channel_name': record.channel.name if record.channel else '已删除频道',
-                'start_time': to_iso8601_utc(record.start_time),
-                'end_time': to_iso8601_utc(record.end_time),
-                'duration': record.duration,
-                'watch_date': to_iso8601_date(record.watch_date)
+        # 一次查询带出用户名与频道名，避免逐行懒加载
+        query = db.session.query(
+            WatchHistory.id,
+            WatchHistory.user_id,
+            WatchHistory.channel_id,
+            WatchHistory.start_time,
+            WatchHistory.end_time,
+            WatchHistory.duration,
+            WatchHistory.watch_date,
+            Users.username,
+            Channel.name.label('channel_name')
+        ).outerjoin(
+            Users, Users.id == WatchHistory.user_id
+        ).outerjoin(
+            Channel, Channel.id == WatchHistory.channel_id
+        ).filter(*valid_filter)
+
+        if cursor:
+            try:
+                cursor_start_time, cursor_id = _decode_history_cursor(cursor)
+            except ValueError:
+                return jsonify({'error': '无效的分页游标'}), 400
+            query = query.filter(or_(
+                WatchHistory.start_time < cursor_start_time,
+                and_(WatchHistory.start_time == cursor_start_time, WatchHistory.id < cursor_id)
+            ))
+
+        # 多取一条判断是否还有下一页
+        rows = query.order_by(
+            WatchHistory.start_time.desc(),
+            WatchHistory.id.desc()
+        ).limit(per_page + 1).all()
+
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+
+        items = [
+            {
+                'id': row.id,
+                'user_id': row.user_id,
+                'username': row.username or '未知用户',
+                'channel_id': row.channel_id,
+                'channel_name': row.channel_name or '已删除频道',
+                'start_time': to_iso8601_utc(row.start_time),
+                'end_time': to_iso8601_utc(row.end_time),
+                'duration': row.duration,
+                'watch_date': to_iso8601_date(row.watch_date)
             }
-            items.append(item)
+            for row in rows
+        ]
+
+        total = None
+        if with_total:
+            total = db.session.scalar(
+                select(func.count()).select_from(WatchHistory).where(*valid_filter)
+            )
 
         return jsonify({
             'items': items,
-            'total': pagination.total,
-            'page': page,
             'per_page': per_page,
-            'pages': pagination.pages
+            'has_more': has_more,
+            'next_cursor': _encode_history_cursor(rows[-1].start_time, rows[-1].id) if has_more else None,
+            'total': total
         })
 
     except Exception as e:
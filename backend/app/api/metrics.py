@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus 指标 API
+"""
+
+import hmac
+
+from flask import Blueprint, Response, jsonify, request
+
+from app.config import get_metrics_enabled, get_metrics_token
+from app.services.metrics import render_latest
+from app.utils.auth import login_required
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics', methods=['GET'])
+@bp.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """
+    输出 Prometheus 文本格式指标
+    配置 METRICS_TOKEN 时需携带该 Bearer Token，未配置时需携带登录令牌（指标不对匿名请求开放）
+    """
+    if not get_metrics_enabled():
+        return jsonify({'error': '指标接口未启用'}), 404
+
+    expected_token = get_metrics_token()
+    if not expected_token:
+        return login_required(_render_metrics)()
+
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header[7:].strip() if auth_header.startswith('Bearer ') else ''
+    if not hmac.compare_digest(token.encode('utf-8'), expected_token.encode('utf-8')):
+        return jsonify({'error': '指标访问令牌无效'}), 401
+    return _render_metrics()
+
+
+def _render_metrics():
+    body, content_type = render_latest()
+    return Response(body, content_type=content_type)
@@ -3,169 +3,183 @@
 流代理 API
 """
 
-import requests
-import uuid
-from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask import Blueprint, current_app, request, jsonify, Response
 from loguru import logger
 from sqlalchemy import select
 from app import db
 from app.models.users import Users
 from app.models.channel import Channel
-from app.models.watch_history import WatchHistory
 from app.models.active_connection import ActiveConnection
-from app.config import get_heartbeat_interval_seconds
+from app.utils import http_pool
 from app.utils.auth import login_required
 from app.utils.datetime_utils import to_iso8601_utc, to_utc_naive
-from app.services.watch_history_saver import update_connection_heartbeat, close_active_connection
+from app.services.heartbeat_aggregator import heartbeat_aggregator
+from app.services.metrics import StreamMeter
+from app.services.stream_session import (
+    StreamSessionError,
+    open_stream_session,
+    close_stream_session,
+    resume_stream_session
+)
+from app.services.stream_auth import credentials_from_hls_query, credentials_from_stream_query, hls_query_params
+from app.services.stream_relay import relay_hub
+from app.services.segment_cache import segment_cache
+from app.services.token_cache import get_token_cache_stats
+from app.services.channel_catalog import get_catalog_stats
+from app.services.playlist_cache import get_playlist_cache_stats
+from app.services.host_breaker import ensure_sync_started, get_host_breaker_stats
+from app.services import hls_proxy
 
 bp = Blueprint('proxy', __name__, url_prefix='/api/proxy')
 
 
-def get_udpxy_url(original_url):
-    """将组播地址转换为 UDPxy 地址"""
-    from app.config import get_udpxy_enabled, get_udpxy_url as get_udpxy_url_config
+@bp.route('/stream/<int:channel_id>', methods=['GET'])
+def stream_channel(channel_id):
+    """代理转发频道流"""
+    try:
+        session = open_stream_session(credentials_from_stream_query(request.args), channel_id)
+    except StreamSessionError as e:
+        return jsonify({'error': e.message}), e.status_code
 
-    if not get_udpxy_enabled():
-        return None
+    connection_id = session['connection_id']
+    stream_url = session['stream_url']
+    app = current_app._get_current_object()
+    heartbeat_aggregator.ensure_started(app)
+    ensure_sync_started(app)
 
-    udpxy_base = get_udpxy_url_config().rstrip('/')
-    
-    # 解析 rtp:// 或 udp:// 地址
-    # 格式: rtp://239.0.0.1:5000 或 udp://@239.0.0.1:5000
-    if original_url.startswith('rtp://'):
-        addr = original_url[6:]  # 移除 rtp://
-    elif original_url.startswith('udp://'):
-        addr = original_url[6:]  # 移除 udp://
-        if addr.startswith('@'):
-            addr = addr[1:]  # 移除 @
-    else:
-        return None
-    
-    # UDPxy URL 格式: http://udpxy:port/udp/239.0.0.1:5000
-    return f"{udpxy_base}/udp/{addr}"
+    # m3u8 源改写播放列表，分片经代理与分片缓存获取
+    if hls_proxy.is_hls_url(stream_url) or hls_proxy.is_hls_content_type(session['content_type']):
+        return _hls_entry_response(session)
 
+    # 会话已创建，后续只在短生命周期的 app context 中访问数据库：
+    # 观看期间（可能数小时）不占用作用域会话与连接池连接
+    db.session.remove()
 
-@bp.route('/stream/<int:channel_id>', methods=['GET'])
-def stream_channel(channel_id):
-    """代理转发频道流"""
-    token = request.args.get('token')
-    
-    if not token:
-        return jsonify({'error': '缺少 Token'}), 401
-    
-    user = Users.query.filter_by(token=token).first()
-    if not user:
-        return jsonify({'error': 'Token 无效'}), 401
-
-    # 使用 SQLAlchemy 2.0 兼容的方式
-    channel = db.session.get(Channel, channel_id)
-    if not channel:
-        return jsonify({'error': '频道不存在'}), 404
-    
-    if not channel.is_active:
-        return jsonify({'error': '频道未启用'}), 403
-    
-    # 获取实际的流地址
-    stream_url = channel.url
-    
-    # 如果是组播源，通过 UDPxy 转换
-    if channel.is_multicast():
-        udpxy_url = get_udpxy_url(channel.url)
-        if udpxy_url:
-            stream_url = udpxy_url
-            logger.info(f"组播源转换: {channel.url} -> {stream_url}")
-        else:
-            return jsonify({'error': 'UDPxy 未配置，无法播放组播源'}), 500
-    else:
-        logger.debug(f"HTTP 源: {stream_url}")
-    
-    # 创建观看记录 + 活跃连接（同事务）
-    connection_id = f"{user.id}_{channel_id}_{uuid.uuid4().hex}"
-    start_time_utc = to_utc_naive()
-    watch_record_id = None
+    # 同频道观众共享一路上游，由 relay_hub 负责拉流与释放
+    subscription = relay_hub.subscribe(channel_id, session['stream_urls'])
 
-    try:
-        watch_record = WatchHistory(user_id=user.id, channel_id=channel.id, start_time=start_time_utc)
-        db.session.add(watch_record)
-        db.session.flush()
-        watch_record_id = watch_record.id
-
-        active_connection = ActiveConnection(
-            connection_id=connection_id,
-            watch_history_id=watch_record_id,
-            user_id=user.id,
-            channel_id=channel.id,
-            start_time=start_time_utc,
-            last_heartbeat=start_time_utc
-        )
-        db.session.add(active_connection)
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"创建活跃连接失败: user_id={user.id}, channel_id={channel.id}, error={e}")
-        return jsonify({'error': '创建观看会话失败'}), 500
-
-    username = user.username
-    channel_name = channel.name
-    heartbeat_interval = get_heartbeat_interval_seconds()
-    last_heartbeat_at = start_time_utc
-    
     def generate():
-        nonlocal last_heartbeat_at, heartbeat_interval
+        meter = StreamMeter(channel_id, session['user_id'])
         try:
-            # 从配置获取缓冲区大小（优先从数据库读取）
-            from app.config import get_proxy_buffer_size
-            buffer_size = get_proxy_buffer_size()
-
-            with requests.get(stream_url, stream=True, timeout=30) as r:
-                r.raise_for_status()
-                for chunk in r.iter_content(chunk_size=buffer_size):
-                    now_utc = to_utc_naive()
-                    if (now_utc - last_heartbeat_at).total_seconds() >= heartbeat_interval:
-                        update_connection_heartbeat(connection_id, heartbeat_time=now_utc)
-                        last_heartbeat_at = now_utc
-                        heartbeat_interval = get_heartbeat_interval_seconds()
-
-                    if chunk:
-                        yield chunk
+            for chunk in subscription:
+                # 心跳仅写入进程内聚合器，由后台线程按心跳间隔批量落库
+                heartbeat_aggregator.record(connection_id, to_utc_naive())
+                meter.add(len(chunk))
+                yield chunk
         except Exception as e:
             logger.error(f"Stream error: {e}")
         finally:
-            # 幂等结束连接：落历史 + 删除活跃连接
-            try:
-                result = close_active_connection(
-                    connection_id=connection_id,
-                    end_time=to_utc_naive(),
-                    fallback_watch_history_id=watch_record_id
-                )
-                if result.get('history_updated'):
-                    logger.debug(
-                        f"观看记录保存: 用户 {username}, 频道 {channel_name}, 时长 {result.get('duration', 0)}秒"
-                    )
-                elif result.get('history_deleted_short'):
-                    logger.debug(
-                        f"观看记录已忽略(<5秒): 用户 {username}, 频道 {channel_name}, 时长 {result.get('duration', 0)}秒"
-                    )
-            except Exception as e:
-                logger.error(f"保存观看记录失败: connection_id={connection_id}, error={e}")
-    
-    # 获取原始响应的 Content-Type（失败时回退默认值）
-    content_type = 'video/mp2t'
+            meter.close()
+            subscription.close()
+            # 幂等结束连接：落历史 + 删除活跃连接（请求上下文此时已结束）
+            _close_stream_session_detached(app, session)
+
+    # Content-Type 优先取已学到的类型（本进程缓存或健康检测写入的频道字段）；未知时沿用本次真实拉流的响应头，不再单独 HEAD 探测
+    content_type = session['content_type'] or subscription.wait_content_type()
+    if content_type is None:
+        subscription.close()
+        _close_stream_session_detached(app, session)
+        return jsonify({'error': '上游连接失败'}), 502
+
+    if hls_proxy.is_hls_content_type(content_type):
+        # 地址无 .m3u8 后缀但上游实际返回播放列表，改走 HLS 代理
+        subscription.close()
+        return _hls_entry_response(session)
+
+    # 不使用 stream_with_context：生成器在请求上下文结束后运行，不再持有数据库会话
+    response = Response(generate(), mimetype=content_type)
+    # 客户端在首个数据块前断开时生成器不会执行，确保仍释放共享上游
+    response.call_on_close(subscription.close)
+    return response
+
+
+def _close_stream_session_detached(app, session):
+    """在独立 app context 中结束观看会话，用完即释放数据库会话"""
+    with app.app_context():
+        close_stream_session(session)
+
+
+def _hls_playlist_response(body):
+    response = Response(body, mimetype=hls_proxy.HLS_CONTENT_TYPE)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _hls_entry_response(session):
+    """返回频道入口播放列表；上游不可用时结束刚创建的观看会话"""
+    try:
+        body = hls_proxy.render_channel_playlist(
+            session['channel_id'],
+            session['stream_url'],
+            session['auth_params'],
+            session['connection_id']
+        )
+    except hls_proxy.HlsProxyError as e:
+        logger.error(f"HLS 入口播放列表获取失败: channel_id={session['channel_id']}, error={e.message}")
+        close_stream_session(session)
+        return jsonify({'error': '上游连接失败'}), e.status_code
+    return _hls_playlist_response(body)
+
+
+def _resolve_hls_request(channel_id, recreate):
+    """
+    校验 HLS 子请求的会话与签名，并记录心跳
+    返回:
+        tuple: (upstream_url, error_response)
+    """
+    credentials = credentials_from_hls_query(request.args)
+    try:
+        connection_id = resume_stream_session(credentials, channel_id, request.args.get('sid'), recreate=recreate)
+    except StreamSessionError as e:
+        return None, (jsonify({'error': e.message}), e.status_code)
+
+    upstream_url = hls_proxy.decode_upstream_url(channel_id, request.args.get('u'), request.args.get('sig'))
+    if upstream_url is None:
+        return None, (jsonify({'error': '签名无效'}), 403)
+
+    heartbeat_aggregator.ensure_started(current_app._get_current_object())
+    heartbeat_aggregator.record(connection_id, to_utc_naive())
+    return upstream_url, None
+
+
+@bp.route('/hls/<int:channel_id>/playlist', methods=['GET'])
+def hls_playlist(channel_id):
+    """代理 HLS 子播放列表（播放器周期刷新，同时续期观看会话）"""
+    upstream_url, error_response = _resolve_hls_request(channel_id, recreate=True)
+    if error_response is not None:
+        return error_response
+
+    try:
+        body = hls_proxy.render_proxied_playlist(
+            channel_id,
+            upstream_url,
+            hls_query_params(credentials_from_hls_query(request.args)),
+            request.args.get('sid')
+        )
+    except hls_proxy.HlsProxyError as e:
+        logger.error(f"HLS 播放列表获取失败: channel_id={channel_id}, error={e.message}")
+        return jsonify({'error': '上游连接失败'}), e.status_code
+    return _hls_playlist_response(body)
+
+
+@bp.route('/hls/<int:channel_id>/segment', methods=['GET'])
+def hls_segment(channel_id):
+    """代理 HLS 分片（经 LRU 分片缓存）"""
+    upstream_url, error_response = _resolve_hls_request(channel_id, recreate=False)
+    if error_response is not None:
+        return error_response
+
+    # 分片回源期间不占用数据库连接
+    db.session.remove()
     try:
-        head_response = requests.head(stream_url, timeout=10, allow_redirects=True)
-        if head_response.ok:
-            content_type = head_response.headers.get('Content-Type', content_type)
-        else:
-            logger.warning(
-                f"探测 Content-Type 失败: url={stream_url}, status={head_response.status_code}"
-            )
-    except requests.RequestException as e:
-        logger.warning(f"探测 Content-Type 异常: url={stream_url}, error={e}")
-    
-    return Response(
-        stream_with_context(generate()),
-        mimetype=content_type
-    )
+        content, content_type, cache_hit = hls_proxy.fetch_segment(upstream_url)
+    except hls_proxy.HlsProxyError as e:
+        logger.error(f"HLS 分片获取失败: channel_id={channel_id}, error={e.message}")
+        return jsonify({'error': '上游连接失败'}), e.status_code
+
+    response = Response(content, mimetype=content_type)
+    response.headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+    return response
 
 
 @bp.route('/status', methods=['GET'])
@@ -211,5 +225,13 @@ def get_proxy_status():
 
     return jsonify({
         'active_connections': len(connections),
-        'connections': connections
+        'connections': connections,
+        'relays': relay_hub.get_stats(),
+        'heartbeat': heartbeat_aggregator.get_stats(),
+        'upstream_pool': http_pool.get_pool_stats(),
+        'hls_cache': segment_cache.get_stats(),
+        'token_cache': get_token_cache_stats(),
+        'channel_catalog': get_catalog_stats(),
+        'playlist_cache': get_playlist_cache_stats(),
+        'upstream_breaker': get_host_breaker_stats()
     })
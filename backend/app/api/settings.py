@@ -8,6 +8,7 @@ from flask import Blueprint, request, jsonify
 from loguru import logger
 from urllib.parse import SplitResult, urlsplit, urlunsplit
 from app.models.settings import Settings
+from app.utils import http_pool
 from app.utils.auth import login_required
 
 bp = Blueprint('settings', __name__, url_prefix='/api/settings')
@@ -108,7 +109,7 @@ def _probe_udpxy(base_url: str, timeout: int = 5):
 
     for target_url in probe_urls:
         try:
-            response = requests.get(target_url, timeout=timeout, allow_redirects=True)
+            response = http_pool.get(target_url, timeout=timeout, allow_redirects=True)
             attempts.append({'url': target_url, 'status_code': response.status_code})
             if 200 <= response.status_code < 400:
                 return True, target_url, response.status_code, attempts
@@ -3,104 +3,64 @@
 订阅链接 API
 """
 
+from datetime import datetime, timezone
+
 from flask import Blueprint, request, jsonify, Response
-from app.models.users import Users
-from app.models.channel import Channel
 from app.models.settings import Settings
+from app.services.playlist_cache import FORMAT_M3U, FORMAT_TXT, get_gzip_body, get_playlist
+from app.services.token_cache import get_token_user
+from app.utils.text_stream import accepts_gzip, iter_text_chunks, text_response
 from app.utils.auth import login_required, get_current_user
 
 bp = Blueprint('subscription', __name__, url_prefix='/api/subscription')
 
 
-def get_stream_url(channel_id, token, request_obj):
-    """生成流代理 URL"""
-    host = request_obj.host_url.rstrip('/')
-    return f"{host}/api/proxy/stream/{channel_id}?token={token}"
-
-
-def get_sorted_active_channels():
-    """按频道排序字段获取启用频道（与频道管理列表保持一致）"""
-    return Channel.query.filter_by(is_active=True).order_by(Channel.sort_order, Channel.id).all()
-
-
-@bp.route('/m3u', methods=['GET'])
-def get_m3u():
-    """获取 M3U 格式订阅链接"""
+def _playlist_response(fmt, mimetype, filename):
+    """
+    生成订阅内容响应（播放地址按启用签名地址与否携带签名参数或订阅 Token）
+    支持 If-None-Match 条件请求，内容未变化时返回 304；客户端接受 gzip 时返回压缩内容
+    """
     token = request.args.get('token')
     
     if not token:
         return jsonify({'error': '缺少 Token'}), 401
     
-    user = Users.query.filter_by(token=token).first()
-    if not user:
+    user = get_token_user(token)
+    if user is None:
         return jsonify({'error': 'Token 无效'}), 401
     
-    # 获取 EPG URL
-    epg_url = Settings.get(Settings.KEY_EPG_URL, '')
-    
-    # 构建 M3U 内容
-    lines = []
-    if epg_url:
-        lines.append(f'#EXTM3U x-tvg-url="{epg_url}"')
+    epg_url = Settings.get(Settings.KEY_EPG_URL, '') if fmt == FORMAT_M3U else ''
+    playlist = get_playlist(fmt, request.host_url.rstrip('/'), epg_url, user.id, token)
+
+    compress = accepts_gzip(request)
+    # 压缩与未压缩内容使用不同的 ETag
+    etag = f'{playlist.etag}-gzip' if compress else playlist.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.vary.add('Accept-Encoding')
+    elif compress:
+        response = text_response(get_gzip_body(playlist), mimetype, filename, gzipped=True)
     else:
-        lines.append('#EXTM3U')
-    
-    # 按频道排序顺序输出，避免被分组循环打乱
-    channels = get_sorted_active_channels()
-    for channel in channels:
-        stream_url = get_stream_url(channel.id, token, request)
-        tvg_id_part = f' tvg-id="{channel.tvg_id}"' if channel.tvg_id else ''
-        logo_part = f' tvg-logo="{channel.logo}"' if channel.logo else ''
-        group_part = f' group-title="{channel.group.name}"' if channel.group else ''
-        lines.append(f'#EXTINF:-1{tvg_id_part} tvg-name="{channel.name}"{logo_part}{group_part},{channel.name}')
-        lines.append(stream_url)
-    
-    content = '\n'.join(lines)
-    
-    return Response(
-        content,
-        mimetype='audio/x-mpegurl',
-        headers={
-            'Content-Disposition': 'attachment; filename="playlist.m3u"'
-        }
-    )
+        response = text_response(iter_text_chunks(playlist.iter_pieces()), mimetype, filename)
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(int(playlist.last_modified), tz=timezone.utc)
+    # 内容包含订阅 Token，只允许客户端缓存，每次使用前重新校验
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/m3u', methods=['GET'])
+def get_m3u():
+    """获取 M3U 格式订阅链接"""
+    return _playlist_response(FORMAT_M3U, 'audio/x-mpegurl', 'playlist.m3u')
 
 
 @bp.route('/txt', methods=['GET'])
 def get_txt():
     """获取 TXT 格式订阅链接"""
-    token = request.args.get('token')
-    
-    if not token:
-        return jsonify({'error': '缺少 Token'}), 401
-    
-    user = Users.query.filter_by(token=token).first()
-    if not user:
-        return jsonify({'error': 'Token 无效'}), 401
-    
-    lines = []
-    
-    channels = get_sorted_active_channels()
-
-    current_group_name = None
-    for channel in channels:
-        group_name = channel.group.name if channel.group else '未分组'
-        if group_name != current_group_name:
-            lines.append(f'{group_name},#genre#')
-            current_group_name = group_name
-
-        stream_url = get_stream_url(channel.id, token, request)
-        lines.append(f'{channel.name},{stream_url}')
-    
-    content = '\n'.join(lines)
-    
-    return Response(
-        content,
-        mimetype='text/plain; charset=utf-8',
-        headers={
-            'Content-Disposition': 'attachment; filename="playlist.txt"'
-        }
-    )
+    return _playlist_response(FORMAT_TXT, 'text/plain; charset=utf-8', 'playlist.txt')
 
 
 @bp.route('/urls', methods=['GET'])
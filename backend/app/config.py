@@ -41,20 +41,80 @@ def load_config():
             'enabled': os.getenv('UDPXY_ENABLED', 'false').lower() == 'true',
             'url': os.getenv('UDPXY_URL', 'http://localhost:3680')
         },
+        'multicast': {
+            'native_enabled': os.getenv('MULTICAST_NATIVE_ENABLED', 'false').lower() == 'true',
+            'interface': os.getenv('MULTICAST_INTERFACE', '0.0.0.0'),
+            'jitter_packets': int(os.getenv('MULTICAST_JITTER_PACKETS', 32))
+        },
         'health_check': {
             'enabled': os.getenv('HEALTH_CHECK_ENABLED', 'true').lower() == 'true',
             'interval': int(os.getenv('HEALTH_CHECK_INTERVAL', 1800)),
             'timeout': int(os.getenv('HEALTH_CHECK_TIMEOUT', 10)),
             'max_retries': int(os.getenv('HEALTH_CHECK_MAX_RETRIES', 1)),
-            'threads': int(os.getenv('HEALTH_CHECK_THREADS', 3))
+            'threads': int(os.getenv('HEALTH_CHECK_THREADS', 3)),
+            'engine': os.getenv('HEALTH_CHECK_ENGINE', 'async').lower(),
+            'concurrency': int(os.getenv('HEALTH_CHECK_CONCURRENCY', 200)),
+            'adaptive': os.getenv('HEALTH_CHECK_ADAPTIVE', 'true').lower() == 'true',
+            'poll_seconds': int(os.getenv('HEALTH_CHECK_POLL_SECONDS', 30)),
+            'min_interval': int(os.getenv('HEALTH_CHECK_MIN_INTERVAL', 60)),
+            'max_interval': int(os.getenv('HEALTH_CHECK_MAX_INTERVAL', 7200)),
+            'batch_size': int(os.getenv('HEALTH_CHECK_BATCH_SIZE', 1000)),
+            'host_concurrency': int(os.getenv('HEALTH_CHECK_HOST_CONCURRENCY', 8)),
+            'deep_probe': os.getenv('HEALTH_CHECK_DEEP_PROBE', 'false').lower() == 'true',
+            'deep_sample_seconds': float(os.getenv('HEALTH_CHECK_DEEP_SAMPLE_SECONDS', 2)),
+            'deep_sample_kb': int(os.getenv('HEALTH_CHECK_DEEP_SAMPLE_KB', 512))
         },
         'proxy': {
-            'buffer_size': int(os.getenv('PROXY_BUFFER_SIZE', 8192))
+            'buffer_size': int(os.getenv('PROXY_BUFFER_SIZE', 8192)),
+            'relay_buffer_chunks': int(os.getenv('PROXY_RELAY_BUFFER_CHUNKS', 256)),
+            'relay_linger_seconds': int(os.getenv('PROXY_RELAY_LINGER_SECONDS', 5)),
+            'content_type_ttl_seconds': int(os.getenv('PROXY_CONTENT_TYPE_TTL_SECONDS', 3600)),
+            'start_buffer_enabled': os.getenv('PROXY_START_BUFFER_ENABLED', 'true').lower() == 'true',
+            'start_buffer_max_kb': int(os.getenv('PROXY_START_BUFFER_MAX_KB', 4096)),
+            'failover_stall_ms': int(os.getenv('PROXY_FAILOVER_STALL_MS', 3000))
+        },
+        'hls': {
+            'segment_cache_memory_mb': int(os.getenv('HLS_SEGMENT_CACHE_MEMORY_MB', 64)),
+            'segment_cache_dir': os.getenv('HLS_SEGMENT_CACHE_DIR', ''),
+            'segment_cache_disk_mb': int(os.getenv('HLS_SEGMENT_CACHE_DISK_MB', 512)),
+            'playlist_cache_seconds': float(os.getenv('HLS_PLAYLIST_CACHE_SECONDS', 1))
+        },
+        'upstream_pool': {
+            'maxsize': int(os.getenv('UPSTREAM_POOL_MAXSIZE', 32)),
+            'host_sizes': os.getenv('UPSTREAM_POOL_HOST_SIZES', '')
+        },
+        'upstream_breaker': {
+            'enabled': os.getenv('UPSTREAM_BREAKER_ENABLED', 'true').lower() == 'true',
+            'failure_threshold': int(os.getenv('UPSTREAM_BREAKER_FAILURE_THRESHOLD', 5)),
+            'open_seconds': int(os.getenv('UPSTREAM_BREAKER_OPEN_SECONDS', 30))
+        },
+        'stream_server': {
+            'host': os.getenv('STREAM_SERVER_HOST', '0.0.0.0'),
+            'port': int(os.getenv('STREAM_SERVER_PORT', 5001)),
+            'db_threads': int(os.getenv('STREAM_SERVER_DB_THREADS', 8))
+        },
+        'stream_auth': {
+            'signed_urls_enabled': os.getenv('SIGNED_STREAM_URLS_ENABLED', 'false').lower() == 'true',
+            'signed_url_ttl_hours': int(os.getenv('SIGNED_STREAM_URL_TTL_HOURS', 168))
+        },
+        'token_cache': {
+            'ttl_seconds': int(os.getenv('TOKEN_CACHE_TTL_SECONDS', 60)),
+            'max_entries': int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', 1024))
+        },
+        'metrics': {
+            'enabled': os.getenv('METRICS_ENABLED', 'true').lower() == 'true',
+            'token': os.getenv('METRICS_TOKEN', ''),
+            'multiproc_dir': os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
         },
         'watch_history': {
             'heartbeat_interval_seconds': int(os.getenv('HEARTBEAT_INTERVAL_SECONDS', 10)),
             'active_heartbeat_timeout_seconds': int(os.getenv('ACTIVE_HEARTBEAT_TIMEOUT_SECONDS', 45)),
-            'history_worker_interval_seconds': int(os.getenv('HISTORY_WORKER_INTERVAL_SECONDS', 15))
+            'history_worker_interval_seconds': int(os.getenv('HISTORY_WORKER_INTERVAL_SECONDS', 15)),
+            'retention_enabled': os.getenv('HISTORY_RETENTION_ENABLED', 'false').lower() == 'true',
+            'retention_days': int(os.getenv('HISTORY_RETENTION_DAYS', 30)),
+            'retention_interval_seconds': int(os.getenv('HISTORY_RETENTION_INTERVAL_SECONDS', 3600)),
+            'cleanup_batch_size': int(os.getenv('HISTORY_CLEANUP_BATCH_SIZE', 500)),
+            'cleanup_batch_pause_ms': int(os.getenv('HISTORY_CLEANUP_BATCH_PAUSE_MS', 50))
         }
     }
 
@@ -120,6 +180,12 @@ def load_runtime_config_from_db():
             _runtime_config['udpxy_url'] = udpxy_url
             logger.info(f"从数据库加载配置: udpxy_url={udpxy_url}")
 
+        # 加载内置组播转发启用状态
+        multicast_native_enabled = Settings.get('multicast_native_enabled')
+        if multicast_native_enabled is not None:
+            _runtime_config['multicast_native_enabled'] = multicast_native_enabled.lower() == 'true'
+            logger.info(f"从数据库加载配置: multicast_native_enabled={multicast_native_enabled}")
+
         # 加载播放心跳间隔
         heartbeat_interval_seconds = Settings.get('heartbeat_interval_seconds')
         if heartbeat_interval_seconds is not None:
@@ -150,6 +216,16 @@ def load_runtime_config_from_db():
             _runtime_config['history_worker_interval_seconds'] = parsed_value
             logger.info(f"从数据库加载配置: history_worker_interval_seconds={parsed_value}")
 
+        # 加载观看历史保留天数
+        watch_history_retention_days = Settings.get('watch_history_retention_days')
+        if watch_history_retention_days is not None:
+            parsed_value = _parse_positive_int(
+                watch_history_retention_days,
+                config.get('watch_history', {}).get('retention_days', 30)
+            )
+            _runtime_config['watch_history_retention_days'] = parsed_value
+            logger.info(f"从数据库加载配置: watch_history_retention_days={parsed_value}")
+
         return True
     except Exception as e:
         logger.error(f"加载运行时配置失败: {e}")
@@ -165,6 +241,81 @@ def get_proxy_buffer_size():
     # 否则使用环境变量默认值
     return config.get('proxy', {}).get('buffer_size', 8192)
 
+def get_proxy_relay_buffer_chunks():
+    """获取共享转发环形缓冲区可保留的数据块数量"""
+    return max(1, int(config.get('proxy', {}).get('relay_buffer_chunks', 256)))
+
+def get_proxy_relay_linger_seconds():
+    """获取最后一位观众离开后上游保留时间（秒，0 表示立即关闭）"""
+    return max(0, int(config.get('proxy', {}).get('relay_linger_seconds', 5)))
+
+def get_proxy_content_type_ttl_seconds():
+    """获取频道 Content-Type 缓存有效期（秒）"""
+    return max(1, int(config.get('proxy', {}).get('content_type_ttl_seconds', 3600)))
+
+def get_proxy_start_buffer_enabled():
+    """是否为共享上游保留关键帧起播缓冲"""
+    return bool(config.get('proxy', {}).get('start_buffer_enabled', True))
+
+def get_proxy_start_buffer_max_bytes():
+    """获取起播缓冲上限（字节），GOP 超过该大小时不提供起播数据"""
+    return _parse_positive_int(config.get('proxy', {}).get('start_buffer_max_kb'), 4096) * 1024
+
+def get_proxy_failover_stall_seconds():
+    """获取上游停滞判定时间（秒）：超过该时间未收到数据即切换到下一个源"""
+    return _parse_positive_int(config.get('proxy', {}).get('failover_stall_ms'), 3000) / 1000
+
+def get_hls_segment_cache_memory_bytes():
+    """获取 HLS 分片内存缓存上限（字节）"""
+    return max(0, int(config.get('hls', {}).get('segment_cache_memory_mb', 64))) * 1024 * 1024
+
+def get_hls_segment_cache_dir():
+    """获取 HLS 分片磁盘缓存目录（为空表示不启用磁盘层）"""
+    cache_dir = config.get('hls', {}).get('segment_cache_dir') or ''
+    if cache_dir and not os.path.isabs(cache_dir):
+        cache_dir = os.path.join(BASE_DIR, cache_dir)
+    return cache_dir
+
+def get_hls_segment_cache_disk_bytes():
+    """获取 HLS 分片磁盘缓存上限（字节）"""
+    return max(0, int(config.get('hls', {}).get('segment_cache_disk_mb', 512))) * 1024 * 1024
+
+def get_hls_playlist_cache_seconds():
+    """获取上游播放列表短缓存时间（秒）"""
+    return max(0.0, float(config.get('hls', {}).get('playlist_cache_seconds', 1)))
+
+def get_upstream_pool_maxsize():
+    """获取上游连接池默认每主机连接数"""
+    return max(1, int(config.get('upstream_pool', {}).get('maxsize', 32)))
+
+def get_upstream_pool_host_sizes():
+    """
+    获取按主机单独配置的连接池大小
+    格式: host1=20,host2:8080=5
+    """
+    host_sizes = {}
+    raw_value = config.get('upstream_pool', {}).get('host_sizes', '') or ''
+    for item in raw_value.split(','):
+        host, _, size = item.strip().rpartition('=')
+        if not host:
+            continue
+        parsed_size = _parse_positive_int(size, None)
+        if parsed_size:
+            host_sizes[host.strip().lower()] = parsed_size
+    return host_sizes
+
+def get_upstream_breaker_enabled():
+    """获取是否启用上游主机熔断"""
+    return config.get('upstream_breaker', {}).get('enabled', True)
+
+def get_upstream_breaker_failure_threshold():
+    """获取触发主机熔断的连续失败次数"""
+    return _parse_positive_int(config.get('upstream_breaker', {}).get('failure_threshold', 5), 5)
+
+def get_upstream_breaker_open_seconds():
+    """获取主机熔断后放行半开探测前的等待时间（秒）"""
+    return _parse_positive_int(config.get('upstream_breaker', {}).get('open_seconds', 30), 30)
+
 def get_health_check_timeout():
     """获取健康检测超时时间（优先从运行时配置读取）"""
     runtime_value = get_runtime_config('health_check_timeout')
@@ -186,6 +337,56 @@ def get_health_check_threads():
         return runtime_value
     return config.get('health_check', {}).get('threads', 3)
 
+def get_health_check_interval_seconds():
+    """获取健康检测间隔（秒）：全量检测周期，自适应调度下为健康频道的基础检测间隔"""
+    return _parse_positive_int(config.get('health_check', {}).get('interval', 1800), 1800)
+
+def get_health_check_adaptive_enabled():
+    """获取是否按频道自适应调度健康检测（关闭时 worker 每个间隔全量检测一次）"""
+    return config.get('health_check', {}).get('adaptive', True)
+
+def get_health_check_poll_seconds():
+    """获取自适应调度下 worker 拉取到期频道的周期（秒）"""
+    return _parse_positive_int(config.get('health_check', {}).get('poll_seconds', 30), 30)
+
+def get_health_check_min_interval_seconds():
+    """获取检测失败频道的最短重检间隔（秒）"""
+    return _parse_positive_int(config.get('health_check', {}).get('min_interval', 60), 60)
+
+def get_health_check_max_interval_seconds():
+    """获取持续健康频道的最长检测间隔（秒）"""
+    return _parse_positive_int(config.get('health_check', {}).get('max_interval', 7200), 7200)
+
+def get_health_check_batch_size():
+    """获取自适应调度下每个轮询周期最多检测的频道数"""
+    return _parse_positive_int(config.get('health_check', {}).get('batch_size', 1000), 1000)
+
+def get_health_check_host_concurrency():
+    """获取健康检测对同一主机（含 UDPxy）同时进行的探测数上限"""
+    return _parse_positive_int(config.get('health_check', {}).get('host_concurrency', 8), 8)
+
+def get_health_check_deep_probe_enabled():
+    """获取是否启用深度探测（读取码流样本检查 TS 同步、PAT/PMT、CC 错误与 PCR，并测量码率）"""
+    return config.get('health_check', {}).get('deep_probe', False)
+
+def get_health_check_deep_sample_seconds():
+    """获取深度探测自首字节起的最长采样时长（秒）"""
+    value = float(config.get('health_check', {}).get('deep_sample_seconds', 2))
+    return value if value > 0 else 2.0
+
+def get_health_check_deep_sample_bytes():
+    """获取深度探测的最大采样字节数"""
+    return _parse_positive_int(config.get('health_check', {}).get('deep_sample_kb', 512), 512) * 1024
+
+def get_health_check_engine():
+    """获取批量健康检测引擎：async（事件循环并发探测）或 thread（线程池）"""
+    engine = config.get('health_check', {}).get('engine', 'async')
+    return engine if engine in ('async', 'thread') else 'async'
+
+def get_health_check_concurrency():
+    """获取 async 引擎同时进行的探测数上限"""
+    return _parse_positive_int(config.get('health_check', {}).get('concurrency', 200), 200)
+
 def get_udpxy_enabled():
     """获取 UDPxy 启用状态（优先从运行时配置读取）"""
     runtime_value = get_runtime_config('udpxy_enabled')
@@ -200,6 +401,21 @@ def get_udpxy_url():
         return runtime_value
     return config.get('udpxy', {}).get('url', 'http://localhost:4022')
 
+def get_multicast_native_enabled():
+    """获取内置组播转发启用状态（优先从运行时配置读取）"""
+    runtime_value = get_runtime_config('multicast_native_enabled')
+    if runtime_value is not None:
+        return runtime_value
+    return config.get('multicast', {}).get('native_enabled', False)
+
+def get_multicast_interface():
+    """获取加入组播组使用的本机网卡地址"""
+    return config.get('multicast', {}).get('interface') or '0.0.0.0'
+
+def get_multicast_jitter_packets():
+    """获取 RTP 抖动缓冲包数"""
+    return _parse_positive_int(config.get('multicast', {}).get('jitter_packets'), 32)
+
 
 def get_heartbeat_interval_seconds():
     """获取播放心跳间隔（秒，优先运行时配置）"""
@@ -224,5 +440,70 @@ def get_history_worker_interval_seconds():
         return runtime_value
     return max(1, int(config.get('watch_history', {}).get('history_worker_interval_seconds', 15)))
 
+
+def get_signed_stream_urls_enabled():
+    """订阅中的播放地址是否使用签名参数（u/exp/sig）代替订阅 Token"""
+    return bool(config.get('stream_auth', {}).get('signed_urls_enabled', False))
+
+
+def get_signed_stream_url_ttl_seconds():
+    """获取签名播放地址有效期（秒）"""
+    return _parse_positive_int(config.get('stream_auth', {}).get('signed_url_ttl_hours'), 168) * 3600
+
+
+def get_token_cache_ttl_seconds():
+    """获取订阅 Token 缓存有效期（秒，0 表示不缓存）"""
+    return max(0, int(config.get('token_cache', {}).get('ttl_seconds', 60)))
+
+
+def get_token_cache_max_entries():
+    """获取订阅 Token 缓存条目上限"""
+    return _parse_positive_int(config.get('token_cache', {}).get('max_entries'), 1024)
+
+
+def get_metrics_enabled():
+    """是否提供 /metrics 指标接口"""
+    return bool(config.get('metrics', {}).get('enabled', True))
+
+
+def get_metrics_token():
+    """获取 /metrics 访问令牌（为空表示不校验）"""
+    return config.get('metrics', {}).get('token') or ''
+
+
+def get_metrics_multiproc_dir():
+    """获取多进程指标目录（为空表示仅统计当前进程）"""
+    multiproc_dir = config.get('metrics', {}).get('multiproc_dir') or ''
+    if multiproc_dir and not os.path.isabs(multiproc_dir):
+        multiproc_dir = os.path.join(BASE_DIR, multiproc_dir)
+    return multiproc_dir
+
+def get_history_retention_enabled():
+    """是否由 worker 按保留天数自动清理观看历史"""
+    return bool(config.get('watch_history', {}).get('retention_enabled', False))
+
+
+def get_history_retention_days():
+    """获取观看历史保留天数（优先从运行时配置读取）"""
+    runtime_value = get_runtime_config('watch_history_retention_days')
+    if runtime_value:
+        return runtime_value
+    return _parse_positive_int(config.get('watch_history', {}).get('retention_days'), 30)
+
+
+def get_history_retention_interval_seconds():
+    """获取自动清理观看历史的执行间隔（秒）"""
+    return _parse_positive_int(config.get('watch_history', {}).get('retention_interval_seconds'), 3600)
+
+
+def get_history_cleanup_batch_size():
+    """获取观看历史清理每批删除的记录数"""
+    return _parse_positive_int(config.get('watch_history', {}).get('cleanup_batch_size'), 500)
+
+
+def get_history_cleanup_batch_pause_seconds():
+    """获取观看历史清理批次之间的让出时间（秒）"""
+    return max(0, int(config.get('watch_history', {}).get('cleanup_batch_pause_ms', 50))) / 1000
+
 # 全局配置对象
 config = load_config()
@@ -6,9 +6,12 @@
 from .users import Users
 from .channel import Channel
 from .channel_group import ChannelGroup
+from .channel_health_schedule import ChannelHealthSchedule
 from .settings import Settings
 from .watch_history import WatchHistory
+from .watch_daily_rollup import WatchDailyRollup
 from .active_connection import ActiveConnection
 from .refresh_token import RefreshToken
+from .upstream_host_breaker import UpstreamHostBreaker
 
-__all__ = ['Users', 'Channel', 'ChannelGroup', 'Settings', 'WatchHistory', 'ActiveConnection', 'RefreshToken']
+__all__ = ['Users', 'Channel', 'ChannelGroup', 'ChannelHealthSchedule', 'Settings', 'WatchHistory', 'WatchDailyRollup', 'ActiveConnection', 'RefreshToken', 'UpstreamHostBreaker']
@@ -3,6 +3,7 @@
 频道模型
 """
 
+import json
 import re
 from app import db
 from app.utils.datetime_utils import to_iso8601_utc, to_utc_naive
@@ -21,10 +22,14 @@ class Channel(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     protocol = db.Column(db.String(20), default='http')  # http, https, rtp, udp
     tvg_id = db.Column(db.String(100), nullable=True)  # EPG tvg-id
+    backup_urls = db.Column(db.Text, nullable=True)  # 备用源地址（JSON 数组，按优先级排列）
     
     # 健康检测相关
     last_check = db.Column(db.DateTime, nullable=True)
     is_healthy = db.Column(db.Boolean, default=True)
+    bitrate_kbps = db.Column(db.Integer, nullable=True)  # 深度探测测得的码率（kbps）
+    first_byte_ms = db.Column(db.Integer, nullable=True)  # 深度探测测得的首字节耗时（毫秒）
+    content_type = db.Column(db.String(100), nullable=True)  # 健康检测从主源响应头学到的 Content-Type
     
     created_at = db.Column(db.DateTime, default=to_utc_naive)
     updated_at = db.Column(db.DateTime, default=to_utc_naive, onupdate=to_utc_naive)
@@ -58,6 +63,49 @@ class Channel(db.Model):
     def is_multicast(self):
         """判断是否为组播源"""
         return self.protocol in ('rtp', 'udp')
+
+    def get_backup_urls(self):
+        """获取备用源地址列表"""
+        if not self.backup_urls:
+            return []
+        try:
+            urls = json.loads(self.backup_urls)
+        except ValueError:
+            return []
+        return [url for url in urls if isinstance(url, str) and url]
+
+    def set_backup_urls(self, urls):
+        """设置备用源地址列表（去重，并排除与主地址相同的项）"""
+        cleaned = []
+        for url in urls or []:
+            url = (url or '').strip()
+            if url and url != self.url and url not in cleaned:
+                cleaned.append(url)
+        self.backup_urls = json.dumps(cleaned, ensure_ascii=False) if cleaned else None
+
+    @staticmethod
+    def parse_backup_urls(raw_value):
+        """
+        解析并校验请求中的备用源（数组或换行分隔的字符串）
+        返回 (urls, error_message)
+        """
+        if raw_value is None:
+            return [], None
+        if isinstance(raw_value, str):
+            raw_value = raw_value.splitlines()
+        if not isinstance(raw_value, list):
+            return None, '备用源格式不正确'
+
+        urls = []
+        for item in raw_value:
+            url = (item or '').strip() if isinstance(item, str) else ''
+            if not url:
+                continue
+            is_valid, error_msg = Channel.validate_url(url)
+            if not is_valid:
+                return None, f'备用源 {url}: {error_msg}'
+            urls.append(url)
+        return urls, None
     
     @staticmethod
     def validate_url(url):
@@ -117,6 +165,7 @@ class Channel(db.Model):
             'url': self.url,
             'logo': self.logo,
             'tvg_id': self.tvg_id,
+            'backup_urls': self.get_backup_urls(),
             'group_id': self.group_id,
             'group_name': self.group.name if self.group else None,
             'sort_order': self.sort_order,
@@ -124,6 +173,8 @@ class Channel(db.Model):
             'protocol': self.protocol,
             'last_check': to_iso8601_utc(self.last_check),    # UTC 时间 + Z 后缀
             'is_healthy': self.is_healthy,
+            'bitrate_kbps': self.bitrate_kbps,
+            'first_byte_ms': self.first_byte_ms,
             'created_at': to_iso8601_utc(self.created_at),    # UTC 时间 + Z 后缀
             'updated_at': to_iso8601_utc(self.updated_at)     # UTC 时间 + Z 后缀
         }
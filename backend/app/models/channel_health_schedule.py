@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+频道健康检测调度模型
+"""
+
+from app import db
+
+
+class ChannelHealthSchedule(db.Model):
+    """频道健康检测待检队列（每个频道一行，由 health-worker 按 next_check_at 拉取到期频道）"""
+    __tablename__ = 'channel_health_schedules'
+
+    channel_id = db.Column(db.Integer, primary_key=True)
+    next_check_at = db.Column(db.DateTime, nullable=False, index=True)  # 下次检测时间（UTC）
+    last_probe_at = db.Column(db.DateTime, nullable=True)  # 最近一次检测时间（UTC）
+    last_result = db.Column(db.Boolean, nullable=True)  # 最近一次检测结果
+    consecutive_successes = db.Column(db.Integer, nullable=False, default=0)
+    consecutive_failures = db.Column(db.Integer, nullable=False, default=0)
+    flap_count = db.Column(db.Integer, nullable=False, default=0)  # 近期状态翻转次数
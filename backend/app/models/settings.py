@@ -3,6 +3,8 @@
 系统设置模型
 """
 
+import uuid
+
 from app import db
 
 
@@ -26,9 +28,16 @@ class Settings(db.Model):
     KEY_HEALTH_CHECK_THREADS = 'health_check_threads'
     KEY_UDPXY_ENABLED = 'udpxy_enabled'
     KEY_UDPXY_URL = 'udpxy_url'
+    KEY_MULTICAST_NATIVE_ENABLED = 'multicast_native_enabled'
     KEY_HEARTBEAT_INTERVAL_SECONDS = 'heartbeat_interval_seconds'
     KEY_ACTIVE_HEARTBEAT_TIMEOUT_SECONDS = 'active_heartbeat_timeout_seconds'
     KEY_HISTORY_WORKER_INTERVAL_SECONDS = 'history_worker_interval_seconds'
+    # 订阅 Token 缓存版本号（重置 Token 时更新，各进程据此清空缓存）
+    KEY_TOKEN_CACHE_VERSION = 'token_cache_version'
+    # 频道目录版本号（频道 / 分组变更时更新，各进程据此重载频道快照）
+    KEY_CHANNEL_CATALOG_VERSION = 'channel_catalog_version'
+    # 观看历史分批清理任务状态（JSON，跨进程共享进度）
+    KEY_HISTORY_CLEANUP_STATUS = 'history_cleanup_status'
     
     @classmethod
     def get(cls, key, default=None):
@@ -48,6 +57,21 @@ class Settings(db.Model):
         db.session.commit()
         return setting
     
+    @classmethod
+    def touch_version(cls, key):
+        """
+        写入新的版本号（不提交，随调用方事务一起提交）
+        返回:
+            str: 新版本号
+        """
+        version = uuid.uuid4().hex
+        setting = cls.query.filter_by(key=key).first()
+        if setting:
+            setting.value = version
+        else:
+            db.session.add(cls(key=key, value=version))
+        return version
+
     @classmethod
     def get_all(cls):
         """获取所有设置"""
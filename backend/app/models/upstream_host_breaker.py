@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+上游主机熔断状态模型
+"""
+
+from app import db
+from app.utils.datetime_utils import to_utc_naive
+
+
+class UpstreamHostBreaker(db.Model):
+    """熔断中的上游主机（跨进程共享，主机恢复后删除对应行）"""
+    __tablename__ = 'upstream_host_breakers'
+
+    host = db.Column(db.String(255), primary_key=True)  # scheme://host:port
+    open_until = db.Column(db.DateTime, nullable=False)  # 熔断结束、放行半开探测的时间（UTC）
+    updated_at = db.Column(db.DateTime, default=to_utc_naive, onupdate=to_utc_naive)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+观看时长日汇总模型
+"""
+
+from app import db
+from app.utils.datetime_utils import to_utc_naive
+
+
+class WatchDailyRollup(db.Model):
+    """按 (日期, 频道, 用户) 汇总的已结束观看记录（由 history-worker 增量维护）"""
+    __tablename__ = 'watch_daily_rollups'
+
+    watch_date = db.Column(db.Date, primary_key=True)
+    channel_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    total_duration = db.Column(db.BigInteger, nullable=False, default=0)  # 总观看时长（秒）
+    session_count = db.Column(db.Integer, nullable=False, default=0)  # 观看次数
+    updated_at = db.Column(db.DateTime, nullable=False, default=to_utc_naive, onupdate=to_utc_naive)
+
+    __table_args__ = (
+        db.Index('idx_rollup_channel_date', 'channel_id', 'watch_date'),
+        db.Index('idx_rollup_user_date', 'user_id', 'watch_date'),
+    )
@@ -19,6 +19,12 @@ class WatchHistory(db.Model):
     end_time = db.Column(db.DateTime)
     duration = db.Column(db.Integer, default=0)  # 观看时长（秒）
     watch_date = db.Column(db.Date, nullable=False, index=True)  # 用于按日汇总
+    rolled_up = db.Column(db.Boolean, nullable=False, default=False, index=True)  # 是否已计入日汇总表
+
+    __table_args__ = (
+        # 历史列表按 (start_time, id) 倒序做游标分页
+        db.Index('idx_watch_history_start_id', 'start_time', 'id'),
+    )
     
     # 关联（无数据库外键约束，使用显式关联条件）
     user = db.relationship(
@@ -79,11 +85,49 @@ class WatchHistory(db.Model):
             'watch_date': to_iso8601_date(self.watch_date)
         }
     
+    @staticmethod
+    def _stats_source(start_date, end_date, user_id=None):
+        """
+        统计数据源：日汇总表 + 尚未汇总的记录（进行中的观看与待汇总的已结束记录）
+        返回:
+            子查询: (watch_date, channel_id, duration, session_count)
+        """
+        from sqlalchemy import func, literal, union_all
+        from app.models.watch_daily_rollup import WatchDailyRollup
+
+        rolled_up = db.select(
+            WatchDailyRollup.watch_date.label('watch_date'),
+            WatchDailyRollup.channel_id.label('channel_id'),
+            WatchDailyRollup.total_duration.label('duration'),
+            WatchDailyRollup.session_count.label('session_count')
+        ).where(
+            WatchDailyRollup.watch_date >= start_date,
+            WatchDailyRollup.watch_date <= end_date
+        )
+
+        pending = db.select(
+            WatchHistory.watch_date.label('watch_date'),
+            WatchHistory.channel_id.label('channel_id'),
+            func.coalesce(WatchHistory.duration, 0).label('duration'),
+            literal(1).label('session_count')
+        ).where(
+            WatchHistory.rolled_up == db.false(),
+            WatchHistory.watch_date >= start_date,
+            WatchHistory.watch_date <= end_date,
+            WatchHistory.duration >= WatchHistory.MIN_VALID_DURATION_SECONDS
+        )
+
+        if user_id:
+            rolled_up = rolled_up.where(WatchDailyRollup.user_id == user_id)
+            pending = pending.where(WatchHistory.user_id == user_id)
+
+        return union_all(rolled_up, pending).subquery()
+
     @staticmethod
     def get_daily_stats(user_id=None, days=7):
         """
         获取每日观看时长统计
-        返回最近 N 天的每日总观看时长
+        返回最近 N 天的每日总观看时长（读取日汇总表，并补上尚未汇总的记录）
         """
         from sqlalchemy import func
         from datetime import timedelta
@@ -91,19 +135,11 @@ class WatchHistory(db.Model):
         end_date = to_utc_naive().date()
         start_date = end_date - timedelta(days=days - 1)
         
+        source = WatchHistory._stats_source(start_date, end_date, user_id=user_id)
         query = db.session.query(
-            WatchHistory.watch_date,
-            func.sum(WatchHistory.duration).label('total_duration')
-        ).filter(
-            WatchHistory.watch_date >= start_date,
-            WatchHistory.watch_date <= end_date,
-            WatchHistory.duration >= WatchHistory.MIN_VALID_DURATION_SECONDS
-        )
-        
-        if user_id:
-            query = query.filter(WatchHistory.user_id == user_id)
-        
-        query = query.group_by(WatchHistory.watch_date).order_by(WatchHistory.watch_date)
+            source.c.watch_date,
+            func.sum(source.c.duration).label('total_duration')
+        ).group_by(source.c.watch_date).order_by(source.c.watch_date)
         
         results = query.all()
         
@@ -114,7 +150,7 @@ class WatchHistory(db.Model):
             stats[d.isoformat()] = 0
         
         for row in results:
-            stats[row.watch_date.isoformat()] = row.total_duration or 0
+            stats[row.watch_date.isoformat()] = int(row.total_duration or 0)
         
         # 转换为有序列表
         return [
@@ -126,7 +162,7 @@ class WatchHistory(db.Model):
     def get_channel_ranking(days=7, limit=10):
         """
         获取频道观看排名
-        返回按观看时长排序的频道列表
+        返回按观看时长排序的频道列表（读取日汇总表，并补上尚未汇总的记录）
         """
         from sqlalchemy import func
         from datetime import timedelta
@@ -135,21 +171,18 @@ class WatchHistory(db.Model):
         end_date = to_utc_naive().date()
         start_date = end_date - timedelta(days=days - 1)
         
+        source = WatchHistory._stats_source(start_date, end_date)
         query = db.session.query(
-            WatchHistory.channel_id,
+            source.c.channel_id,
             Channel.name.label('channel_name'),
-            func.sum(WatchHistory.duration).label('total_duration'),
-            func.count(WatchHistory.id).label('watch_count')
+            func.sum(source.c.duration).label('total_duration'),
+            func.sum(source.c.session_count).label('watch_count')
         ).join(
-            Channel, WatchHistory.channel_id == Channel.id
-        ).filter(
-            WatchHistory.watch_date >= start_date,
-            WatchHistory.watch_date <= end_date,
-            WatchHistory.duration >= WatchHistory.MIN_VALID_DURATION_SECONDS
+            Channel, source.c.channel_id == Channel.id
         ).group_by(
-            WatchHistory.channel_id, Channel.name
+            source.c.channel_id, Channel.name
         ).order_by(
-            func.sum(WatchHistory.duration).desc()
+            func.sum(source.c.duration).desc()
         ).limit(limit)
         
         results = query.all()
@@ -158,8 +191,9 @@ class WatchHistory(db.Model):
             {
                 'channel_id': row.channel_id,
                 'channel_name': row.channel_name,
-                'total_duration': row.total_duration or 0,
-                'watch_count': row.watch_count or 0
+                'total_duration': int(row.total_duration or 0),
+                'watch_count': int(row.watch_count or 0)
             }
             for row in results
         ]
+
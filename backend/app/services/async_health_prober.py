@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+基于事件循环的频道健康探测
+
+一个事件循环内并发探测全部频道，全局信号量限制同时进行的探测数（数百级），
+不再为每个并发探测占用一个线程；同一主机另有并发上限，并与线程池版本共用主机熔断状态。
+探测语义与线程池版本一致：
+HTTP(S) 发送 HEAD（跟随重定向，状态码 < 400 视为健康），
+组播经 UDPxy 拉流读到首块数据、或直接加入组播组收到首个数据报即视为健康；
+开启深度探测时改为读取有限的码流样本分析（见 stream_probe）。
+"""
+
+import asyncio
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from loguru import logger
+
+from app.config import get_health_check_deep_probe_enabled
+from app.services.content_type_cache import remember_content_type
+from app.services.hls_proxy import is_hls_content_type, is_hls_url
+from app.services.host_breaker import allow_request, host_key, record_host_failure, record_host_success
+from app.services.metrics import observe_health_check
+from app.services.multicast_relay import open_multicast_socket, parse_multicast_url, strip_rtp_header
+from app.services.stream_probe import SAMPLE_READ_SIZE, UNHEALTHY, ProbeResult, SampleCollector, shallow_result
+from app.services.stream_urls import extract_rtp_udp_addr, probe_target_url
+
+UDPXY_PROBE_CHUNK_SIZE = 1024
+
+
+class _FirstDatagramProtocol(asyncio.DatagramProtocol):
+    """收到首个非空数据报即完成"""
+
+    def __init__(self, received):
+        self._received = received
+
+    def datagram_received(self, data, addr):
+        if data and not self._received.done():
+            self._received.set_result(True)
+
+    def error_received(self, exc):
+        if not self._received.done():
+            self._received.set_exception(exc)
+
+
+class _SampleDatagramProtocol(asyncio.DatagramProtocol):
+    """去除 RTP 头后把数据报交给样本收集器，样本足够时完成"""
+
+    def __init__(self, collector, finished):
+        self._collector = collector
+        self._finished = finished
+
+    def datagram_received(self, data, addr):
+        if self._finished.done():
+            return
+        _, payload = strip_rtp_header(data)
+        if payload and self._collector.feed(payload):
+            self._finished.set_result(True)
+
+    def error_received(self, exc):
+        if not self._finished.done():
+            self._finished.set_exception(exc)
+
+
+async def _probe_http(http, channel_info):
+    async with http.head(channel_info['url'], allow_redirects=True) as response:
+        if response.status < 400:
+            # 顺带学习 Content-Type，检测结束后写回频道供流代理启动时直接使用
+            remember_content_type(channel_info['id'], channel_info['url'], response.headers.get('Content-Type'))
+            return True
+        return False
+
+
+async def _probe_udp_with_udpxy(http, addr, udpxy_url):
+    udpxy_base = (udpxy_url or '').rstrip('/')
+    if not addr or not udpxy_base:
+        return False
+
+    async with http.get(f"{udpxy_base}/udp/{addr}") as response:
+        if response.status != 200:
+            return False
+        try:
+            chunk = await response.content.read(UDPXY_PROBE_CHUNK_SIZE)
+        except (ClientError, asyncio.TimeoutError):
+            # UDPxy 已响应但组播无数据，属于频道异常而非主机异常
+            return False
+        return len(chunk) > 0
+
+
+async def _probe_udp_direct(addr, timeout):
+    group, port = parse_multicast_url(addr)
+    loop = asyncio.get_running_loop()
+    received = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _FirstDatagramProtocol(received),
+        sock=open_multicast_socket(group, port)
+    )
+    try:
+        return await asyncio.wait_for(received, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        transport.close()
+
+
+async def _sample_response(response, started_at, channel_name):
+    """从已建立的响应中采样并分析码流（样本读取中断时分析已收到的部分）"""
+    collector = SampleCollector(started_at)
+    try:
+        while not collector.done:
+            chunk = await response.content.read(SAMPLE_READ_SIZE)
+            if not chunk:
+                break
+            collector.feed(chunk)
+    except (ClientError, asyncio.TimeoutError):
+        pass
+    return collector.evaluate(channel_name)
+
+
+async def _deep_probe_http(http, channel_info):
+    url = channel_info['url']
+    started_at = time.perf_counter()
+    async with http.get(url) as response:
+        if response.status >= 400:
+            return UNHEALTHY
+        content_type = response.headers.get('Content-Type')
+        remember_content_type(channel_info['id'], url, content_type)
+        if is_hls_url(url) or is_hls_content_type(content_type):
+            return ProbeResult(True, None, int((time.perf_counter() - started_at) * 1000))
+        return await _sample_response(response, started_at, channel_info.get('name'))
+
+
+async def _deep_probe_udpxy(http, addr, udpxy_url, channel_name):
+    udpxy_base = (udpxy_url or '').rstrip('/')
+    if not addr or not udpxy_base:
+        return UNHEALTHY
+
+    started_at = time.perf_counter()
+    async with http.get(f"{udpxy_base}/udp/{addr}") as response:
+        if response.status != 200:
+            return UNHEALTHY
+        return await _sample_response(response, started_at, channel_name)
+
+
+async def _deep_probe_multicast(addr, timeout, channel_name):
+    group, port = parse_multicast_url(addr)
+    loop = asyncio.get_running_loop()
+    started_at = time.perf_counter()
+    collector = SampleCollector(started_at)
+    finished = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _SampleDatagramProtocol(collector, finished),
+        sock=open_multicast_socket(group, port)
+    )
+    try:
+        # 首个数据报最多等待 timeout 秒，之后最多再采样 HEALTH_CHECK_DEEP_SAMPLE_SECONDS 秒
+        await asyncio.wait_for(finished, timeout + collector.max_seconds)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        transport.close()
+    return collector.evaluate(channel_name)
+
+
+async def _deep_check_channel_once(http, channel_info, timeout, udpxy_enabled, udpxy_url):
+    """执行单次深度检测，不包含重试逻辑。"""
+    protocol = (channel_info.get('protocol') or '').lower()
+
+    if protocol in ('http', 'https'):
+        return await _deep_probe_http(http, channel_info)
+
+    if protocol in ('rtp', 'udp'):
+        addr = extract_rtp_udp_addr(channel_info.get('url') or '')
+        if udpxy_enabled:
+            return await _deep_probe_udpxy(http, addr, udpxy_url, channel_info.get('name'))
+        if not addr:
+            return UNHEALTHY
+        return await _deep_probe_multicast(addr, timeout, channel_info.get('name'))
+
+    return UNHEALTHY
+
+
+async def _check_channel_once(http, channel_info, timeout, udpxy_enabled, udpxy_url):
+    """执行单次检测，不包含重试逻辑，返回 ProbeResult。"""
+    if get_health_check_deep_probe_enabled():
+        return await _deep_check_channel_once(http, channel_info, timeout, udpxy_enabled, udpxy_url)
+    return shallow_result(await _shallow_check_channel_once(http, channel_info, timeout, udpxy_enabled, udpxy_url))
+
+
+async def _shallow_check_channel_once(http, channel_info, timeout, udpxy_enabled, udpxy_url):
+    """按响应状态码 / 首块数据检测。"""
+    protocol = (channel_info.get('protocol') or '').lower()
+    url = channel_info.get('url') or ''
+
+    if protocol in ('http', 'https'):
+        return await _probe_http(http, channel_info)
+
+    if protocol in ('rtp', 'udp'):
+        addr = extract_rtp_udp_addr(url)
+        if udpxy_enabled:
+            return await _probe_udp_with_udpxy(http, addr, udpxy_url)
+        if not addr:
+            return False
+        return await _probe_udp_direct(addr, timeout)
+
+    return False
+
+
+async def _probe_channel_with_retry(http, channel_info, timeout, max_retries, udpxy_enabled, udpxy_url):
+    """按重试次数探测频道，任一次成功即返回；所在主机熔断时直接判为异常。"""
+    target_url = probe_target_url(channel_info, udpxy_enabled, udpxy_url)
+    result = UNHEALTHY
+    for attempt in range(max_retries + 1):
+        if not allow_request(target_url):
+            return result
+        try:
+            result = await _check_channel_once(http, channel_info, timeout, udpxy_enabled, udpxy_url)
+            record_host_success(target_url)
+        except (ClientError, asyncio.TimeoutError):
+            record_host_failure(target_url)
+        except Exception as e:
+            if attempt == max_retries:
+                logger.error(f"健康检测异常 - 频道 {channel_info.get('id')}: {e}")
+
+        if result.is_healthy:
+            return result
+
+        if attempt < max_retries:
+            logger.debug(
+                f"频道 {channel_info.get('name')} 检测失败，正在重试 ({attempt + 1}/{max_retries})..."
+            )
+
+    # 保留最后一次深度探测测得的码率与首字节耗时
+    return result
+
+
+class _HostLimiter:
+    """按主机限制同时进行的探测数（先占主机名额再占全局名额，等待中的探测不占全局名额）"""
+
+    def __init__(self, host_concurrency):
+        self._host_concurrency = host_concurrency
+        self._semaphores = {}
+
+    def get(self, url):
+        key = host_key(url)
+        if key is None:
+            return None
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(self._host_concurrency)
+        return semaphore
+
+
+async def _check_channel(semaphore, host_limiter, http, channel_info, timeout, max_retries, udpxy_enabled, udpxy_url):
+    host_semaphore = host_limiter.get(probe_target_url(channel_info, udpxy_enabled, udpxy_url))
+    if host_semaphore is not None:
+        await host_semaphore.acquire()
+    try:
+        async with semaphore:
+            started_at = time.perf_counter()
+            result = await _probe_channel_with_retry(
+                http, channel_info, timeout, max_retries, udpxy_enabled, udpxy_url
+            )
+            observe_health_check(result.is_healthy, time.perf_counter() - started_at)
+            return channel_info['id'], result
+    finally:
+        if host_semaphore is not None:
+            host_semaphore.release()
+
+
+async def _probe_all(channel_infos, timeout, max_retries, udpxy_enabled, udpxy_url, concurrency, host_concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    host_limiter = _HostLimiter(host_concurrency)
+    # 与线程池版本的 requests 超时一致：连接与两次读取之间各自计时
+    http = ClientSession(
+        connector=TCPConnector(limit=concurrency, limit_per_host=0),
+        timeout=ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout),
+        auto_decompress=False
+    )
+    try:
+        results = await asyncio.gather(*[
+            _check_channel(
+                semaphore, host_limiter, http, channel_info, timeout, max_retries, udpxy_enabled, udpxy_url
+            )
+            for channel_info in channel_infos
+        ])
+    finally:
+        await http.close()
+    return dict(results)
+
+
+def probe_channels(channel_infos, timeout, max_retries, udpxy_enabled, udpxy_url, concurrency, host_concurrency=None):
+    """
+    并发探测频道健康状态（在调用线程中运行独立的事件循环，只做网络探测，不触碰数据库会话）
+    参数:
+        channel_infos: [{'id', 'name', 'url', 'protocol'}, ...]
+        concurrency: 同时进行的探测数上限
+        host_concurrency: 同一主机（含 UDPxy）同时进行的探测数上限，默认不单独限制
+    返回:
+        dict: {channel_id: ProbeResult}
+    """
+    if not channel_infos:
+        return {}
+    concurrency = max(1, int(concurrency))
+    host_concurrency = max(1, int(host_concurrency or concurrency))
+    return asyncio.run(
+        _probe_all(channel_infos, timeout, max_retries, udpxy_enabled, udpxy_url, concurrency, host_concurrency)
+    )
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+异步流代理服务（asyncio 事件循环承载 /api/proxy/stream/<id>）
+
+上游读取与客户端写出都在事件循环内完成，单进程即可承载大量长连接；
+鉴权、观看会话等数据库操作放到线程池内、在独立 app context 中短暂执行。
+"""
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
+from loguru import logger
+
+from app.config import (
+    config,
+    get_proxy_buffer_size,
+    get_proxy_relay_buffer_chunks,
+    get_proxy_relay_linger_seconds,
+    get_proxy_failover_stall_seconds
+)
+from app.services.content_type_cache import remember_content_type
+from app.services.hls_proxy import (
+    HLS_CONTENT_TYPE,
+    HlsProxyError,
+    is_hls_content_type,
+    is_hls_url,
+    render_channel_playlist
+)
+from app.services.host_breaker import allow_request, ensure_sync_started, record_host_failure, record_host_success
+from app.services.metrics import StreamMeter, db_query_scope, observe_upstream_ttfb
+from app.services.multicast_relay import (
+    MpegTsAssembler,
+    is_multicast_url,
+    open_multicast_socket,
+    parse_multicast_url
+)
+from app.services.source_ranking import record_success
+from app.services.stream_auth import credentials_from_stream_query
+from app.services.stream_relay import SourceFailover, create_start_buffer, relay_key
+from app.services.stream_session import StreamSessionError, open_stream_session, close_stream_session
+from app.services.heartbeat_aggregator import heartbeat_aggregator
+from app.utils.datetime_utils import to_utc_naive
+
+DEFAULT_CONTENT_TYPE = 'video/mp2t'
+UPSTREAM_TIMEOUT_SECONDS = 30
+MULTICAST_POLL_SECONDS = 1
+
+
+class AsyncStreamRelay:
+    """单个频道的异步上游读取器 + 环形缓冲区（语义与 StreamRelay 一致）"""
+
+    def __init__(self, hub, key, channel_id, stream_urls):
+        self._hub = hub
+        self.key = key
+        self.channel_id = channel_id
+        self.stream_urls = list(stream_urls)
+        self.stream_url = self.stream_urls[0]
+
+        self._cond = asyncio.Condition()
+        self._chunks = deque(maxlen=max(1, int(get_proxy_relay_buffer_chunks())))
+        self._next_seq = 0
+        self._viewers = 0
+        self._finished = False
+        self._stopping = False
+        self._linger_handle = None
+        self._task = None
+        self._content_type = asyncio.get_running_loop().create_future()
+        self._start_buffer = create_start_buffer()
+
+        self.bytes_relayed = 0
+        self.lagged_skips = 0
+        self.failovers = 0
+
+    @property
+    def usable(self):
+        return not (self._finished or self._stopping)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            await self._run_sources(get_proxy_buffer_size())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Stream error: {e}")
+        finally:
+            self._set_content_type(None)
+            async with self._cond:
+                self._finished = True
+                self._cancel_linger()
+                self._cond.notify_all()
+            self._hub._discard(self)
+            logger.debug(f"上游已关闭: channel_id={self.channel_id}, 转发字节={self.bytes_relayed}")
+
+    async def _run_sources(self, buffer_size):
+        """依次连接各个源，切换规则见 SourceFailover（与 StreamRelay 共用）"""
+        failover = SourceFailover(self.stream_urls)
+        while True:
+            source_url, delay = failover.next_source()
+            if source_url is None:
+                return
+            if delay:
+                await asyncio.sleep(delay)
+            if not allow_request(source_url):
+                # 源所在主机熔断中，直接尝试下一个源
+                logger.debug(f"上游主机熔断中，跳过源: channel_id={self.channel_id}, url={source_url}")
+                continue
+
+            bytes_before = self.bytes_relayed
+            started_at = time.monotonic()
+            self.stream_url = source_url
+            # 不同源的 PAT/PMT 与时间戳不连续，起播缓冲重新积累
+            self._start_buffer = create_start_buffer()
+            error = None
+            try:
+                if is_multicast_url(source_url):
+                    await self._read_multicast(source_url, buffer_size)
+                else:
+                    await self._read_http(source_url, buffer_size)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+
+            failover.source_done(source_url, self.bytes_relayed - bytes_before, time.monotonic() - started_at, error)
+            if error is None:
+                logger.info(f"上游已结束: channel_id={self.channel_id}, url={source_url}")
+                continue
+            self.failovers += 1
+            logger.warning(f"上游中断，切换源: channel_id={self.channel_id}, url={source_url}, error={error}")
+
+    def _on_upstream_ready(self, content_type):
+        if not self._content_type.done():
+            content_type = content_type or DEFAULT_CONTENT_TYPE
+            remember_content_type(self.channel_id, self.stream_url, content_type)
+            self._set_content_type(content_type)
+        logger.debug(f"上游已连接: channel_id={self.channel_id}, url={self.stream_url}")
+
+    async def _read_http(self, source_url, buffer_size):
+        started_at = time.perf_counter()
+        # 读超时即停滞判定时间：超过该时间收不到数据就切换源
+        timeout = ClientTimeout(
+            total=None,
+            sock_connect=UPSTREAM_TIMEOUT_SECONDS,
+            sock_read=get_proxy_failover_stall_seconds()
+        )
+        try:
+            response = await self._hub.http.get(source_url, timeout=timeout)
+        except (ClientError, asyncio.TimeoutError):
+            record_host_failure(source_url)
+            raise
+        async with response as r:
+            if r.status >= 500:
+                record_host_failure(source_url)
+            r.raise_for_status()
+            record_host_success(source_url)
+            self._on_upstream_ready(r.headers.get('Content-Type'))
+            first_chunk = True
+            async for chunk in r.content.iter_chunked(buffer_size):
+                if chunk:
+                    if first_chunk:
+                        ttfb_seconds = time.perf_counter() - started_at
+                        record_success(source_url, ttfb_seconds * 1000)
+                        observe_upstream_ttfb('http', ttfb_seconds)
+                        first_chunk = False
+                    await self._publish(chunk)
+
+    async def _read_multicast(self, source_url, buffer_size):
+        started_at = time.perf_counter()
+        stall_seconds = get_proxy_failover_stall_seconds()
+        poll_seconds = min(MULTICAST_POLL_SECONDS, stall_seconds)
+        group, port = parse_multicast_url(source_url)
+        packets = asyncio.Queue()
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _MulticastProtocol(packets),
+            sock=open_multicast_socket(group, port)
+        )
+        assembler = MpegTsAssembler(buffer_size)
+        first_chunk = True
+        try:
+            self._on_upstream_ready(DEFAULT_CONTENT_TYPE)
+            while True:
+                try:
+                    packet = await asyncio.wait_for(packets.get(), poll_seconds)
+                except asyncio.TimeoutError:
+                    # 码流暂停时把已收到的数据先推给观众
+                    chunk = assembler.flush()
+                    if chunk:
+                        await self._publish(chunk)
+                else:
+                    for chunk in assembler.feed(packet):
+                        if first_chunk:
+                            ttfb_seconds = time.perf_counter() - started_at
+                            record_success(source_url, ttfb_seconds * 1000)
+                            observe_upstream_ttfb('multicast', ttfb_seconds)
+                            first_chunk = False
+                        await self._publish(chunk)
+
+                # 按输出的负载计时：持续收到但全部被丢弃的数据报同样视为停滞
+                if assembler.idle_seconds() >= stall_seconds:
+                    raise TimeoutError(f"组播 {group}:{port} 超过 {stall_seconds} 秒无数据")
+        finally:
+            transport.close()
+
+    def _set_content_type(self, content_type):
+        if not self._content_type.done():
+            self._content_type.set_result(content_type)
+
+    async def _publish(self, chunk):
+        async with self._cond:
+            if self._start_buffer is not None:
+                self._start_buffer.feed(chunk)
+            self._chunks.append(chunk)
+            self._next_seq += 1
+            self.bytes_relayed += len(chunk)
+            self._cond.notify_all()
+
+    async def wait_content_type(self):
+        """等待上游响应头，上游连接失败时返回 None"""
+        return await asyncio.shield(self._content_type)
+
+    def attach(self):
+        """返回 (起始序号, 起播数据)"""
+        self._viewers += 1
+        self._cancel_linger()
+        start_burst = self._start_buffer.snapshot() if self._start_buffer is not None else b''
+        return self._next_seq, start_burst
+
+    def detach(self):
+        self._viewers = max(0, self._viewers - 1)
+        if self._viewers > 0 or self._finished:
+            return
+
+        linger_seconds = get_proxy_relay_linger_seconds()
+        if linger_seconds > 0:
+            self._linger_handle = asyncio.get_running_loop().call_later(linger_seconds, self._stop_if_idle)
+        else:
+            self._stop_if_idle()
+
+    def _cancel_linger(self):
+        if self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._linger_handle = None
+
+    def _stop_if_idle(self):
+        self._linger_handle = None
+        if self._viewers > 0 or self._finished:
+            return
+        self._stopping = True
+        self._hub._discard(self)
+        if self._task is not None:
+            self._task.cancel()
+
+    async def read(self, cursor):
+        """读取 cursor 之后的缓冲块，上游结束且已读完时返回 (None, cursor)"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: cursor < self._next_seq or self._finished)
+
+            if cursor >= self._next_seq:
+                return None, cursor
+
+            oldest_seq = self._next_seq - len(self._chunks)
+            if cursor < oldest_seq:
+                self.lagged_skips += 1
+                cursor = oldest_seq
+
+            chunks = list(itertools.islice(self._chunks, cursor - oldest_seq, None))
+            return chunks, self._next_seq
+
+
+class _MulticastProtocol(asyncio.DatagramProtocol):
+    """组播数据报直接入队，由读取任务解包"""
+
+    def __init__(self, packets):
+        self._packets = packets
+
+    def datagram_received(self, data, addr):
+        self._packets.put_nowait(data)
+
+
+class AsyncRelayHub:
+    """按频道管理异步共享上游（仅在事件循环线程内访问，无需加锁）"""
+
+    def __init__(self, http):
+        self.http = http
+        self._relays = {}
+
+    def _discard(self, relay):
+        if self._relays.get(relay.key) is relay:
+            del self._relays[relay.key]
+
+    def acquire(self, channel_id, stream_urls):
+        key = relay_key(channel_id, stream_urls)
+        relay = self._relays.get(key)
+        if relay is None or not relay.usable:
+            relay = AsyncStreamRelay(self, key, channel_id, stream_urls)
+            self._relays[key] = relay
+            relay.start()
+        return relay, relay.attach()
+
+
+def _call_in_app_context(flask_app, func, *args, **kwargs):
+    """在独立 app context 内执行数据库操作，结束即释放会话"""
+    with flask_app.app_context(), db_query_scope(f"stream_server.{func.__name__}"):
+        return func(*args, **kwargs)
+
+
+async def handle_stream(request):
+    """代理转发频道流（异步版）"""
+    server = request.app
+    flask_app = server['flask_app']
+    executor = server['db_executor']
+    loop = asyncio.get_running_loop()
+
+    def run_db(func, *args, **kwargs):
+        return loop.run_in_executor(executor, lambda: _call_in_app_context(flask_app, func, *args, **kwargs))
+
+    channel_id = int(request.match_info['channel_id'])
+    try:
+        session = await run_db(open_stream_session, credentials_from_stream_query(request.query), channel_id)
+    except StreamSessionError as e:
+        return web.json_response({'error': e.message}, status=e.status_code)
+
+    async def hls_entry_response():
+        # m3u8 源只在这里返回改写后的入口播放列表，子列表与分片由 Flask 的 /api/proxy/hls 处理
+        try:
+            body = await loop.run_in_executor(
+                executor,
+                render_channel_playlist,
+                channel_id,
+                session['stream_url'],
+                session['auth_params'],
+                session['connection_id']
+            )
+        except HlsProxyError as e:
+            logger.error(f"HLS 入口播放列表获取失败: channel_id={channel_id}, error={e.message}")
+            await run_db(close_stream_session, session)
+            return web.json_response({'error': '上游连接失败'}, status=e.status_code)
+        return web.Response(text=body, content_type=HLS_CONTENT_TYPE, headers={'Cache-Control': 'no-cache'})
+
+    if is_hls_url(session['stream_url']) or is_hls_content_type(session['content_type']):
+        return await hls_entry_response()
+
+    relay, (cursor, start_burst) = server['relay_hub'].acquire(channel_id, session['stream_urls'])
+    meter = StreamMeter(channel_id, session['user_id'])
+    response = None
+    # 改走 HLS 时观看会话由 HLS 心跳维持，不在这里结束
+    close_session = True
+    try:
+        content_type = session['content_type'] or await relay.wait_content_type()
+        if content_type is None:
+            return web.json_response({'error': '上游连接失败'}, status=502)
+
+        if is_hls_content_type(content_type):
+            # 地址无 .m3u8 后缀但上游实际返回播放列表，改走 HLS 代理
+            close_session = False
+            return await hls_entry_response()
+
+        response = web.StreamResponse(headers={'Content-Type': content_type})
+        await response.prepare(request)
+        if start_burst:
+            # 先发送最近关键帧起的缓冲数据，播放器可立即起播
+            await response.write(start_burst)
+            meter.add(len(start_burst))
+
+        while True:
+            chunks, cursor = await relay.read(cursor)
+            if chunks is None:
+                break
+
+            # 心跳仅写入进程内聚合器，由后台线程按心跳间隔批量落库
+            heartbeat_aggregator.record(session['connection_id'], to_utc_naive())
+            for chunk in chunks:
+                await response.write(chunk)
+                meter.add(len(chunk))
+        return response
+    except ConnectionResetError:
+        # 客户端断开
+        return response
+    finally:
+        meter.close()
+        relay.detach()
+        if close_session:
+            # 幂等结束连接：落历史 + 删除活跃连接
+            await asyncio.shield(run_db(close_stream_session, session))
+
+
+def create_stream_server(flask_app):
+    """创建异步流代理 aiohttp 应用"""
+    stream_config = config.get('stream_server', {})
+    server = web.Application()
+    server['flask_app'] = flask_app
+    server['db_executor'] = ThreadPoolExecutor(
+        max_workers=max(1, int(stream_config.get('db_threads', 8))),
+        thread_name_prefix='stream-db'
+    )
+
+    async def on_startup(app):
+        # 上游均为长连接，不限制连接总数；空闲连接保持 keep-alive 供后续拉流复用
+        app['http'] = ClientSession(
+            connector=TCPConnector(limit=0, limit_per_host=0, keepalive_timeout=30),
+            timeout=ClientTimeout(
+                total=None,
+                sock_connect=UPSTREAM_TIMEOUT_SECONDS,
+                sock_read=UPSTREAM_TIMEOUT_SECONDS
+            ),
+            auto_decompress=False
+        )
+        app['relay_hub'] = AsyncRelayHub(app['http'])
+        heartbeat_aggregator.ensure_started(flask_app)
+        ensure_sync_started(flask_app)
+
+    async def on_cleanup(app):
+        await app['http'].close()
+        app['db_executor'].shutdown(wait=False)
+
+    server.on_startup.append(on_startup)
+    server.on_cleanup.append(on_cleanup)
+    server.router.add_get('/api/proxy/stream/{channel_id:\\d+}', handle_stream)
+    return server
+
+
+def run_stream_server(flask_app):
+    """启动异步流代理服务（阻塞运行）"""
+    stream_config = config.get('stream_server', {})
+    host = stream_config.get('host', '0.0.0.0')
+    port = int(stream_config.get('port', 5001))
+    logger.info(f"异步流代理服务已启动: http://{host}:{port}/api/proxy/stream/<id>")
+    # reuse_port 允许同一端口启动多个实例，按 CPU 核数水平扩展
+    web.run_app(
+        create_stream_server(flask_app),
+        host=host,
+        port=port,
+        reuse_port=True,
+        access_log=None,
+        print=None
+    )
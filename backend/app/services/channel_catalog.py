@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+频道目录快照（进程内）
+
+流代理启动时需要频道的地址、协议、启用与健康状态。每个进程在内存中保存全部频道的精简快照，
+频道 / 分组的新增、修改、删除、导入、排序以及健康检测结果写入时更新 settings 表中的目录版本号，
+各进程定期比对版本号，变化时整体重载快照（同时清空进程内的 Content-Type 缓存）；其余时间按频道 ID 查找不访问数据库。
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+from loguru import logger
+
+from app.services.content_type_cache import clear_content_types
+
+# 各进程比对目录版本号的最小间隔（秒）
+VERSION_CHECK_INTERVAL_SECONDS = 1.0
+
+CatalogChannel = namedtuple(
+    'CatalogChannel',
+    ['id', 'name', 'url', 'backup_urls', 'protocol', 'is_active', 'is_healthy', 'content_type']
+)
+
+_lock = threading.Lock()
+_state = {
+    'channels': None,
+    'version': None,
+    'version_checked_at': 0.0,
+    'reloads': 0,
+    'hits': 0,
+    'misses': 0
+}
+
+
+def _load_version():
+    from app.models.settings import Settings
+    return Settings.get(Settings.KEY_CHANNEL_CATALOG_VERSION, '')
+
+
+def _to_catalog_channel(channel):
+    return CatalogChannel(
+        id=channel.id,
+        name=channel.name,
+        url=channel.url,
+        backup_urls=tuple(channel.get_backup_urls()),
+        protocol=channel.protocol,
+        is_active=bool(channel.is_active),
+        is_healthy=channel.is_healthy is not False,
+        content_type=channel.content_type
+    )
+
+
+def _load_channels():
+    from app.models.channel import Channel
+    return {channel.id: _to_catalog_channel(channel) for channel in Channel.query.all()}
+
+
+def _ensure_fresh_locked(now):
+    """按间隔比对目录版本号，版本变化或尚未加载时重载快照"""
+    if _state['channels'] is not None and now - _state['version_checked_at'] < VERSION_CHECK_INTERVAL_SECONDS:
+        return
+    version = _load_version()
+    if _state['channels'] is None or version != _state['version']:
+        if version != _state['version']:
+            clear_content_types()
+        _state['channels'] = _load_channels()
+        _state['version'] = version
+        _state['reloads'] += 1
+        logger.debug(f"频道目录快照已重载: channels={len(_state['channels'])}, version={version}")
+    _state['version_checked_at'] = now
+
+
+def get_catalog_channel(channel_id):
+    """
+    按 ID 获取频道快照（需在 app context 内调用）
+    快照中不存在时（其他进程刚创建、本进程尚未比对到新版本）直接查询一次数据库，结果不写入快照
+    返回:
+        CatalogChannel: 频道不存在时返回 None
+    """
+    with _lock:
+        _ensure_fresh_locked(time.monotonic())
+        channel = _state['channels'].get(channel_id)
+        if channel is not None:
+            _state['hits'] += 1
+            return channel
+        _state['misses'] += 1
+
+    from app import db
+    from app.models.channel import Channel
+    channel = db.session.get(Channel, channel_id)
+    return _to_catalog_channel(channel) if channel else None
+
+
+def get_catalog_version():
+    """获取当前进程快照对应的目录版本号（需在 app context 内调用）"""
+    with _lock:
+        _ensure_fresh_locked(time.monotonic())
+        return _state['version']
+
+
+def bump_catalog_version():
+    """
+    更新目录版本号（不提交，随调用方的频道 / 分组变更一起提交）
+    本进程立即重载，其他进程在下次比对时重载
+    """
+    from app.models.settings import Settings
+
+    Settings.touch_version(Settings.KEY_CHANNEL_CATALOG_VERSION)
+    with _lock:
+        _state['channels'] = None
+        _state['version_checked_at'] = 0.0
+
+
+def get_catalog_stats():
+    with _lock:
+        channels = _state['channels']
+        return {
+            'channels': len(channels) if channels is not None else 0,
+            'reloads': _state['reloads'],
+            'hits': _state['hits'],
+            'misses': _state['misses']
+        }
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+上游 Content-Type 缓存（进程内，按频道 + 上游地址 + TTL）
+
+Content-Type 从真实拉流响应或健康检测响应中学习，避免流启动前单独发起 HEAD 探测。
+按 (频道, 地址) 缓存，频道地址修改后旧条目不会被新地址命中；频道目录版本变化时整体清空。
+健康检测运行在独立的 worker 进程，学到的主源 Content-Type 写入 channels.content_type，
+由频道目录快照带给流代理进程。
+"""
+
+import threading
+import time
+
+from app.config import get_proxy_content_type_ttl_seconds
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def get_cached_content_type(channel_id, url):
+    """获取缓存的 Content-Type，未命中或已过期返回 None"""
+    key = (channel_id, url)
+    with _lock:
+        item = _cache.get(key)
+        if item is None:
+            return None
+
+        content_type, expires_at = item
+        if expires_at <= time.monotonic():
+            del _cache[key]
+            return None
+        return content_type
+
+
+def remember_content_type(channel_id, url, content_type):
+    """记录频道某个上游地址的 Content-Type"""
+    if not channel_id or not url or not content_type:
+        return
+
+    expires_at = time.monotonic() + get_proxy_content_type_ttl_seconds()
+    with _lock:
+        _cache[(channel_id, url)] = (content_type, expires_at)
+
+
+def clear_content_types():
+    """清空缓存（频道目录版本变化时调用）"""
+    with _lock:
+        _cache.clear()
@@ -5,27 +5,26 @@
 
 import socket
 import struct
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 from loguru import logger
+from sqlalchemy import bindparam, select, update
+from app.config import get_health_check_deep_probe_enabled
+from app.services.channel_catalog import bump_catalog_version
+from app.services.content_type_cache import get_cached_content_type, remember_content_type
+from app.services.hls_proxy import is_hls_content_type, is_hls_url
+from app.services.host_breaker import allow_request, host_key, record_host_failure, record_host_success
+from app.services.metrics import observe_health_check
+from app.services.multicast_relay import UDP_RECV_SIZE, open_multicast_socket, parse_multicast_url, strip_rtp_header
+from app.services.stream_probe import SAMPLE_READ_SIZE, UNHEALTHY, ProbeResult, SampleCollector, shallow_result
+from app.services.stream_urls import extract_rtp_udp_addr, probe_target_url
+from app.utils import http_pool
 from app.utils.datetime_utils import to_utc_naive
 
-def _extract_rtp_udp_addr(url):
-    """从 URL 中解析 RTP/UDP 地址。"""
-    if not url:
-        return ''
-
-    if url.startswith('rtp://'):
-        return url[6:]
-
-    if url.startswith('udp://'):
-        addr = url[6:]
-        if addr.startswith('@'):
-            return addr[1:]
-        return addr
-
-    return url
-
+# 健康状态写回时每条 UPDATE 覆盖的频道数
+WRITE_BATCH_SIZE = 500
 
 def _probe_udp_with_udpxy(addr, timeout, udpxy_url):
     """通过 UDPxy 拉流并读取少量数据验证可用性。"""
@@ -39,10 +38,14 @@ def _probe_udp_with_udpxy(addr, timeout, udpxy_url):
     stream_url = f"{udpxy_base}/udp/{addr}"
     response = None
     try:
-        response = requests.get(stream_url, timeout=timeout, stream=True)
+        response = http_pool.get(stream_url, timeout=timeout, stream=True)
         if response.status_code != 200:
             return False
-        chunk = next(response.iter_content(chunk_size=1024), None)
+        try:
+            chunk = next(response.iter_content(chunk_size=1024), None)
+        except requests.exceptions.RequestException:
+            # UDPxy 已响应但组播无数据，属于频道异常而非主机异常
+            return False
         return chunk is not None and len(chunk) > 0
     finally:
         if response is not None:
@@ -79,17 +82,106 @@ def _probe_udp_direct(addr, timeout, channel_name):
         sock.close()
 
 
+def _sample_response(response, started_at, channel_name):
+    """从已建立的流式响应中采样并分析码流（样本读取中断时分析已收到的部分）"""
+    collector = SampleCollector(started_at)
+    try:
+        for chunk in response.iter_content(chunk_size=SAMPLE_READ_SIZE):
+            if chunk and collector.feed(chunk):
+                break
+    except requests.exceptions.RequestException:
+        pass
+    return collector.evaluate(channel_name)
+
+
+def _deep_probe_http(channel_info, timeout):
+    """深度探测 HTTP(S) 源：GET 拉流采样，HLS 源只校验状态码与首字节耗时。"""
+    url = channel_info.get('url') or ''
+    started_at = time.perf_counter()
+    with http_pool.get(url, timeout=timeout, stream=True) as response:
+        if response.status_code >= 400:
+            return UNHEALTHY
+        content_type = response.headers.get('Content-Type')
+        remember_content_type(channel_info.get('id'), url, content_type)
+        if is_hls_url(url) or is_hls_content_type(content_type):
+            return ProbeResult(True, None, int((time.perf_counter() - started_at) * 1000))
+        return _sample_response(response, started_at, channel_info.get('name'))
+
+
+def _deep_probe_udpxy(addr, timeout, udpxy_url, channel_name):
+    """深度探测组播源（经 UDPxy）：拉流采样。"""
+    udpxy_base = (udpxy_url or '').rstrip('/')
+    if not addr or not udpxy_base:
+        return UNHEALTHY
+
+    started_at = time.perf_counter()
+    with http_pool.get(f"{udpxy_base}/udp/{addr}", timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            return UNHEALTHY
+        return _sample_response(response, started_at, channel_name)
+
+
+def _deep_probe_multicast(addr, timeout, channel_name):
+    """深度探测组播源（直连）：加入组播组采样，去除 RTP 头后分析。"""
+    if not addr:
+        return UNHEALTHY
+
+    group, port = parse_multicast_url(addr)
+    started_at = time.perf_counter()
+    collector = SampleCollector(started_at)
+    sock = open_multicast_socket(group, port)
+    try:
+        sock.settimeout(timeout)
+        while True:
+            packet, _ = sock.recvfrom(UDP_RECV_SIZE)
+            _, payload = strip_rtp_header(packet)
+            if payload and collector.feed(payload):
+                break
+    except socket.timeout:
+        pass
+    finally:
+        sock.close()
+    return collector.evaluate(channel_name)
+
+
+def _deep_check_channel_once(channel_info, timeout, udpxy_enabled, udpxy_url):
+    """执行单次深度检测，不包含重试逻辑。"""
+    protocol = (channel_info.get('protocol') or '').lower()
+
+    if protocol in ('http', 'https'):
+        return _deep_probe_http(channel_info, timeout)
+
+    if protocol in ('rtp', 'udp'):
+        addr = extract_rtp_udp_addr(channel_info.get('url') or '')
+        if udpxy_enabled:
+            return _deep_probe_udpxy(addr, timeout, udpxy_url, channel_info.get('name'))
+        return _deep_probe_multicast(addr, timeout, channel_info.get('name'))
+
+    return UNHEALTHY
+
+
 def _check_channel_once(channel_info, timeout, udpxy_enabled, udpxy_url):
-    """执行单次检测，不包含重试逻辑。"""
+    """执行单次检测，不包含重试逻辑，返回 ProbeResult。"""
+    if get_health_check_deep_probe_enabled():
+        return _deep_check_channel_once(channel_info, timeout, udpxy_enabled, udpxy_url)
+    return shallow_result(_shallow_check_channel_once(channel_info, timeout, udpxy_enabled, udpxy_url))
+
+
+def _shallow_check_channel_once(channel_info, timeout, udpxy_enabled, udpxy_url):
+    """按响应状态码 / 首块数据检测。"""
     protocol = (channel_info.get('protocol') or '').lower()
     url = channel_info.get('url') or ''
 
     if protocol in ('http', 'https'):
-        response = requests.head(url, timeout=timeout, allow_redirects=True)
-        return response.status_code < 400
+        response = http_pool.head(url, timeout=timeout, allow_redirects=True)
+        if response.status_code < 400:
+            # 顺带学习 Content-Type，检测结束后写回频道供流代理启动时直接使用
+            remember_content_type(channel_info.get('id'), url, response.headers.get('Content-Type'))
+            return True
+        return False
 
     if protocol in ('rtp', 'udp'):
-        addr = _extract_rtp_udp_addr(url)
+        addr = extract_rtp_udp_addr(url)
         if udpxy_enabled:
             return _probe_udp_with_udpxy(addr, timeout, udpxy_url)
         return _probe_udp_direct(addr, timeout, channel_info.get('name'))
@@ -97,33 +189,189 @@ def _check_channel_once(channel_info, timeout, udpxy_enabled, udpxy_url):
     return False
 
 
-def _check_channel_with_retry(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url):
-    """检测单个频道健康状态，带重试。"""
+def _check_channel_with_retry(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url, host_semaphore=None):
+    """检测单个频道健康状态，带重试，并记录检测耗时与结果。"""
+    started_at = time.perf_counter()
+    if host_semaphore is None:
+        result = _probe_channel_with_retry(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url)
+    else:
+        with host_semaphore:
+            result = _probe_channel_with_retry(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url)
+    observe_health_check(result.is_healthy, time.perf_counter() - started_at)
+    return result
+
+
+def _probe_channel_with_retry(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url):
+    """按重试次数探测频道，任一次成功即返回；所在主机熔断时直接判为异常。"""
+    target_url = probe_target_url(channel_info, udpxy_enabled, udpxy_url)
+    result = UNHEALTHY
     for attempt in range(max_retries + 1):
+        if not allow_request(target_url):
+            return result
         try:
-            is_healthy = _check_channel_once(channel_info, timeout, udpxy_enabled, udpxy_url)
+            result = _check_channel_once(channel_info, timeout, udpxy_enabled, udpxy_url)
+            record_host_success(target_url)
         except requests.exceptions.RequestException:
-            is_healthy = False
+            record_host_failure(target_url)
         except Exception as e:
             if attempt == max_retries:
                 logger.error(f"健康检测异常 - 频道 {channel_info.get('id')}: {e}")
-            is_healthy = False
 
-        if is_healthy:
-            return True
+        if result.is_healthy:
+            return result
 
         if attempt < max_retries:
             logger.debug(
                 f"频道 {channel_info.get('name')} 检测失败，正在重试 ({attempt + 1}/{max_retries})..."
             )
 
-    return False
+    # 保留最后一次深度探测测得的码率与首字节耗时
+    return result
 
 
-def _check_channel_task(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url):
+def _check_channel_task(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url, host_semaphore=None):
     """线程池任务：只做网络探测，不触碰数据库会话。"""
-    is_healthy = _check_channel_with_retry(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url)
-    return channel_info['id'], is_healthy
+    result = _check_channel_with_retry(
+        channel_info, timeout, max_retries, udpxy_enabled, udpxy_url, host_semaphore
+    )
+    return channel_info['id'], result
+
+
+def _stream_metrics(result_by_channel_id):
+    """取出测得码率或首字节耗时的检测结果（浅层探测不覆盖已有测量值）"""
+    return {
+        channel_id: result
+        for channel_id, result in result_by_channel_id.items()
+        if result.bitrate_kbps is not None or result.first_byte_ms is not None
+    }
+
+
+def _bulk_update_channels(channel_ids, values):
+    """
+    按频道 ID 分批执行 UPDATE（不提交）
+    显式保留 updated_at：健康检测写回不属于频道编辑，不触发 onupdate
+    """
+    from app import db
+    from app.models.channel import Channel
+
+    for start in range(0, len(channel_ids), WRITE_BATCH_SIZE):
+        db.session.execute(
+            update(Channel)
+            .where(Channel.id.in_(channel_ids[start:start + WRITE_BATCH_SIZE]))
+            .values(updated_at=Channel.updated_at, **values)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _save_stream_metrics(metrics_by_channel_id):
+    """按主键批量写回深度探测测得的码率与首字节耗时（executemany，不提交）"""
+    from app import db
+    from app.models.channel import Channel
+
+    if not metrics_by_channel_id:
+        return
+    channel_table = Channel.__table__
+    statement = (
+        channel_table.update()
+        .where(channel_table.c.id == bindparam('channel_id'))
+        .values(
+            bitrate_kbps=bindparam('bitrate_kbps'),
+            first_byte_ms=bindparam('first_byte_ms'),
+            updated_at=channel_table.c.updated_at
+        )
+    )
+    rows = [
+        {
+            'channel_id': channel_id,
+            'bitrate_kbps': result.bitrate_kbps,
+            'first_byte_ms': result.first_byte_ms
+        }
+        for channel_id, result in sorted(metrics_by_channel_id.items())
+    ]
+    for start in range(0, len(rows), WRITE_BATCH_SIZE):
+        db.session.execute(statement, rows[start:start + WRITE_BATCH_SIZE])
+
+
+def _learned_content_types(channels):
+    """
+    取出本轮探测学到、且与频道现有值不同的主源 Content-Type
+    参数:
+        channels: 含 id / url / content_type 的频道行或模型
+    返回:
+        dict: {channel_id: (探测地址, Content-Type)}
+    """
+    learned = {}
+    for channel in channels:
+        content_type = get_cached_content_type(channel.id, channel.url)
+        if content_type and content_type != channel.content_type:
+            learned[channel.id] = (channel.url, content_type)
+    return learned
+
+
+def _save_content_types(content_types_by_channel_id):
+    """
+    写回学到的 Content-Type（executemany，不提交）
+    按探测时的地址做条件更新：探测期间地址被修改的频道不会写入旧地址的类型
+    """
+    from app import db
+    from app.models.channel import Channel
+
+    if not content_types_by_channel_id:
+        return
+    channel_table = Channel.__table__
+    statement = (
+        channel_table.update()
+        .where(channel_table.c.id == bindparam('channel_id'), channel_table.c.url == bindparam('probed_url'))
+        .values(content_type=bindparam('content_type'), updated_at=channel_table.c.updated_at)
+    )
+    rows = [
+        {'channel_id': channel_id, 'probed_url': url, 'content_type': content_type}
+        for channel_id, (url, content_type) in sorted(content_types_by_channel_id.items())
+    ]
+    for start in range(0, len(rows), WRITE_BATCH_SIZE):
+        db.session.execute(statement, rows[start:start + WRITE_BATCH_SIZE])
+
+
+def _save_probe_results(previous_by_channel_id, health_by_channel_id, now, metrics_by_channel_id=None,
+                        content_types_by_channel_id=None):
+    """
+    写回检测结果并提交：只有状态变化的频道更新 is_healthy，全部频道更新 last_check，
+    深度探测测得码率 / 首字节耗时的频道一并更新，学到新 Content-Type 的频道更新 content_type，
+    有状态或 Content-Type 变化时才更新频道目录版本号
+    参数:
+        previous_by_channel_id: {channel_id: 检测前的 is_healthy}
+        health_by_channel_id: {channel_id: 本次检测结果}
+        metrics_by_channel_id: {channel_id: ProbeResult}，仅包含测得码率或首字节耗时的频道
+        content_types_by_channel_id: {channel_id: (探测地址, Content-Type)}，见 _learned_content_types
+    返回:
+        int: 状态变化的频道数
+    """
+    from app import db
+    from app.services.health_schedule import record_probe_results
+
+    changed_by_value = {True: [], False: []}
+    for channel_id, is_healthy in health_by_channel_id.items():
+        if previous_by_channel_id.get(channel_id) is not is_healthy:
+            changed_by_value[is_healthy].append(channel_id)
+    changed = len(changed_by_value[True]) + len(changed_by_value[False])
+
+    try:
+        for is_healthy, channel_ids in changed_by_value.items():
+            if channel_ids:
+                _bulk_update_channels(sorted(channel_ids), {'is_healthy': is_healthy})
+        _bulk_update_channels(sorted(health_by_channel_id), {'last_check': now})
+        _save_stream_metrics(metrics_by_channel_id)
+        _save_content_types(content_types_by_channel_id)
+        record_probe_results(health_by_channel_id, now)
+        if changed or content_types_by_channel_id:
+            # 健康状态影响主源 / 备用源顺序、Content-Type 影响转发方式，通知各进程重载频道快照
+            bump_catalog_version()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return changed
 
 
 def check_channel_health(channel, max_retries=None):
@@ -159,32 +407,97 @@ def check_channel_health(channel, max_retries=None):
         'url': channel_obj.url,
         'protocol': channel_obj.protocol
     }
-    is_healthy = _check_channel_with_retry(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url)
+    previous_is_healthy = channel_obj.is_healthy
+    # 探测期间不持有事务，写回时再开启新的短事务
+    db.session.commit()
+    result = _check_channel_with_retry(channel_info, timeout, max_retries, udpxy_enabled, udpxy_url)
+
+    _save_probe_results(
+        {channel_info['id']: previous_is_healthy},
+        {channel_info['id']: result.is_healthy},
+        to_utc_naive(),
+        _stream_metrics({channel_info['id']: result}),
+        _learned_content_types([channel_obj])
+    )
+    return result.is_healthy
 
-    channel_obj.is_healthy = is_healthy
-    channel_obj.last_check = to_utc_naive()
-    try:
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        raise
 
-    return is_healthy
+def _probe_with_threads(channel_infos, timeout, max_retries, udpxy_enabled, udpxy_url):
+    """线程池并发探测，返回 {channel_id: ProbeResult}"""
+    from app.config import get_health_check_host_concurrency, get_health_check_threads
 
+    max_workers = max(1, int(get_health_check_threads()))
+    logger.info(f"开始多线程健康检测，线程数: {max_workers}，频道数: {len(channel_infos)}")
 
-def check_all_channels():
-    """检测所有活跃频道（多线程）"""
+    # 同一主机（含 UDPxy）同时进行的探测数受限，避免并发打满单个源站
+    host_concurrency = get_health_check_host_concurrency()
+    host_semaphores = {}
+    for channel_info in channel_infos:
+        key = host_key(probe_target_url(channel_info, udpxy_enabled, udpxy_url))
+        if key is not None and key not in host_semaphores:
+            host_semaphores[key] = threading.BoundedSemaphore(host_concurrency)
+
+    result_by_channel_id = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_channel = {
+            executor.submit(
+                _check_channel_task,
+                channel_info,
+                timeout,
+                max_retries,
+                udpxy_enabled,
+                udpxy_url,
+                host_semaphores.get(host_key(probe_target_url(channel_info, udpxy_enabled, udpxy_url)))
+            ): channel_info
+            for channel_info in channel_infos
+        }
+
+        for future in as_completed(future_to_channel):
+            channel_info = future_to_channel[future]
+            try:
+                channel_id, result = future.result()
+            except Exception as e:
+                channel_id = channel_info['id']
+                result = UNHEALTHY
+                logger.error(f"检测频道 {channel_info['name']} 时发生异常: {e}")
+
+            result_by_channel_id[channel_id] = result
+
+    return result_by_channel_id
+
+
+def _probe_with_event_loop(channel_infos, timeout, max_retries, udpxy_enabled, udpxy_url):
+    """事件循环并发探测，返回 {channel_id: ProbeResult}"""
+    from app.config import get_health_check_concurrency, get_health_check_host_concurrency
+    from app.services.async_health_prober import probe_channels
+
+    concurrency = get_health_check_concurrency()
+    host_concurrency = get_health_check_host_concurrency()
+    logger.info(
+        f"开始异步健康检测，并发数: {concurrency}，单主机并发数: {host_concurrency}，频道数: {len(channel_infos)}"
+    )
+    return probe_channels(
+        channel_infos, timeout, max_retries, udpxy_enabled, udpxy_url, concurrency, host_concurrency
+    )
+
+
+def _check_channels(channels):
+    """
+    探测给定频道并写回健康状态与下次检测时间（按配置使用事件循环或线程池并发探测）
+    参数:
+        channels: 含 id / name / url / protocol / is_healthy / content_type 的频道行
+    返回:
+        dict: {total, healthy, unhealthy, changed}
+    """
     from app import db
-    from app.models.channel import Channel
     from app.config import (
-        get_health_check_threads,
+        get_health_check_engine,
         get_health_check_timeout,
         get_health_check_max_retries,
         get_udpxy_enabled,
         get_udpxy_url
     )
 
-    channels = Channel.query.filter_by(is_active=True).all()
     channel_infos = [
         {
             'id': channel.id,
@@ -194,67 +507,87 @@ def check_all_channels():
         }
         for channel in channels
     ]
+    previous_by_channel_id = {channel.id: channel.is_healthy for channel in channels}
+    # 结束读取频道时开启的事务：探测期间不持有事务与连接，写回时再开启新的短事务
+    db.session.commit()
 
     results = {
         'total': len(channel_infos),
         'healthy': 0,
-        'unhealthy': 0
+        'unhealthy': 0,
+        'changed': 0
     }
 
     if not channel_infos:
         return results
 
-    max_workers = max(1, int(get_health_check_threads()))
     timeout = max(1, int(get_health_check_timeout()))
     max_retries = max(0, int(get_health_check_max_retries()))
     udpxy_enabled = get_udpxy_enabled()
     udpxy_url = get_udpxy_url()
 
-    logger.info(f"开始多线程健康检测，线程数: {max_workers}，频道数: {len(channel_infos)}")
+    if get_health_check_engine() == 'thread':
+        probe = _probe_with_threads
+    else:
+        probe = _probe_with_event_loop
+    started_at = time.perf_counter()
+    result_by_channel_id = probe(channel_infos, timeout, max_retries, udpxy_enabled, udpxy_url)
+    logger.info(f"健康检测探测完成，频道数: {len(channel_infos)}，耗时: {time.perf_counter() - started_at:.1f}s")
 
-    health_by_channel_id = {}
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_channel = {
-            executor.submit(
-                _check_channel_task,
-                channel_info,
-                timeout,
-                max_retries,
-                udpxy_enabled,
-                udpxy_url
-            ): channel_info
-            for channel_info in channel_infos
-        }
+    result_by_channel_id = {
+        channel.id: result_by_channel_id.get(channel.id, UNHEALTHY) for channel in channels
+    }
+    health_by_channel_id = {
+        channel_id: result.is_healthy for channel_id, result in result_by_channel_id.items()
+    }
+    results['healthy'] = sum(health_by_channel_id.values())
+    results['unhealthy'] = results['total'] - results['healthy']
+    results['changed'] = _save_probe_results(
+        previous_by_channel_id,
+        health_by_channel_id,
+        to_utc_naive(),
+        _stream_metrics(result_by_channel_id),
+        _learned_content_types(channels)
+    )
+    return results
 
-        for future in as_completed(future_to_channel):
-            channel_info = future_to_channel[future]
-            try:
-                channel_id, is_healthy = future.result()
-            except Exception as e:
-                channel_id = channel_info['id']
-                is_healthy = False
-                logger.error(f"检测频道 {channel_info['name']} 时发生异常: {e}")
 
-            health_by_channel_id[channel_id] = is_healthy
-            if is_healthy:
-                results['healthy'] += 1
-            else:
-                results['unhealthy'] += 1
+def check_all_channels():
+    """检测所有活跃频道"""
+    from app import db
+    from app.models.channel import Channel
 
-    now = to_utc_naive()
-    for channel in channels:
-        channel.is_healthy = health_by_channel_id.get(channel.id, False)
-        channel.last_check = now
+    return _check_channels(db.session.execute(
+        select(Channel.id, Channel.name, Channel.url, Channel.protocol, Channel.is_healthy, Channel.content_type)
+        .where(Channel.is_active == db.true())
+    ).all())
 
-    try:
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        raise
 
-    return results
+def check_due_channels():
+    """
+    检测待检队列中已到期的活跃频道（自适应调度）
+    每次最多检测 HEALTH_CHECK_BATCH_SIZE 个，其余留到下个轮询周期
+    """
+    from app import db
+    from app.config import get_health_check_batch_size
+    from app.services.health_schedule import pull_due_channels, sync_health_schedules
+
+    now = to_utc_naive()
+    queued = sync_health_schedules(now)
+    if queued:
+        logger.info(f"新加入健康检测队列的频道数: {queued}")
+    channels = pull_due_channels(now, get_health_check_batch_size())
+    # 先提交队列补齐与删除，探测期间不持有事务（SQLite 下会一直占用写锁）
+    db.session.commit()
+    if not channels:
+        return {'total': 0, 'healthy': 0, 'unhealthy': 0, 'changed': 0}
+    return _check_channels(channels)
 
 
 def run_health_worker_cycle():
     """执行一次健康检测 worker 周期。"""
+    from app.config import get_health_check_adaptive_enabled
+
+    if get_health_check_adaptive_enabled():
+        return check_due_channels()
     return check_all_channels()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+频道健康检测自适应调度
+
+每个频道在 channel_health_schedules 表中有一行待检记录，health-worker 每个轮询周期
+按 next_check_at 拉取到期频道探测，并根据最近结果计算各自的下次检测时间：
+- 持续健康的频道从 HEALTH_CHECK_INTERVAL 起逐次加倍，最长 HEALTH_CHECK_MAX_INTERVAL；
+- 检测失败的频道从 HEALTH_CHECK_MIN_INTERVAL 起逐次加倍，最长 HEALTH_CHECK_INTERVAL；
+- 近期状态反复翻转的频道检测间隔不超过 HEALTH_CHECK_INTERVAL 的四分之一。
+下次检测时间带有随机抖动，新加入队列的频道在一个检测间隔内随机分布，避免集中探测。
+"""
+
+import random
+from datetime import timedelta
+
+from sqlalchemy import delete, exists, insert, select, update
+
+from app import db
+from app.config import (
+    get_health_check_interval_seconds,
+    get_health_check_max_interval_seconds,
+    get_health_check_min_interval_seconds
+)
+from app.models.channel import Channel
+from app.models.channel_health_schedule import ChannelHealthSchedule
+
+# 下次检测时间的随机抖动比例（±10%）
+JITTER_RATIO = 0.1
+# 近期翻转次数达到该值视为状态抖动
+FLAP_THRESHOLD = 2
+# 同一结果连续出现该次数后清零翻转计数
+FLAP_RESET_STREAK = 5
+# 状态抖动频道的检测间隔上限为基础间隔的 1/4
+FLAPPING_INTERVAL_DIVISOR = 4
+# 按频道 ID 批量读写待检记录时每批的数量
+SCHEDULE_BATCH_SIZE = 500
+
+
+def _get_intervals():
+    base_interval = get_health_check_interval_seconds()
+    min_interval = min(get_health_check_min_interval_seconds(), base_interval)
+    max_interval = max(get_health_check_max_interval_seconds(), base_interval)
+    return base_interval, min_interval, max_interval
+
+
+def _next_interval_seconds(successes, failures, flap_count, intervals):
+    """按连续成功 / 失败次数与翻转次数计算下次检测间隔（秒，未加抖动）"""
+    base_interval, min_interval, max_interval = intervals
+    if failures:
+        interval = min(base_interval, min_interval * 2 ** min(failures - 1, 16))
+    else:
+        interval = min(max_interval, base_interval * 2 ** min(max(successes - 1, 0), 16))
+    if flap_count >= FLAP_THRESHOLD:
+        interval = min(interval, max(min_interval, base_interval // FLAPPING_INTERVAL_DIVISOR))
+    return interval
+
+
+def _jittered(now, interval_seconds):
+    return now + timedelta(seconds=interval_seconds * random.uniform(1 - JITTER_RATIO, 1 + JITTER_RATIO))
+
+
+def _apply_result(row, is_healthy, now, intervals):
+    """根据本次检测结果更新待检记录字段（row 为 dict）"""
+    if row['last_result'] is not None and row['last_result'] != is_healthy:
+        row['flap_count'] += 1
+
+    if is_healthy:
+        row['consecutive_successes'] += 1
+        row['consecutive_failures'] = 0
+        streak = row['consecutive_successes']
+    else:
+        row['consecutive_failures'] += 1
+        row['consecutive_successes'] = 0
+        streak = row['consecutive_failures']
+    if streak >= FLAP_RESET_STREAK:
+        row['flap_count'] = 0
+
+    row['last_result'] = is_healthy
+    row['last_probe_at'] = now
+    row['next_check_at'] = _jittered(
+        now,
+        _next_interval_seconds(
+            row['consecutive_successes'], row['consecutive_failures'], row['flap_count'], intervals
+        )
+    )
+    return row
+
+
+def _iter_batches(items, batch_size=SCHEDULE_BATCH_SIZE):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def sync_health_schedules(now):
+    """
+    补齐活跃频道的待检记录，并删除已删除频道的记录（不提交，需在 app context 内调用）
+    从未检测过的频道立即到期，其余频道的首次检测时间在一个基础间隔内随机分布
+    返回:
+        int: 新加入队列的频道数
+    """
+    db.session.execute(
+        delete(ChannelHealthSchedule).where(
+            ~exists().where(Channel.id == ChannelHealthSchedule.channel_id)
+        ).execution_options(synchronize_session=False)
+    )
+
+    missing = db.session.execute(
+        select(Channel.id, Channel.last_check)
+        .outerjoin(ChannelHealthSchedule, ChannelHealthSchedule.channel_id == Channel.id)
+        .where(Channel.is_active == db.true(), ChannelHealthSchedule.channel_id.is_(None))
+    ).all()
+    if not missing:
+        return 0
+
+    base_interval = get_health_check_interval_seconds()
+    rows = [
+        {
+            'channel_id': channel_id,
+            'next_check_at': now if last_check is None else now + timedelta(
+                seconds=random.uniform(0, base_interval)
+            ),
+            'consecutive_successes': 0,
+            'consecutive_failures': 0,
+            'flap_count': 0
+        }
+        for channel_id, last_check in missing
+    ]
+    for batch in _iter_batches(rows):
+        db.session.execute(insert(ChannelHealthSchedule), batch)
+    return len(rows)
+
+
+def pull_due_channels(now, limit):
+    """
+    按到期先后取出到期的活跃频道（需在 app context 内调用）
+    返回:
+        list[Row]: (id, name, url, protocol, is_healthy, content_type)
+    """
+    return db.session.execute(
+        select(Channel.id, Channel.name, Channel.url, Channel.protocol, Channel.is_healthy, Channel.content_type)
+        .join(ChannelHealthSchedule, ChannelHealthSchedule.channel_id == Channel.id)
+        .where(Channel.is_active == db.true(), ChannelHealthSchedule.next_check_at <= now)
+        .order_by(ChannelHealthSchedule.next_check_at, Channel.id)
+        .limit(limit)
+    ).all()
+
+
+def record_probe_results(health_by_channel_id, now):
+    """
+    按检测结果重新计算各频道的下次检测时间（不提交，随健康状态写回一起提交）
+    参数:
+        health_by_channel_id: {channel_id: is_healthy}，全量检测、单频道检测与到期检测共用
+    """
+    intervals = _get_intervals()
+    channel_ids = sorted(health_by_channel_id)
+    columns = (
+        ChannelHealthSchedule.channel_id,
+        ChannelHealthSchedule.last_result,
+        ChannelHealthSchedule.consecutive_successes,
+        ChannelHealthSchedule.consecutive_failures,
+        ChannelHealthSchedule.flap_count
+    )
+
+    for batch_ids in _iter_batches(channel_ids):
+        existing = {
+            row.channel_id: row._asdict()
+            for row in db.session.execute(
+                select(*columns).where(ChannelHealthSchedule.channel_id.in_(batch_ids))
+            )
+        }
+
+        updates = []
+        inserts = []
+        for channel_id in batch_ids:
+            row = existing.get(channel_id)
+            if row is None:
+                row = {
+                    'channel_id': channel_id,
+                    'last_result': None,
+                    'consecutive_successes': 0,
+                    'consecutive_failures': 0,
+                    'flap_count': 0
+                }
+                inserts.append(row)
+            else:
+                updates.append(row)
+            _apply_result(row, bool(health_by_channel_id[channel_id]), now, intervals)
+
+        if inserts:
+            db.session.execute(insert(ChannelHealthSchedule), inserts)
+        if updates:
+            # 按主键批量更新（executemany）
+            db.session.execute(update(ChannelHealthSchedule), updates)
+
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+进程内心跳聚合服务
+
+流代理每收到数据就在内存中记录连接的最新心跳时间，后台线程按心跳间隔
+把本进程内全部心跳合并为批量 UPDATE 写入数据库（每个周期一次提交），
+代替每条连接各自 UPDATE + COMMIT。
+"""
+
+import os
+import threading
+import time
+
+from loguru import logger
+
+from app.config import get_heartbeat_interval_seconds
+from app.services.metrics import db_query_scope, observe_heartbeat_flush, record_heartbeat_flush_failure
+from app.services.watch_history_saver import update_connection_heartbeats
+
+
+class HeartbeatAggregator:
+    """按进程聚合活跃连接心跳并定期批量落库"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._app = None
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            'flush_count': 0,
+            'flush_failures': 0,
+            'rows_flushed': 0,
+            'last_flush_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def ensure_started(self, app):
+        """确保当前进程的落库线程已启动（兼容 Gunicorn preload 后 fork）"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # fork 后继承的待写心跳属于父进程，直接丢弃
+                self._pending = {}
+            self._app = app
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='heartbeat-aggregator', daemon=True)
+            self._thread.start()
+            logger.debug(f"心跳聚合线程已启动: pid={pid}")
+
+    def record(self, connection_id, heartbeat_time):
+        """记录连接最新心跳（仅内存操作，由后台线程批量落库）"""
+        with self._lock:
+            self._pending[connection_id] = heartbeat_time
+
+    def discard(self, connection_id):
+        """连接结束时移除尚未落库的心跳"""
+        with self._lock:
+            self._pending.pop(connection_id, None)
+
+    def flush(self):
+        """
+        立即把待写心跳批量落库（需在 app context 内调用）
+        返回:
+            int: 本次提交的心跳条数
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        started_at = time.perf_counter()
+        try:
+            update_connection_heartbeats(pending)
+        except Exception as e:
+            with self._lock:
+                # 写入失败时合并回待写队列，保留更新的心跳时间
+                for connection_id, heartbeat_time in pending.items():
+                    current = self._pending.get(connection_id)
+                    if current is None or current < heartbeat_time:
+                        self._pending[connection_id] = heartbeat_time
+                self._stats['flush_failures'] += 1
+            record_heartbeat_flush_failure()
+            logger.error(f"批量更新连接心跳失败: size={len(pending)}, error={e}")
+            return 0
+
+        elapsed_seconds = time.perf_counter() - started_at
+        observe_heartbeat_flush(elapsed_seconds, len(pending))
+        elapsed_ms = elapsed_seconds * 1000
+        with self._lock:
+            self._stats['flush_count'] += 1
+            self._stats['rows_flushed'] += len(pending)
+            self._stats['last_flush_size'] = len(pending)
+            self._stats['last_flush_ms'] = round(elapsed_ms, 3)
+            self._stats['max_flush_ms'] = round(max(self._stats['max_flush_ms'], elapsed_ms), 3)
+            self._stats['total_flush_ms'] += elapsed_ms
+        return len(pending)
+
+    def _run(self):
+        while True:
+            time.sleep(get_heartbeat_interval_seconds())
+            try:
+                with self._app.app_context(), db_query_scope('heartbeat_flush'):
+                    self.flush()
+            except Exception as e:
+                logger.error(f"心跳聚合线程执行失败: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['total_flush_ms'] = round(stats['total_flush_ms'], 3)
+        return stats
+
+
+heartbeat_aggregator = HeartbeatAggregator()
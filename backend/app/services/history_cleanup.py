@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+观看历史分批清理
+
+只删除已结束且已计入日汇总表的记录，每批一条 DELETE 并单独提交，批次之间让出数据库，
+避免长时间锁表阻塞心跳与开播写入。日汇总只由 history-worker 维护，清理任务不做汇总，
+尚未汇总的记录留到下次清理。任务进度保存在 settings 表中，
+任一进程（worker 的保留策略任务、Web 进程的手动清理）同一时刻只运行一个清理任务。
+"""
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from loguru import logger
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.config import (
+    get_history_cleanup_batch_pause_seconds,
+    get_history_cleanup_batch_size,
+    get_history_retention_days
+)
+from app.models.settings import Settings
+from app.models.watch_history import WatchHistory
+from app.utils.datetime_utils import to_iso8601_utc, to_utc_naive
+
+# 按保留天数清理（worker 定时执行）
+MODE_RETENTION = 'retention'
+# 清空全部已结束记录（手动触发）
+MODE_ALL = 'all'
+
+STATE_RUNNING = 'running'
+STATE_FINISHED = 'finished'
+STATE_FAILED = 'failed'
+
+# 运行中的任务超过该时间未更新进度视为已中断（进程退出等），允许重新启动
+STALE_RUNNING_SECONDS = 120
+
+
+def _parse_iso8601_utc(value):
+    try:
+        return datetime.fromisoformat(value.rstrip('Z'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _load_status_row():
+    return Settings.query.filter_by(key=Settings.KEY_HISTORY_CLEANUP_STATUS).first()
+
+
+def _decode_status(raw_value):
+    try:
+        status = json.loads(raw_value) if raw_value else None
+    except ValueError:
+        status = None
+    return status if isinstance(status, dict) else None
+
+
+def _is_running(status, now):
+    if not status or status.get('state') != STATE_RUNNING:
+        return False
+    updated_at = _parse_iso8601_utc(status.get('updated_at'))
+    return updated_at is not None and (now - updated_at).total_seconds() < STALE_RUNNING_SECONDS
+
+
+def get_history_cleanup_status():
+    """
+    获取最近一次清理任务的状态（需在 app context 内调用）
+    返回:
+        dict: 从未执行过清理时返回 None
+    """
+    row = _load_status_row()
+    status = _decode_status(row.value if row else None)
+    if status and status.get('state') == STATE_RUNNING and not _is_running(status, to_utc_naive()):
+        status['state'] = STATE_FAILED
+        status['error'] = status.get('error') or '任务已中断'
+    return status
+
+
+def _claim(mode):
+    """
+    原子地把任务状态置为运行中（比较并替换 settings 中的状态值）
+    返回:
+        tuple: (是否成功, 当前状态)
+    """
+    now = to_utc_naive()
+    row = _load_status_row()
+    previous_raw = row.value if row else None
+    previous = _decode_status(previous_raw)
+    if _is_running(previous, now):
+        db.session.rollback()
+        return False, previous
+
+    cutoff_date = None
+    if mode == MODE_RETENTION:
+        cutoff_date = (now.date() - timedelta(days=get_history_retention_days())).isoformat()
+
+    status = {
+        'state': STATE_RUNNING,
+        'mode': mode,
+        'cutoff_date': cutoff_date,
+        'deleted': 0,
+        'pending_rollup': 0,
+        'batches': 0,
+        'started_at': to_iso8601_utc(now),
+        'updated_at': to_iso8601_utc(now),
+        'finished_at': None,
+        'error': None
+    }
+    raw_value = json.dumps(status)
+
+    try:
+        if row is None:
+            db.session.add(Settings(key=Settings.KEY_HISTORY_CLEANUP_STATUS, value=raw_value))
+            db.session.commit()
+            return True, status
+
+        result = db.session.execute(
+            update(Settings).where(
+                Settings.key == Settings.KEY_HISTORY_CLEANUP_STATUS,
+                Settings.value == previous_raw
+            ).values(value=raw_value).execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except IntegrityError:
+        # 其他进程同时创建了状态行
+        db.session.rollback()
+        return False, get_history_cleanup_status()
+
+    if result.rowcount != 1:
+        return False, get_history_cleanup_status()
+    return True, status
+
+
+def _save_status(status):
+    """写入任务状态（不提交，随当前批次一起提交）"""
+    status['updated_at'] = to_iso8601_utc(to_utc_naive())
+    db.session.execute(
+        update(Settings).where(
+            Settings.key == Settings.KEY_HISTORY_CLEANUP_STATUS
+        ).values(value=json.dumps(status)).execution_options(synchronize_session=False)
+    )
+
+
+def _cleanup_filter(status):
+    conditions = [
+        WatchHistory.end_time.isnot(None),
+        WatchHistory.rolled_up == db.true()
+    ]
+    if status.get('cutoff_date'):
+        conditions.append(WatchHistory.watch_date < datetime.fromisoformat(status['cutoff_date']).date())
+    return conditions
+
+
+def _run(status):
+    """分批执行清理（需在 app context 内调用）"""
+    batch_size = get_history_cleanup_batch_size()
+    pause_seconds = get_history_cleanup_batch_pause_seconds()
+
+    try:
+        conditions = _cleanup_filter(status)
+        while True:
+            history_ids = db.session.scalars(
+                select(WatchHistory.id).where(*conditions).order_by(WatchHistory.id).limit(batch_size)
+            ).all()
+            if not history_ids:
+                break
+
+            result = db.session.execute(
+                delete(WatchHistory).where(
+                    WatchHistory.id.in_(history_ids)
+                ).execution_options(synchronize_session=False)
+            )
+            status['deleted'] += result.rowcount or 0
+            status['batches'] += 1
+            _save_status(status)
+            db.session.commit()
+
+            if len(history_ids) < batch_size:
+                break
+            if pause_seconds:
+                time.sleep(pause_seconds)
+
+        # 已结束但 worker 尚未汇总的记录不删除，仪表盘统计不受清理影响
+        status['pending_rollup'] = db.session.scalar(
+            select(func.count(WatchHistory.id)).where(
+                WatchHistory.end_time.isnot(None),
+                WatchHistory.rolled_up == db.false()
+            )
+        ) or 0
+        status['state'] = STATE_FINISHED
+    except Exception as e:
+        db.session.rollback()
+        status['state'] = STATE_FAILED
+        status['error'] = str(e)
+        logger.error(f"观看历史清理失败: mode={status['mode']}, error={e}")
+
+    status['finished_at'] = to_iso8601_utc(to_utc_naive())
+    _save_status(status)
+    db.session.commit()
+
+    if status['state'] == STATE_FINISHED:
+        logger.info(
+            "观看历史清理完成: "
+            f"mode={status['mode']}, 删除={status['deleted']}, 批次={status['batches']}, "
+            f"待汇总未删除={status['pending_rollup']}"
+        )
+    return status
+
+
+def run_history_retention():
+    """
+    按保留天数清理观看历史（worker 调用，同步执行，需在 app context 内调用）
+    返回:
+        dict: 任务状态；已有清理任务在运行时返回 None
+    """
+    claimed, status = _claim(MODE_RETENTION)
+    if not claimed:
+        logger.info("已有观看历史清理任务在运行，跳过本次保留策略清理")
+        return None
+    return _run(status)
+
+
+def start_history_cleanup(app, mode=MODE_ALL):
+    """
+    在后台线程中启动清理任务，立即返回（需在 app context 内调用）
+    返回:
+        tuple: (是否已启动, 当前状态)
+    """
+    claimed, status = _claim(mode)
+    if not claimed:
+        return False, status
+
+    def run_in_background():
+        with app.app_context():
+            _run(status)
+
+    started_status = dict(status)
+    threading.Thread(target=run_in_background, name='history-cleanup', daemon=True).start()
+    return True, started_status
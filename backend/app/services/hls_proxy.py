@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+HLS 代理服务（m3u8 改写 + 分片缓存）
+
+频道源为 m3u8 时，播放列表中的子列表、分片、密钥等 URI 全部改写为经由本服务的地址，
+上游地址以签名参数携带，避免被当作任意 URL 代理使用；分片经 segment_cache 回源，
+同频道的并发观众直接命中缓存。
+"""
+
+import base64
+import hashlib
+import hmac
+import re
+import threading
+import time
+from urllib.parse import urlencode, urljoin, urlsplit
+
+from app.config import get_hls_playlist_cache_seconds
+from app.services.segment_cache import segment_cache
+from app.utils import http_pool
+from app.utils.jwt import derive_signing_key
+
+HLS_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+HLS_CONTENT_TYPES = (
+    'application/vnd.apple.mpegurl',
+    'application/x-mpegurl',
+    'audio/mpegurl',
+    'audio/x-mpegurl'
+)
+UPSTREAM_TIMEOUT_SECONDS = 15
+# 上游为媒体播放列表时，包装成单码率主列表使用的占位码率
+DEFAULT_VARIANT_BANDWIDTH = 2000000
+
+# 这些标签的 URI 属性指向子播放列表，其余（KEY/MAP/PART 等）按分片处理
+_PLAYLIST_URI_TAGS = ('#EXT-X-MEDIA:', '#EXT-X-I-FRAME-STREAM-INF:')
+_URI_ATTR_PATTERN = re.compile(r'URI="([^"]*)"')
+
+_playlist_lock = threading.Lock()
+_playlist_cache = {}
+
+
+class HlsProxyError(Exception):
+    """HLS 代理请求失败"""
+
+    def __init__(self, message, status_code=502):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def is_hls_url(url):
+    """根据路径后缀判断是否为 m3u8 源"""
+    return bool(url) and urlsplit(url).path.lower().endswith('.m3u8')
+
+
+def is_hls_content_type(content_type):
+    if not content_type:
+        return False
+    return content_type.split(';', 1)[0].strip().lower() in HLS_CONTENT_TYPES
+
+
+def _sign(channel_id, upstream_url):
+    message = f"{channel_id}\n{upstream_url}".encode('utf-8')
+    return hmac.new(derive_signing_key('hls'), message, hashlib.sha256).hexdigest()[:32]
+
+
+def decode_upstream_url(channel_id, encoded_url, signature):
+    """
+    还原并校验改写 URI 中携带的上游地址
+    返回:
+        str: 上游地址；签名不匹配时返回 None
+    """
+    if not encoded_url or not signature:
+        return None
+    try:
+        padded = encoded_url + '=' * (-len(encoded_url) % 4)
+        upstream_url = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+    except (ValueError, UnicodeError):
+        return None
+    if not hmac.compare_digest(_sign(channel_id, upstream_url), signature):
+        return None
+    return upstream_url
+
+
+def build_proxy_uri(kind, channel_id, upstream_url, auth_params, sid):
+    """
+    生成经由代理的播放列表（kind=playlist）或分片（kind=segment）地址
+    参数:
+        auth_params: 播放鉴权参数（订阅 Token 或签名参数），原样带入改写地址
+    """
+    encoded_url = base64.urlsafe_b64encode(upstream_url.encode('utf-8')).decode('ascii').rstrip('=')
+    query = urlencode({
+        **auth_params,
+        'sid': sid,
+        'u': encoded_url,
+        'sig': _sign(channel_id, upstream_url)
+    })
+    return f"/api/proxy/hls/{channel_id}/{kind}?{query}"
+
+
+def fetch_playlist(url):
+    """
+    拉取上游播放列表（短时缓存，多观众同时刷新只回源一次）
+    返回:
+        tuple: (text, final_url)，final_url 为跟随重定向后的地址，用于解析相对 URI
+    """
+    cache_seconds = get_hls_playlist_cache_seconds()
+    now = time.monotonic()
+    if cache_seconds > 0:
+        with _playlist_lock:
+            cached = _playlist_cache.get(url)
+            if cached is not None and cached[0] > now:
+                return cached[1], cached[2]
+
+    try:
+        response = http_pool.get(url, timeout=UPSTREAM_TIMEOUT_SECONDS)
+        response.raise_for_status()
+    except Exception as e:
+        raise HlsProxyError(f"上游播放列表获取失败: {e}") from e
+
+    text = response.text
+    if not text.lstrip('\ufeff').startswith('#EXTM3U'):
+        raise HlsProxyError('上游返回的不是 m3u8 播放列表')
+
+    final_url = response.url or url
+    if cache_seconds > 0:
+        with _playlist_lock:
+            # 顺带清理过期条目，避免字典无限增长
+            for key in [key for key, item in _playlist_cache.items() if item[0] <= now]:
+                del _playlist_cache[key]
+            _playlist_cache[url] = (now + cache_seconds, text, final_url)
+    return text, final_url
+
+
+def is_master_playlist(text):
+    return '#EXT-X-STREAM-INF' in text
+
+
+def rewrite_playlist(text, base_url, channel_id, auth_params, sid):
+    """把播放列表中的所有 URI 改写为代理地址"""
+    lines = []
+    next_uri_kind = 'segment'
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#'):
+            if line.startswith('#EXT-X-STREAM-INF'):
+                next_uri_kind = 'playlist'
+            if 'URI="' in line:
+                kind = 'playlist' if line.startswith(_PLAYLIST_URI_TAGS) else 'segment'
+                line = _URI_ATTR_PATTERN.sub(
+                    lambda m: 'URI="{}"'.format(
+                        build_proxy_uri(kind, channel_id, urljoin(base_url, m.group(1)), auth_params, sid)
+                    ),
+                    line
+                )
+            lines.append(line)
+            continue
+
+        upstream_url = urljoin(base_url, line)
+        kind = 'playlist' if next_uri_kind == 'playlist' or is_hls_url(upstream_url) else 'segment'
+        lines.append(build_proxy_uri(kind, channel_id, upstream_url, auth_params, sid))
+        next_uri_kind = 'segment'
+
+    return '\n'.join(lines) + '\n'
+
+
+def render_channel_playlist(channel_id, stream_url, auth_params, sid):
+    """
+    生成频道入口播放列表
+    上游为主列表时直接改写；为媒体列表时包装成单码率主列表，
+    使播放器刷新的是带会话 ID 的代理地址，而不是重复创建观看会话的入口地址
+    """
+    text, final_url = fetch_playlist(stream_url)
+    if is_master_playlist(text):
+        return rewrite_playlist(text, final_url, channel_id, auth_params, sid)
+
+    media_uri = build_proxy_uri('playlist', channel_id, final_url, auth_params, sid)
+    return (
+        '#EXTM3U\n'
+        f'#EXT-X-STREAM-INF:BANDWIDTH={DEFAULT_VARIANT_BANDWIDTH}\n'
+        f'{media_uri}\n'
+    )
+
+
+def render_proxied_playlist(channel_id, upstream_url, auth_params, sid):
+    """改写子播放列表（主列表中的码率 / 媒体列表）"""
+    text, final_url = fetch_playlist(upstream_url)
+    return rewrite_playlist(text, final_url, channel_id, auth_params, sid)
+
+
+def _fetch_segment_from_origin(url):
+    try:
+        response = http_pool.get(url, timeout=UPSTREAM_TIMEOUT_SECONDS)
+        response.raise_for_status()
+    except Exception as e:
+        raise HlsProxyError(f"上游分片获取失败: {e}") from e
+    return response.content, response.headers.get('Content-Type') or 'video/mp2t'
+
+
+def fetch_segment(url):
+    """
+    经 LRU 缓存读取分片
+    返回:
+        tuple: (content, content_type, cache_hit)
+    """
+    return segment_cache.get_or_fetch(url, lambda: _fetch_segment_from_origin(url))
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+上游主机熔断（跨进程共享）
+
+按 scheme://host:port 统计连续的主机级失败（连接失败、超时等未拿到响应的错误，
+流代理拉流时的 5xx 响应同样计入；拿到其他 HTTP 响应即视为主机可达）。连续失败达到阈值后熔断：
+熔断期间该主机上的健康探测直接判为异常、流代理直接跳过该源，不再逐个等待超时；
+熔断时间结束后放行一次半开探测，成功即恢复，失败则重新熔断。
+
+健康检测（worker 进程）与流代理（Gunicorn / 异步流代理进程）共用熔断状态：
+连续失败计数在各进程内统计，熔断与恢复这两种状态变化写入 upstream_host_breakers 表；
+各进程的同步线程每隔 SHARED_SYNC_SECONDS 秒写出本进程的状态变化并重新读取全部熔断中的主机。
+allow_request 只读内存，不访问数据库，可在事件循环内直接调用。
+"""
+
+import os
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from app.config import (
+    get_upstream_breaker_enabled,
+    get_upstream_breaker_failure_threshold,
+    get_upstream_breaker_open_seconds
+)
+from app.utils.datetime_utils import to_utc_naive
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# 与共享熔断表同步的间隔（秒）
+SHARED_SYNC_SECONDS = 2
+
+_lock = threading.Lock()
+_hosts = {}
+# 待写入共享表的状态变化：{host: 熔断结束的 UTC 时间}，值为 None 表示已恢复（删除行）
+_pending_writes = {}
+_sync = {
+    'app': None,
+    'thread': None,
+    'pid': None,
+    'synced_at': None
+}
+
+
+def host_key(url):
+    """返回 URL 对应的主机键（scheme://host:port），组播等非 HTTP 地址返回 None"""
+    parts = urlsplit(url or '')
+    scheme = (parts.scheme or '').lower()
+    if scheme not in ('http', 'https') or not parts.hostname:
+        return None
+    try:
+        port = parts.port or (443 if scheme == 'https' else 80)
+    except ValueError:
+        return None
+    return f"{scheme}://{parts.hostname.lower()}:{port}"
+
+
+def _host_state(key):
+    state = _hosts.get(key)
+    if state is None:
+        state = _hosts.setdefault(key, {
+            'consecutive_failures': 0,
+            # 熔断中为恢复探测的放行时间（monotonic），未熔断为 None
+            'open_until': None,
+            'half_open': False,
+            'opened': 0,
+            'rejected': 0
+        })
+    return state
+
+
+def allow_request(url):
+    """
+    判断是否允许向该地址所在主机发起请求
+    熔断期间返回 False；熔断时间结束后放行一次半开探测（再次等待熔断时间后才会放行下一次）
+    """
+    key = host_key(url)
+    if key is None or not get_upstream_breaker_enabled():
+        return True
+
+    now = time.monotonic()
+    with _lock:
+        state = _hosts.get(key)
+        if state is None or state['open_until'] is None:
+            return True
+        if now >= state['open_until']:
+            state['half_open'] = True
+            state['open_until'] = now + get_upstream_breaker_open_seconds()
+            return True
+        state['rejected'] += 1
+        return False
+
+
+def record_host_success(url):
+    """记录主机可达（已拿到响应），关闭熔断"""
+    key = host_key(url)
+    if key is None:
+        return
+    with _lock:
+        state = _hosts.get(key)
+        if state is not None:
+            if state['open_until'] is not None:
+                # 熔断中的主机恢复，通知其他进程
+                _pending_writes[key] = None
+            state['consecutive_failures'] = 0
+            state['open_until'] = None
+            state['half_open'] = False
+
+
+def record_host_failure(url):
+    """记录一次主机级失败，连续失败达到阈值（或半开探测失败）时熔断"""
+    key = host_key(url)
+    if key is None:
+        return
+    now = time.monotonic()
+    with _lock:
+        state = _host_state(key)
+        state['consecutive_failures'] += 1
+        if state['half_open'] or state['consecutive_failures'] >= get_upstream_breaker_failure_threshold():
+            if state['open_until'] is None or state['half_open']:
+                state['opened'] += 1
+            open_seconds = get_upstream_breaker_open_seconds()
+            state['open_until'] = now + open_seconds
+            state['half_open'] = False
+            _pending_writes[key] = to_utc_naive() + timedelta(seconds=open_seconds)
+
+
+def _breaker_upsert_statement():
+    """熔断行写入语句：主机不存在时插入，存在时更新熔断结束时间"""
+    from app import db
+    from app.models.upstream_host_breaker import UpstreamHostBreaker
+
+    table = UpstreamHostBreaker.__table__
+    if db.engine.dialect.name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+        statement = mysql_insert(table)
+        return statement.on_duplicate_key_update(
+            open_until=statement.inserted.open_until,
+            updated_at=statement.inserted.updated_at
+        )
+
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+    statement = sqlite_insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.host],
+        set_={'open_until': statement.excluded.open_until, 'updated_at': statement.excluded.updated_at}
+    )
+
+
+def sync_shared_state():
+    """
+    写出本进程的熔断 / 恢复变化，并按共享表刷新本进程状态（需在 app context 内调用）
+    - 其他进程熔断的主机：本进程同样熔断到相同时间
+    - 本进程熔断中、但共享表中已删除的主机（其他进程探测成功）：本进程随之恢复
+    """
+    from sqlalchemy import delete, select
+
+    from app import db
+    from app.models.upstream_host_breaker import UpstreamHostBreaker
+
+    with _lock:
+        pending = dict(_pending_writes)
+        _pending_writes.clear()
+
+    try:
+        now_utc = to_utc_naive()
+        opened = [
+            {'host': key, 'open_until': open_until, 'updated_at': now_utc}
+            for key, open_until in sorted(pending.items())
+            if open_until is not None
+        ]
+        closed = sorted(key for key, open_until in pending.items() if open_until is None)
+        if opened:
+            db.session.execute(_breaker_upsert_statement(), opened)
+        if closed:
+            db.session.execute(delete(UpstreamHostBreaker).where(UpstreamHostBreaker.host.in_(closed)))
+        rows = db.session.execute(select(UpstreamHostBreaker.host, UpstreamHostBreaker.open_until)).all()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        with _lock:
+            # 写入失败时放回待写队列，保留更新的变化
+            for key, open_until in pending.items():
+                _pending_writes.setdefault(key, open_until)
+        raise
+
+    now = time.monotonic()
+    shared = {row.host: now + (row.open_until - now_utc).total_seconds() for row in rows}
+    with _lock:
+        for key, open_until in shared.items():
+            if key in _pending_writes:
+                continue
+            state = _host_state(key)
+            if state['open_until'] is None:
+                state['opened'] += 1
+            if state['open_until'] is None or (not state['half_open'] and state['open_until'] < open_until):
+                state['open_until'] = open_until
+        for key, state in _hosts.items():
+            if key in shared or key in _pending_writes or state['open_until'] is None:
+                continue
+            state['consecutive_failures'] = 0
+            state['open_until'] = None
+            state['half_open'] = False
+        _sync['synced_at'] = time.time()
+
+
+def ensure_sync_started(app):
+    """确保当前进程的共享熔断同步线程已启动（兼容 Gunicorn preload 后 fork）"""
+    pid = os.getpid()
+    thread = _sync['thread']
+    if _sync['pid'] == pid and thread is not None and thread.is_alive():
+        return
+
+    with _lock:
+        thread = _sync['thread']
+        if _sync['pid'] == pid and thread is not None and thread.is_alive():
+            return
+        if _sync['pid'] != pid:
+            # fork 后继承的待写变化属于父进程
+            _pending_writes.clear()
+        _sync['app'] = app
+        _sync['pid'] = pid
+        _sync['thread'] = threading.Thread(target=_run_sync, name='host-breaker-sync', daemon=True)
+        _sync['thread'].start()
+
+
+def _run_sync():
+    while True:
+        try:
+            if get_upstream_breaker_enabled():
+                with _sync['app'].app_context():
+                    sync_shared_state()
+        except Exception as e:
+            logger.error(f"同步上游主机熔断状态失败: {e}")
+        time.sleep(SHARED_SYNC_SECONDS)
+
+
+def get_host_breaker_stats():
+    now = time.monotonic()
+    with _lock:
+        hosts = {}
+        for key, state in _hosts.items():
+            if not state['consecutive_failures'] and state['open_until'] is None:
+                continue
+            if state['open_until'] is None:
+                status = STATE_CLOSED
+            elif state['half_open'] or now >= state['open_until']:
+                status = STATE_HALF_OPEN
+            else:
+                status = STATE_OPEN
+            hosts[key] = {
+                'state': status,
+                'consecutive_failures': state['consecutive_failures'],
+                'opened': state['opened'],
+                'rejected': state['rejected']
+            }
+        synced_at = _sync['synced_at']
+        return {
+            'open': sum(1 for item in hosts.values() if item['state'] != STATE_CLOSED),
+            # 只列出近期有失败的主机
+            'hosts': hosts,
+            # 最近一次与共享熔断表同步的时间（秒级时间戳），同步线程未启动时为 None
+            'synced_at': int(synced_at) if synced_at is not None else None
+        }
@@ -5,14 +5,18 @@
 
 import re
 import requests
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, current_app, request, jsonify
 from loguru import logger
-from sqlalchemy import func, inspect
+from sqlalchemy import and_, func, inspect, or_
 from app import db
 from app.models.channel import Channel
 from app.models.channel_group import ChannelGroup
+from app.models.watch_daily_rollup import WatchDailyRollup
 from app.models.watch_history import WatchHistory
+from app.services.channel_catalog import bump_catalog_version
+from app.utils import http_pool
 from app.utils.auth import login_required
+from app.utils.text_stream import accepts_gzip, iter_lines, streamed_text_response
 
 bp = Blueprint('import_export', __name__, url_prefix='/api/import-export')
 
@@ -131,6 +135,9 @@ def save_imported_channels(channels, overwrite, auto_create_group, include_regex
         protected_channel_ids = {
             row[0] for row in db.session.query(WatchHistory.channel_id).distinct().all()
         }
+        protected_channel_ids.update(
+            row[0] for row in db.session.query(WatchDailyRollup.channel_id).distinct().all()
+        )
 
         # 若存在 active_connections 表，也将活跃连接中的频道加入保护集合
         table_names = set(inspect(db.engine).get_table_names())
@@ -161,6 +168,7 @@ def save_imported_channels(channels, overwrite, auto_create_group, include_regex
 
         # 所有频道已脱离分组后，分组可安全清空
         ChannelGroup.query.delete(synchronize_session=False)
+        bump_catalog_version()
         db.session.commit()
     
     imported_count = 0
@@ -232,6 +240,7 @@ def save_imported_channels(channels, overwrite, auto_create_group, include_regex
         db.session.add(channel)
         imported_count += 1
     
+    bump_catalog_version()
     db.session.commit()
     
     result = {
@@ -330,7 +339,7 @@ def import_from_url():
     try:
         # 获取远程文件内容
         logger.info(f"正在从 URL 获取频道列表: {url}")
-        response = requests.get(url, timeout=30, headers={
+        response = http_pool.get(url, timeout=30, headers={
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         })
         response.raise_for_status()
@@ -384,58 +393,103 @@ def import_from_url():
 @bp.route('/export', methods=['GET'])
 @login_required
 def export_channels():
-    """导出频道"""
+    """导出频道（逐行流式输出，客户端接受 gzip 时压缩）"""
     format_type = request.args.get('format', 'm3u')
     
-    lines = []
-    
     if format_type == 'm3u':
-        lines.append('#EXTM3U')
-        
-        # 按分组获取频道
-        groups = ChannelGroup.query.order_by(ChannelGroup.sort_order).all()
-        ungrouped = Channel.query.filter_by(group_id=None, is_active=True).order_by(Channel.sort_order).all()
-        
-        for group in groups:
-            channels = Channel.query.filter_by(group_id=group.id, is_active=True).order_by(Channel.sort_order).all()
-            for channel in channels:
-                logo_part = f' tvg-logo="{channel.logo}"' if channel.logo else ''
-                lines.append(f'#EXTINF:-1 tvg-name="{channel.name}"{logo_part} group-title="{group.name}",{channel.name}')
-                lines.append(channel.url)
-        
-        for channel in ungrouped:
-            logo_part = f' tvg-logo="{channel.logo}"' if channel.logo else ''
-            lines.append(f'#EXTINF:-1 tvg-name="{channel.name}"{logo_part},{channel.name}')
-            lines.append(channel.url)
-        
-        content = '\n'.join(lines)
+        iter_format_lines = _iter_export_m3u_lines
         mimetype = 'audio/x-mpegurl'
         filename = 'channels.m3u'
     else:
-        # TXT 格式
-        groups = ChannelGroup.query.order_by(ChannelGroup.sort_order).all()
-        ungrouped = Channel.query.filter_by(group_id=None, is_active=True).order_by(Channel.sort_order).all()
-        
-        for group in groups:
-            channels = Channel.query.filter_by(group_id=group.id, is_active=True).order_by(Channel.sort_order).all()
-            if channels:
-                lines.append(f'{group.name},#genre#')
-                for channel in channels:
-                    lines.append(f'{channel.name},{channel.url}')
-        
-        if ungrouped:
-            lines.append('未分组,#genre#')
-            for channel in ungrouped:
-                lines.append(f'{channel.name},{channel.url}')
-        
-        content = '\n'.join(lines)
+        iter_format_lines = _iter_export_txt_lines
         mimetype = 'text/plain; charset=utf-8'
         filename = 'channels.txt'
     
-    return Response(
-        content,
-        mimetype=mimetype,
-        headers={
-            'Content-Disposition': f'attachment; filename="{filename}"'
-        }
+    app = current_app._get_current_object()
+    return streamed_text_response(
+        iter_lines(_iter_in_app_context(app, iter_format_lines)),
+        mimetype,
+        filename,
+        compress=accepts_gzip(request)
     )
+
+
+def _iter_in_app_context(app, iter_format_lines):
+    """响应输出阶段在独立的 app context 中分批查询，输出结束或客户端断开时释放会话"""
+    with app.app_context():
+        yield from iter_format_lines()
+
+
+# 导出时每批从数据库读取的频道数量
+EXPORT_BATCH_SIZE = 500
+
+
+def _fetch_export_batch(group_id, after):
+    """
+    读取分组内排在 after（sort_order, id）之后的一批启用频道
+    每批一次短查询，读取后立即释放会话，下载期间不持有游标与连接池连接
+    """
+    # 旧数据的 sort_order 可能为 NULL，按 0 参与排序与比较
+    sort_key = func.coalesce(Channel.sort_order, 0)
+    query = (
+        db.session.query(Channel.id, sort_key.label('sort_key'), Channel.group_id, Channel.name, Channel.logo, Channel.url)
+        .filter(Channel.group_id.is_(None) if group_id is None else Channel.group_id == group_id)
+        .filter(Channel.is_active.is_(True))
+    )
+    if after is not None:
+        sort_order, channel_id = after
+        query = query.filter(or_(
+            sort_key > sort_order,
+            and_(sort_key == sort_order, Channel.id > channel_id)
+        ))
+    try:
+        return query.order_by(sort_key, Channel.id).limit(EXPORT_BATCH_SIZE).all()
+    finally:
+        db.session.remove()
+
+
+def _iter_export_channels():
+    """
+    按分组顺序逐批读取启用频道：先输出各分组内频道，再输出未分组频道
+    分组内按 (sort_order, id) 键集分页，每批使用独立的短会话
+    返回:
+        迭代器: (分组名, 频道行)，未分组频道的分组名为 None
+    """
+    try:
+        groups = (
+            db.session.query(ChannelGroup.id, ChannelGroup.name)
+            .order_by(ChannelGroup.sort_order, ChannelGroup.id)
+            .all()
+        )
+    finally:
+        db.session.remove()
+
+    for group_id, group_name in [*groups, (None, None)]:
+        after = None
+        while True:
+            rows = _fetch_export_batch(group_id, after)
+            for row in rows:
+                yield group_name, row
+            if len(rows) < EXPORT_BATCH_SIZE:
+                break
+            after = (rows[-1].sort_key, rows[-1].id)
+
+
+def _iter_export_m3u_lines():
+    yield '#EXTM3U'
+    for group_name, channel in _iter_export_channels():
+        logo_part = f' tvg-logo="{channel.logo}"' if channel.logo else ''
+        group_part = f' group-title="{group_name}"' if group_name is not None else ''
+        yield f'#EXTINF:-1 tvg-name="{channel.name}"{logo_part}{group_part},{channel.name}'
+        yield channel.url
+
+
+def _iter_export_txt_lines():
+    current_group_id = None
+    started = False
+    for group_name, channel in _iter_export_channels():
+        if not started or channel.group_id != current_group_id:
+            yield f'{group_name if group_name is not None else "未分组"},#genre#'
+            current_group_id = channel.group_id
+            started = True
+        yield f'{channel.name},{channel.url}'
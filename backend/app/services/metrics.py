@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus 指标
+
+设置环境变量 PROMETHEUS_MULTIPROC_DIR 后使用 prometheus_client 的多进程模式：
+Gunicorn 各 worker、统一 worker 与异步流代理把指标写入该目录下的 mmap 文件，
+/metrics 由任一 Web 进程汇总全部进程的数据；未设置时仅统计当前进程。
+"""
+
+import atexit
+import contextvars
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from app.config import get_metrics_multiproc_dir
+
+_MULTIPROC_DIR = get_metrics_multiproc_dir()
+if _MULTIPROC_DIR:
+    # prometheus_client 在导入时根据该变量选择多进程存储
+    os.makedirs(_MULTIPROC_DIR, exist_ok=True)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = _MULTIPROC_DIR
+
+from flask import has_request_context, request  # noqa: E402
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+# 观看字节数按该间隔（秒）合并写入计数器，避免每个数据块都写一次 mmap
+BYTES_FLUSH_INTERVAL_SECONDS = 1.0
+
+_FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+STREAM_BYTES_BY_CHANNEL = Counter(
+    'iptv_stream_channel_bytes_total',
+    '转发给观众的字节数（按频道）',
+    ['channel_id']
+)
+STREAM_BYTES_BY_USER = Counter(
+    'iptv_stream_user_bytes_total',
+    '转发给观众的字节数（按用户）',
+    ['user_id']
+)
+ACTIVE_STREAMS = Gauge(
+    'iptv_active_streams',
+    '当前进程正在转发的观看连接数',
+    multiprocess_mode='liveall'
+)
+UPSTREAM_TTFB = Histogram(
+    'iptv_upstream_ttfb_seconds',
+    '上游首字节耗时',
+    ['kind'],
+    buckets=_FAST_BUCKETS[3:] + (10.0, 15.0)
+)
+HEARTBEAT_FLUSH = Histogram(
+    'iptv_heartbeat_flush_seconds',
+    '心跳批量落库耗时',
+    buckets=_FAST_BUCKETS
+)
+HEARTBEAT_FLUSH_ROWS = Counter(
+    'iptv_heartbeat_flush_rows_total',
+    '批量落库的心跳条数'
+)
+HEARTBEAT_FLUSH_FAILURES = Counter(
+    'iptv_heartbeat_flush_failures_total',
+    '心跳批量落库失败次数'
+)
+HEALTH_CHECK_DURATION = Histogram(
+    'iptv_health_check_duration_seconds',
+    '单个频道健康检测耗时（含重试）',
+    ['outcome'],
+    buckets=_SLOW_BUCKETS[:9]
+)
+WORKER_CYCLE = Histogram(
+    'iptv_worker_cycle_seconds',
+    '后台 worker 单轮执行耗时',
+    ['worker', 'outcome'],
+    buckets=_SLOW_BUCKETS
+)
+DB_QUERY_DURATION = Histogram(
+    'iptv_db_query_duration_seconds',
+    '数据库语句耗时（按接口 / 任务）',
+    ['endpoint'],
+    buckets=_FAST_BUCKETS
+)
+
+# 非请求上下文（worker 任务、后台线程）中数据库语句归属的名称
+_db_scope = contextvars.ContextVar('iptv_metrics_db_scope', default='background')
+_instrument_lock = threading.Lock()
+_instrumented = False
+
+
+def is_multiprocess():
+    return bool(_MULTIPROC_DIR)
+
+
+def render_latest():
+    """
+    生成 Prometheus 文本格式的指标
+    返回:
+        tuple: (body, content_type)
+    """
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class StreamMeter:
+    """单个观看连接的指标记录（字节数按时间合并后写入计数器）"""
+
+    def __init__(self, channel_id, user_id):
+        self._channel_id = str(channel_id)
+        self._user_id = str(user_id)
+        self._pending_bytes = 0
+        self._flushed_at = time.monotonic()
+        self._closed = False
+        ACTIVE_STREAMS.inc()
+
+    def add(self, size):
+        self._pending_bytes += size
+        now = time.monotonic()
+        if now - self._flushed_at >= BYTES_FLUSH_INTERVAL_SECONDS:
+            self._flush(now)
+
+    def _flush(self, now):
+        if self._pending_bytes:
+            STREAM_BYTES_BY_CHANNEL.labels(self._channel_id).inc(self._pending_bytes)
+            STREAM_BYTES_BY_USER.labels(self._user_id).inc(self._pending_bytes)
+            self._pending_bytes = 0
+        self._flushed_at = now
+
+    def close(self):
+        """幂等结束：写入剩余字节并减少活跃连接数"""
+        if self._closed:
+            return
+        self._closed = True
+        self._flush(time.monotonic())
+        ACTIVE_STREAMS.dec()
+
+
+def observe_upstream_ttfb(kind, seconds):
+    UPSTREAM_TTFB.labels(kind).observe(seconds)
+
+
+def observe_heartbeat_flush(seconds, rows):
+    HEARTBEAT_FLUSH.observe(seconds)
+    HEARTBEAT_FLUSH_ROWS.inc(rows)
+
+
+def record_heartbeat_flush_failure():
+    HEARTBEAT_FLUSH_FAILURES.inc()
+
+
+def observe_health_check(is_healthy, seconds):
+    HEALTH_CHECK_DURATION.labels('healthy' if is_healthy else 'unhealthy').observe(seconds)
+
+
+@contextmanager
+def db_query_scope(name):
+    """把非请求上下文中执行的数据库语句归属到指定名称"""
+    scope_token = _db_scope.set(name)
+    try:
+        yield
+    finally:
+        _db_scope.reset(scope_token)
+
+
+@contextmanager
+def track_worker_cycle(worker):
+    """统计后台 worker 单轮耗时，并把期间的数据库语句归属到该 worker"""
+    started_at = time.perf_counter()
+    outcome = 'error'
+    try:
+        with db_query_scope(f"worker:{worker}"):
+            yield
+        outcome = 'ok'
+    finally:
+        WORKER_CYCLE.labels(worker, outcome).observe(time.perf_counter() - started_at)
+
+
+def _current_db_scope():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return _db_scope.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('iptv_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('iptv_query_started')
+    if not started:
+        return
+    DB_QUERY_DURATION.labels(_current_db_scope()).observe(time.perf_counter() - started.pop())
+
+
+def _handle_db_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None:
+        started = connection.info.get('iptv_query_started')
+        if started:
+            started.pop()
+
+
+def instrument_sqlalchemy():
+    """为所有 SQLAlchemy Engine 注册语句计时（重复调用无副作用）"""
+    global _instrumented
+    with _instrument_lock:
+        if _instrumented:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_db_error)
+        _instrumented = True
+
+
+_PID_FILE_PATTERN = re.compile(r'_(\d+)\.db$')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def cleanup_multiprocess_dir():
+    """
+    清理已退出进程遗留的指标文件（Gunicorn 启动时调用）
+    统一 worker、异步流代理等仍在运行的进程的文件保留
+    """
+    if not is_multiprocess():
+        return 0
+    removed = 0
+    for name in os.listdir(_MULTIPROC_DIR):
+        match = _PID_FILE_PATTERN.search(name)
+        if match is None or _pid_alive(int(match.group(1))):
+            continue
+        try:
+            os.remove(os.path.join(_MULTIPROC_DIR, name))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def mark_process_dead(pid):
+    """进程退出后移除其 live 类型仪表（Gunicorn child_exit 钩子调用）"""
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid, _MULTIPROC_DIR)
+
+
+if is_multiprocess():
+    # 独立启动的统一 worker / 异步流代理正常退出时同样移除自身的 live 仪表
+    atexit.register(lambda: mark_process_dead(os.getpid()))
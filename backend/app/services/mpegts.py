@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+MPEG-TS 解析工具
+
+只解析转发与探测需要的最少字段：包对齐、PID、PAT/PMT、随机访问点（关键帧）、连续计数与 PCR。
+"""
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+NULL_PID = 0x1FFF
+
+# PMT stream_type -> 视频编码
+VIDEO_STREAM_TYPES = {
+    0x01: 'mpeg1',
+    0x02: 'mpeg2',
+    0x10: 'mpeg4',
+    0x1B: 'h264',
+    0x24: 'hevc',
+    0x42: 'avs',
+    0xD2: 'avs2',
+    0xEA: 'vc1'
+}
+
+# 判定对齐需要连续命中同步字节的包数
+_SYNC_CHECK_PACKETS = 3
+
+
+def packet_pid(packet):
+    return ((packet[1] & 0x1F) << 8) | packet[2]
+
+
+def payload_unit_start(packet):
+    return bool(packet[1] & 0x40)
+
+
+def continuity_counter(packet):
+    return packet[3] & 0x0F
+
+
+def has_payload(packet):
+    return bool(packet[3] & 0x10)
+
+
+def adaptation_field(packet):
+    """返回适配域内容（不含长度字节），无适配域时返回 b''"""
+    if not packet[3] & 0x20:
+        return b''
+    length = packet[4]
+    return packet[5:5 + length]
+
+
+def random_access_indicator(packet):
+    field = adaptation_field(packet)
+    return bool(field) and bool(field[0] & 0x40)
+
+
+def discontinuity_indicator(packet):
+    field = adaptation_field(packet)
+    return bool(field) and bool(field[0] & 0x80)
+
+
+def packet_pcr(packet):
+    """返回适配域中的 PCR（27MHz 时钟），未携带 PCR 时返回 None"""
+    field = adaptation_field(packet)
+    if len(field) < 7 or not field[0] & 0x10:
+        return None
+    base = (field[1] << 25) | (field[2] << 17) | (field[3] << 9) | (field[4] << 1) | (field[5] >> 7)
+    extension = ((field[5] & 0x01) << 8) | field[6]
+    return base * 300 + extension
+
+
+def packet_payload(packet):
+    """返回包负载（跳过适配域）"""
+    if not has_payload(packet):
+        return b''
+    offset = 4
+    if packet[3] & 0x20:
+        offset += 1 + packet[4]
+    return packet[offset:TS_PACKET_SIZE]
+
+
+def find_sync(data, start=0):
+    """
+    查找连续 TS 包的起始位置
+    返回:
+        int: 对齐位置，找不到时返回 -1
+    """
+    last_start = len(data) - TS_PACKET_SIZE * _SYNC_CHECK_PACKETS
+    position = data.find(b'\x47', start)
+    while 0 <= position <= last_start:
+        if all(data[position + i * TS_PACKET_SIZE] == TS_SYNC_BYTE for i in range(1, _SYNC_CHECK_PACKETS)):
+            return position
+        position = data.find(b'\x47', position + 1)
+    return -1
+
+
+def _psi_section(packet):
+    """取出单包内的 PSI 段（不处理跨包段，PAT/PMT 通常都在一个包内）"""
+    if not payload_unit_start(packet):
+        return None
+    payload = packet_payload(packet)
+    if not payload:
+        return None
+    pointer = payload[0]
+    section = payload[1 + pointer:]
+    if len(section) < 3:
+        return None
+    section_length = ((section[1] & 0x0F) << 8) | section[2]
+    if len(section) < 3 + section_length:
+        return None
+    return section[:3 + section_length]
+
+
+def parse_pat(packet):
+    """
+    解析 PAT
+    返回:
+        list: PMT PID 列表，解析失败时返回 None
+    """
+    section = _psi_section(packet)
+    if section is None or section[0] != 0x00:
+        return None
+    pmt_pids = []
+    # 跳过 8 字节表头，去掉末尾 4 字节 CRC
+    for offset in range(8, len(section) - 4, 4):
+        program_number = (section[offset] << 8) | section[offset + 1]
+        pid = ((section[offset + 2] & 0x1F) << 8) | section[offset + 3]
+        if program_number != 0:
+            pmt_pids.append(pid)
+    return pmt_pids
+
+
+def parse_pmt(packet):
+    """
+    解析 PMT
+    返回:
+        dict: {'pcr_pid': int, 'streams': [(pid, stream_type), ...]}，解析失败时返回 None
+    """
+    section = _psi_section(packet)
+    if section is None or section[0] != 0x02 or len(section) < 16:
+        return None
+    pcr_pid = ((section[8] & 0x1F) << 8) | section[9]
+    program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+    offset = 12 + program_info_length
+    end = len(section) - 4
+    streams = []
+    while offset + 5 <= end:
+        stream_type = section[offset]
+        pid = ((section[offset + 1] & 0x1F) << 8) | section[offset + 2]
+        es_info_length = ((section[offset + 3] & 0x0F) << 8) | section[offset + 4]
+        streams.append((pid, stream_type))
+        offset += 5 + es_info_length
+    return {'pcr_pid': pcr_pid, 'streams': streams}
+
+
+def find_video_stream(pmt):
+    """返回 PMT 中第一个视频流 (pid, codec)，没有视频时返回 (None, None)"""
+    for pid, stream_type in pmt['streams']:
+        codec = VIDEO_STREAM_TYPES.get(stream_type)
+        if codec:
+            return pid, codec
+    return None, None
+
+
+def _iter_nal_types(data, codec):
+    position = data.find(b'\x00\x00\x01')
+    while 0 <= position < len(data) - 3:
+        header = data[position + 3]
+        yield (header & 0x1F) if codec == 'h264' else ((header >> 1) & 0x3F)
+        position = data.find(b'\x00\x00\x01', position + 3)
+
+
+def is_keyframe_start(packet, codec):
+    """
+    判断视频包是否为随机访问点起始
+    优先使用适配域 random_access_indicator，未标记时检查 PES 首包内的 IDR / IRAP NAL；
+    SEI 较大时 IDR 可能落在后续包中，因此紧随其前的 SPS（HEVC 为 VPS/SPS）也视为起始
+    """
+    if random_access_indicator(packet):
+        return True
+    if codec not in ('h264', 'hevc') or not payload_unit_start(packet):
+        return False
+
+    payload = packet_payload(packet)
+    if len(payload) < 9 or payload[:3] != b'\x00\x00\x01':
+        return False
+    es_data = payload[9 + payload[8]:]
+    for nal_type in _iter_nal_types(es_data, codec):
+        if codec == 'h264' and nal_type in (5, 7):
+            return True
+        if codec == 'hevc' and (16 <= nal_type <= 21 or nal_type in (32, 33)):
+            return True
+    return False
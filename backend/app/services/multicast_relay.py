@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+内置组播转 HTTP 服务（替代外部 UDPxy）
+
+直接加入组播组接收 UDP/RTP 数据，去除 RTP 头得到 MPEG-TS，
+并用小型抖动缓冲按 RTP 序号重排、去重。每个组播组在进程内只加入一次，
+由共享转发（stream_relay / async_stream_server）分发给所有本地观众。
+"""
+
+import socket
+import struct
+import time
+
+from app.config import get_multicast_interface, get_multicast_jitter_packets
+
+MPEG_TS_SYNC_BYTE = 0x47
+RTP_VERSION = 2
+RTP_HEADER_SIZE = 12
+RTP_SEQ_MODULO = 1 << 16
+UDP_RECV_SIZE = 65536
+DEFAULT_MULTICAST_PORT = 5000
+# 序号回退超过该距离（远超抖动缓冲窗口）视为发送端重启，立即按新序号重新同步
+RTP_RESYNC_DISTANCE = 1024
+# 连续收到该数量序号相连的落后包时同样重新同步（序号小幅回退的重启）
+RTP_RESYNC_LATE_PACKETS = 16
+
+
+def is_multicast_url(url):
+    """判断是否为 rtp:// 或 udp:// 组播地址"""
+    return bool(url) and url.lower().startswith(('rtp://', 'udp://'))
+
+
+def parse_multicast_url(url):
+    """
+    解析组播地址
+    支持: rtp://239.0.0.1:5000、udp://@239.0.0.1:5000
+    返回:
+        tuple: (group, port)
+    """
+    addr = url.split('://', 1)[1] if '://' in url else url
+    if addr.startswith('@'):
+        addr = addr[1:]
+    addr = addr.split('/', 1)[0]
+
+    if ':' in addr:
+        group, port_text = addr.rsplit(':', 1)
+        return group, int(port_text)
+    return addr, DEFAULT_MULTICAST_PORT
+
+
+def open_multicast_socket(group, port, interface=None):
+    """创建已加入组播组的 UDP 套接字"""
+    interface = interface or get_multicast_interface()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        try:
+            # 绑定组播地址（Linux）可避免收到同端口其他组的数据
+            sock.bind((group, port))
+        except OSError:
+            sock.bind(('', port))
+        mreq = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        return sock
+    except Exception:
+        sock.close()
+        raise
+
+
+def strip_rtp_header(packet):
+    """
+    去除 RTP 头
+    返回:
+        tuple: (sequence_number, payload)；非 RTP 封装（裸 UDP TS）时序号为 None
+    """
+    if not packet or packet[0] == MPEG_TS_SYNC_BYTE:
+        return None, packet
+
+    if len(packet) < RTP_HEADER_SIZE or (packet[0] >> 6) != RTP_VERSION:
+        return None, packet
+
+    has_padding = bool(packet[0] & 0x20)
+    has_extension = bool(packet[0] & 0x10)
+    csrc_count = packet[0] & 0x0F
+    sequence_number = (packet[2] << 8) | packet[3]
+
+    offset = RTP_HEADER_SIZE + 4 * csrc_count
+    if has_extension:
+        if len(packet) < offset + 4:
+            return sequence_number, b''
+        extension_words = (packet[offset + 2] << 8) | packet[offset + 3]
+        offset += 4 + 4 * extension_words
+
+    end = len(packet)
+    if has_padding and end > offset:
+        end -= packet[-1]
+
+    if offset >= end:
+        return sequence_number, b''
+    return sequence_number, packet[offset:end]
+
+
+class RtpJitterBuffer:
+    """按 RTP 序号重排、去重的小型抖动缓冲"""
+
+    def __init__(self, capacity=None):
+        self.capacity = max(1, int(capacity or get_multicast_jitter_packets()))
+        self._expected = None
+        self._pending = {}
+        self._late_streak = 0
+        self._late_next = None
+        self.duplicates = 0
+        self.lost = 0
+        self.resyncs = 0
+
+    @staticmethod
+    def _distance(seq, base):
+        """seq 相对 base 的前向距离（处理 16 位回绕），落后时为负数"""
+        diff = (seq - base) % RTP_SEQ_MODULO
+        return diff if diff < RTP_SEQ_MODULO // 2 else diff - RTP_SEQ_MODULO
+
+    def push(self, sequence_number, payload):
+        """写入一个包，返回可按序输出的负载列表"""
+        if sequence_number is None:
+            return [payload]
+
+        if self._expected is None:
+            self._expected = sequence_number
+
+        ready = []
+        distance = self._distance(sequence_number, self._expected)
+        if distance < 0:
+            # 只有序号相连的落后包才像是重启后的新序列，反复重发的同一个包不计入
+            self._late_streak = self._late_streak + 1 if sequence_number == self._late_next else 1
+            self._late_next = (sequence_number + 1) % RTP_SEQ_MODULO
+            if -distance <= RTP_RESYNC_DISTANCE and self._late_streak < RTP_RESYNC_LATE_PACKETS:
+                # 迟到或重复的包
+                self.duplicates += 1
+                return []
+            # 发送端 / 编码器重启导致序号回退：输出已缓存的包后从当前包重新计序
+            ready = self._flush_pending()
+            self._expected = sequence_number
+            self.resyncs += 1
+        else:
+            self._late_streak = 0
+
+        if sequence_number in self._pending:
+            self.duplicates += 1
+            return ready
+
+        self._pending[sequence_number] = payload
+        ready.extend(self._drain())
+
+        if len(self._pending) > self.capacity:
+            # 缓冲已满仍未等到缺失包，放弃缺口，从最早的已缓存包继续
+            earliest = min(self._pending, key=lambda seq: self._distance(seq, self._expected))
+            self.lost += self._distance(earliest, self._expected)
+            self._expected = earliest
+            ready.extend(self._drain())
+        return ready
+
+    def _flush_pending(self):
+        """按序取出全部已缓存的包（忽略缺口）"""
+        ready = [
+            self._pending[seq]
+            for seq in sorted(self._pending, key=lambda seq: self._distance(seq, self._expected))
+        ]
+        self._pending.clear()
+        self._late_streak = 0
+        return ready
+
+    def _drain(self):
+        ready = []
+        while self._expected in self._pending:
+            ready.append(self._pending.pop(self._expected))
+            self._expected = (self._expected + 1) % RTP_SEQ_MODULO
+        return ready
+
+
+class MpegTsAssembler:
+    """把组播包还原为 MPEG-TS 并聚合成约 chunk_size 字节的数据块"""
+
+    def __init__(self, chunk_size, jitter_packets=None):
+        self.chunk_size = max(1, int(chunk_size))
+        self.jitter = RtpJitterBuffer(jitter_packets)
+        self._buffer = bytearray()
+        self._last_output_at = time.monotonic()
+
+    def feed(self, packet):
+        """写入一个 UDP 包，返回已凑满的数据块列表"""
+        sequence_number, payload = strip_rtp_header(packet)
+        for ready in self.jitter.push(sequence_number, payload):
+            if ready:
+                self._buffer += ready
+                self._last_output_at = time.monotonic()
+        if len(self._buffer) >= self.chunk_size:
+            return [self.flush()]
+        return []
+
+    def idle_seconds(self):
+        """距上次输出有效负载的秒数（持续收到被丢弃的包也会累计，用于停滞判定）"""
+        return time.monotonic() - self._last_output_at
+
+    def flush(self):
+        """取出缓冲区内剩余数据"""
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        return chunk
+
+
+class MulticastReceiver:
+    """阻塞式组播接收器（每个实例持有一个组播组成员关系）"""
+
+    def __init__(self, url, chunk_size, interface=None):
+        self.group, self.port = parse_multicast_url(url)
+        self._sock = open_multicast_socket(self.group, self.port, interface)
+        self._assembler = MpegTsAssembler(chunk_size)
+
+    def iter_chunks(self, stop_event, poll_seconds=1, idle_timeout=30):
+        """
+        持续接收组播数据直到 stop_event 置位
+        超过 idle_timeout 秒没有可输出的数据时抛出 TimeoutError（按输出的负载计时，而非收到的数据报）
+        """
+        self._sock.settimeout(poll_seconds)
+        while not stop_event.is_set():
+            try:
+                packet = self._sock.recv(UDP_RECV_SIZE)
+            except socket.timeout:
+                # 码流暂停时把已收到的数据先推给观众
+                chunk = self._assembler.flush()
+                if chunk:
+                    yield chunk
+            else:
+                yield from self._assembler.feed(packet)
+
+            if self._assembler.idle_seconds() >= idle_timeout:
+                raise TimeoutError(f"组播 {self.group}:{self.port} 超过 {idle_timeout} 秒无数据")
+
+    def close(self):
+        try:
+            self._sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+订阅播放列表模板缓存（进程内）
+
+M3U / TXT 订阅内容按「格式 + 访问地址 + 频道目录版本号 + EPG 地址」渲染一次，
+模板中播放地址的鉴权参数处留空，请求时只需拼接当前用户的订阅 Token（或逐频道签名参数）。
+频道 / 分组变更会更新频道目录版本号，下次请求时重新渲染。
+gzip 压缩后的完整内容按 ETag 另行缓存，同一用户的设备重复拉取时直接返回。
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlencode
+
+from app.config import get_signed_stream_url_ttl_seconds, get_signed_stream_urls_enabled
+from app.services.channel_catalog import get_catalog_version
+from app.services.stream_auth import EXPIRY_ROUNDING_SECONDS, get_signed_expiry, sign_stream_params
+from app.utils.text_stream import iter_gzip, iter_text_chunks
+
+FORMAT_M3U = 'm3u'
+FORMAT_TXT = 'txt'
+
+# 每个进程最多保留的模板数量（格式 × 访问地址）
+MAX_TEMPLATES = 16
+# 每个进程最多缓存的 gzip 内容数量（按用户 ETag，3000 个频道的 M3U 压缩后约数十 KB）
+MAX_GZIP_BODIES = 256
+
+# parts 比 channel_ids 多一项：parts[0] + query(channel_ids[0]) + parts[1] + ... + parts[-1]
+PlaylistTemplate = namedtuple('PlaylistTemplate', ['parts', 'channel_ids', 'digest', 'rendered_at'])
+
+RenderedPlaylist = namedtuple('RenderedPlaylist', ['etag', 'last_modified', 'iter_pieces'])
+
+_lock = threading.Lock()
+# 同一时刻只渲染一份模板，避免目录变更后大量设备同时刷新导致重复渲染
+_render_lock = threading.Lock()
+_templates = OrderedDict()
+_gzip_bodies = OrderedDict()
+_stats = {
+    'renders': 0,
+    'hits': 0,
+    'gzip_hits': 0,
+    'gzip_misses': 0
+}
+
+
+def _query_channels():
+    from app import db
+    from app.models.channel import Channel
+    return (
+        Channel.query
+        .options(db.joinedload(Channel.group))
+        .filter_by(is_active=True)
+        .order_by(Channel.sort_order, Channel.id)
+        .all()
+    )
+
+
+def _render_m3u(channels, host, epg_url):
+    parts = []
+    channel_ids = []
+    current = [f'#EXTM3U x-tvg-url="{epg_url}"' if epg_url else '#EXTM3U']
+    # 按频道排序顺序输出，避免被分组循环打乱
+    for channel in channels:
+        tvg_id_part = f' tvg-id="{channel.tvg_id}"' if channel.tvg_id else ''
+        logo_part = f' tvg-logo="{channel.logo}"' if channel.logo else ''
+        group_part = f' group-title="{channel.group.name}"' if channel.group else ''
+        current.append(f'\n#EXTINF:-1{tvg_id_part} tvg-name="{channel.name}"{logo_part}{group_part},{channel.name}')
+        current.append(f'\n{host}/api/proxy/stream/{channel.id}?')
+        parts.append(''.join(current))
+        channel_ids.append(channel.id)
+        current = []
+    parts.append(''.join(current))
+    return parts, channel_ids
+
+
+def _render_txt(channels, host):
+    parts = []
+    channel_ids = []
+    current = []
+    current_group_name = None
+    separator = ''
+    for channel in channels:
+        group_name = channel.group.name if channel.group else '未分组'
+        if group_name != current_group_name:
+            current.append(f'{separator}{group_name},#genre#')
+            current_group_name = group_name
+            separator = '\n'
+        current.append(f'{separator}{channel.name},{host}/api/proxy/stream/{channel.id}?')
+        separator = '\n'
+        parts.append(''.join(current))
+        channel_ids.append(channel.id)
+        current = []
+    parts.append(''.join(current))
+    return parts, channel_ids
+
+
+def _build_template(fmt, host, epg_url):
+    channels = _query_channels()
+    if fmt == FORMAT_M3U:
+        parts, channel_ids = _render_m3u(channels, host, epg_url)
+    else:
+        parts, channel_ids = _render_txt(channels, host)
+
+    digest = hashlib.sha1()
+    for part, channel_id in zip(parts, channel_ids):
+        digest.update(part.encode('utf-8'))
+        digest.update(f'\0{channel_id}\0'.encode('utf-8'))
+    digest.update(parts[-1].encode('utf-8'))
+    return PlaylistTemplate(tuple(parts), tuple(channel_ids), digest.hexdigest(), time.time())
+
+
+def _get_template(fmt, host, epg_url):
+    key = (fmt, host, get_catalog_version(), epg_url)
+    with _lock:
+        template = _templates.get(key)
+        if template is not None:
+            _templates.move_to_end(key)
+            _stats['hits'] += 1
+            return template
+
+    with _render_lock:
+        with _lock:
+            template = _templates.get(key)
+            if template is not None:
+                _stats['hits'] += 1
+                return template
+
+        template = _build_template(fmt, host, epg_url)
+
+        with _lock:
+            # 目录版本号变化后旧模板不会再命中，直接移除
+            stale_keys = [k for k in _templates if k[2] != key[2]]
+            for stale_key in stale_keys:
+                del _templates[stale_key]
+            if stale_keys:
+                _gzip_bodies.clear()
+            _templates[key] = template
+            while len(_templates) > MAX_TEMPLATES:
+                _templates.popitem(last=False)
+            _stats['renders'] += 1
+    return template
+
+
+def get_playlist(fmt, host, epg_url, user_id, user_token):
+    """
+    获取用户的订阅播放列表（需在 app context 内调用）
+    ETag 与 Last-Modified 无需拼接内容即可得到，命中 If-None-Match 时不必生成内容
+    参数:
+        fmt: FORMAT_M3U / FORMAT_TXT
+        host: 访问地址（不含末尾 /）
+    返回:
+        RenderedPlaylist: (etag, last_modified 时间戳, iter_pieces() -> 文本片段迭代器)
+    """
+    template = _get_template(fmt, host, epg_url)
+
+    if not get_signed_stream_urls_enabled():
+        query = urlencode({'token': user_token})
+        etag = hashlib.sha1(f'{template.digest}\n{query}'.encode('utf-8')).hexdigest()
+
+        def iter_token_pieces():
+            yield template.parts[0]
+            for part in template.parts[1:]:
+                yield query
+                yield part
+
+        return RenderedPlaylist(etag, template.rendered_at, iter_token_pieces)
+
+    # 签名地址：同一份订阅内共用过期时间，过期时间按小时取整，同一时段内内容不变
+    expires_at = get_signed_expiry()
+    etag = hashlib.sha1(
+        f'{template.digest}\n{user_id}\n{user_token}\n{expires_at}'.encode('utf-8')
+    ).hexdigest()
+    # 过期时间上一次变化的时刻
+    expiry_changed_at = expires_at - EXPIRY_ROUNDING_SECONDS - get_signed_stream_url_ttl_seconds()
+
+    def iter_signed_pieces():
+        yield template.parts[0]
+        for channel_id, part in zip(template.channel_ids, template.parts[1:]):
+            yield urlencode(sign_stream_params(user_id, user_token, channel_id, expires_at=expires_at))
+            yield part
+
+    return RenderedPlaylist(etag, max(template.rendered_at, expiry_changed_at), iter_signed_pieces)
+
+
+def get_gzip_body(playlist):
+    """
+    获取订阅内容的 gzip 编码
+    返回:
+        bytes: 已缓存时返回完整内容；否则返回边压缩边输出的迭代器，输出完毕后写入缓存
+    """
+    with _lock:
+        body = _gzip_bodies.get(playlist.etag)
+        if body is not None:
+            _gzip_bodies.move_to_end(playlist.etag)
+            _stats['gzip_hits'] += 1
+            return body
+        _stats['gzip_misses'] += 1
+    return _iter_and_cache_gzip(playlist)
+
+
+def _iter_and_cache_gzip(playlist):
+    compressed = []
+    for data in iter_gzip(iter_text_chunks(playlist.iter_pieces())):
+        compressed.append(data)
+        yield data
+
+    # 客户端中途断开时生成器不会执行到这里，不缓存不完整的内容
+    with _lock:
+        _gzip_bodies[playlist.etag] = b''.join(compressed)
+        _gzip_bodies.move_to_end(playlist.etag)
+        while len(_gzip_bodies) > MAX_GZIP_BODIES:
+            _gzip_bodies.popitem(last=False)
+
+
+def get_playlist_cache_stats():
+    with _lock:
+        return {
+            'templates': len(_templates),
+            'renders': _stats['renders'],
+            'hits': _stats['hits'],
+            'gzip_bodies': len(_gzip_bodies),
+            'gzip_hits': _stats['gzip_hits'],
+            'gzip_misses': _stats['gzip_misses']
+        }
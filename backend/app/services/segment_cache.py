@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+HLS 分片 LRU 缓存（内存 + 可选磁盘）
+
+按上游 URL 缓存分片内容，内存超出上限时按 LRU 溢出到磁盘，磁盘超出上限时删除最久未用的分片。
+同一分片并发未命中时只回源一次，其余请求等待首个请求的结果（回源失败时同样得到该错误，不再各自回源）。
+磁盘层每个进程使用以 PID 命名的子目录，上限按整个缓存目录（所有进程合计）计算；
+已退出进程遗留的子目录在进程启动和定期统计磁盘用量时删除。
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+from app.config import (
+    get_hls_segment_cache_dir,
+    get_hls_segment_cache_disk_bytes,
+    get_hls_segment_cache_memory_bytes
+)
+
+# 等待其他请求回源同一分片的最长时间（秒）
+INFLIGHT_WAIT_SECONDS = 30
+# 统计其他进程磁盘缓存用量的间隔（秒）
+DISK_USAGE_SCAN_SECONDS = 5
+
+
+class _Inflight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 无权限发送信号说明进程存在
+        return True
+    return True
+
+
+def _dir_bytes(path):
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return total
+
+
+class SegmentCache:
+    """按 URL 缓存分片，条目为 (content, content_type)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_dir = None
+        self._disk_seq = 0
+        self._spilling = {}
+        self._other_disk_bytes = 0
+        self._other_disk_scanned_at = None
+        self._inflight = {}
+        self._stats = {}
+
+    def _reset_locked(self):
+        """初始化当前进程的缓存（兼容 Gunicorn preload 后 fork）"""
+        self._pid = os.getpid()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._spilling = {}
+        self._other_disk_bytes = 0
+        self._other_disk_scanned_at = None
+        self._inflight = {}
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'bytes_from_cache': 0,
+            'bytes_from_origin': 0,
+            'evictions': 0
+        }
+
+        base_dir = get_hls_segment_cache_dir()
+        self._disk_dir = None
+        if base_dir and get_hls_segment_cache_disk_bytes() > 0:
+            # 每个进程独立子目录，避免多进程互删文件
+            disk_dir = os.path.join(base_dir, str(self._pid))
+            shutil.rmtree(disk_dir, ignore_errors=True)
+            self._other_disk_bytes = self._scan_other_disk_dirs(base_dir)
+            self._other_disk_scanned_at = time.monotonic()
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+                self._disk_dir = disk_dir
+            except OSError as e:
+                logger.warning(f"HLS 磁盘缓存目录不可用，仅使用内存缓存: {disk_dir}, error={e}")
+
+    def _scan_other_disk_dirs(self, base_dir):
+        """删除已退出进程遗留的子目录，返回仍在运行的其他进程占用的磁盘字节数"""
+        total = 0
+        try:
+            with os.scandir(base_dir) as entries:
+                names = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return 0
+        for name in names:
+            if not name.isdigit() or int(name) == self._pid:
+                continue
+            path = os.path.join(base_dir, name)
+            if _pid_alive(int(name)):
+                total += _dir_bytes(path)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+        return total
+
+    def _other_disk_usage(self):
+        """其他进程的磁盘缓存用量，按 DISK_USAGE_SCAN_SECONDS 间隔在锁外重新统计"""
+        now = time.monotonic()
+        with self._lock:
+            scanned_at = self._other_disk_scanned_at
+            disk_dir = self._disk_dir
+            if disk_dir is None or (scanned_at is not None and now - scanned_at < DISK_USAGE_SCAN_SECONDS):
+                return self._other_disk_bytes
+            # 先占用本轮统计，其他线程继续使用上次结果
+            self._other_disk_scanned_at = now
+
+        other_bytes = self._scan_other_disk_dirs(os.path.dirname(disk_dir))
+        with self._lock:
+            self._other_disk_bytes = other_bytes
+        return other_bytes
+
+    def _ensure_process_locked(self):
+        if self._pid != os.getpid():
+            self._reset_locked()
+
+    def _disk_path_locked(self, url):
+        # 每次溢出使用新文件名，延迟删除的旧文件不会误删同 URL 重新写入的新文件
+        self._disk_seq += 1
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self._disk_dir, f"{digest}.{self._disk_seq}")
+
+    def _memory_hit_locked(self, url):
+        entry = self._memory.get(url)
+        if entry is not None:
+            self._memory.move_to_end(url)
+            return entry
+        # 已移出内存但尚未写完磁盘的分片仍可直接返回
+        return self._spilling.get(url)
+
+    def _store_locked(self, url, entry):
+        """写入内存层，返回需要在锁外写入磁盘的 (url, entry, path) 列表"""
+        memory_limit = get_hls_segment_cache_memory_bytes()
+        spills = []
+        if len(entry[0]) > memory_limit:
+            self._queue_spill_locked(url, entry, spills)
+            return spills
+
+        self._memory[url] = entry
+        self._memory_bytes += len(entry[0])
+        while self._memory_bytes > memory_limit and self._memory:
+            old_url, old_entry = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_entry[0])
+            self._queue_spill_locked(old_url, old_entry, spills)
+        return spills
+
+    def _queue_spill_locked(self, url, entry, spills):
+        """内存淘汰的分片登记为待写磁盘，未启用磁盘层或超过上限时直接丢弃"""
+        if self._disk_dir is None or len(entry[0]) > get_hls_segment_cache_disk_bytes():
+            self._stats['evictions'] += 1
+            return
+        self._spilling[url] = entry
+        spills.append((url, entry, self._disk_path_locked(url)))
+
+    def _write_spills(self, spills):
+        """在锁外写入磁盘（临时文件 + 重命名），完成后再登记到磁盘层"""
+        if not spills:
+            return
+        other_bytes = self._other_disk_usage()
+        for url, entry, path in spills:
+            content, content_type = entry
+            written = True
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.debug(f"HLS 分片写入磁盘缓存失败: {e}")
+                written = False
+                self._remove_files([tmp_path])
+
+            stale_paths = []
+            with self._lock:
+                current = self._spilling.get(url) is entry
+                if current:
+                    self._spilling.pop(url, None)
+                # 写盘期间该分片已重新进入缓存或进程已重置时丢弃本次文件
+                if not written or not current or url in self._memory or url in self._disk:
+                    self._stats['evictions'] += 1
+                    if written:
+                        stale_paths.append(path)
+                else:
+                    # 上限按整个缓存目录计算，只淘汰本进程的文件
+                    disk_limit = max(0, get_hls_segment_cache_disk_bytes() - other_bytes)
+                    self._disk[url] = (content_type, len(content), path)
+                    self._disk_bytes += len(content)
+                    while self._disk_bytes > disk_limit and self._disk:
+                        _, (_, old_size, old_path) = self._disk.popitem(last=False)
+                        self._disk_bytes -= old_size
+                        self._stats['evictions'] += 1
+                        stale_paths.append(old_path)
+            self._remove_files(stale_paths)
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _read_disk_file(path):
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return content
+
+    def get_or_fetch(self, url, fetch):
+        """
+        读取分片，未命中时调用 fetch() 回源并写入缓存
+        锁内只做内存查找和决策，磁盘读写、删除都在锁外进行，慢磁盘不会阻塞内存命中
+        参数:
+            fetch: 无参函数，返回 (content, content_type)，失败时抛出异常
+        返回:
+            tuple: (content, content_type, cache_hit)
+        """
+        disk_meta = None
+        with self._lock:
+            self._ensure_process_locked()
+            entry = self._memory_hit_locked(url)
+            if entry is not None:
+                self._stats['hits'] += 1
+                self._stats['bytes_from_cache'] += len(entry[0])
+                return entry[0], entry[1], True
+
+            inflight = self._inflight.get(url)
+            leader = inflight is None
+            if leader:
+                # 磁盘命中同样由首个请求读取，其余请求按回源方式等待结果
+                inflight = _Inflight()
+                self._inflight[url] = inflight
+                disk_meta = self._disk.pop(url, None)
+                if disk_meta is not None:
+                    self._disk_bytes -= disk_meta[1]
+
+        if not leader:
+            # 其他观众正在回源（或读磁盘）同一分片，等待其结果
+            finished = inflight.event.wait(INFLIGHT_WAIT_SECONDS)
+            if inflight.entry is not None:
+                with self._lock:
+                    self._stats['hits'] += 1
+                    self._stats['bytes_from_cache'] += len(inflight.entry[0])
+                return inflight.entry[0], inflight.entry[1], True
+            if finished and inflight.error is not None:
+                # 首个请求回源失败，直接返回同一错误，避免等待者同时重试压垮上游
+                raise inflight.error
+            # 等待超时：首个请求仍未完成，自行回源
+            content, content_type = fetch()
+            with self._lock:
+                self._stats['misses'] += 1
+                self._stats['bytes_from_origin'] += len(content)
+            return content, content_type, False
+
+        spills = []
+        try:
+            entry = None
+            if disk_meta is not None:
+                content = self._read_disk_file(disk_meta[2])
+                if content is not None:
+                    # 磁盘命中后提升回内存
+                    entry = (content, disk_meta[0])
+            cache_hit = entry is not None
+            if not cache_hit:
+                try:
+                    entry = fetch()
+                except Exception as e:
+                    inflight.error = e
+                    raise
+            with self._lock:
+                self._ensure_process_locked()
+                if cache_hit:
+                    self._stats['hits'] += 1
+                    self._stats['bytes_from_cache'] += len(entry[0])
+                else:
+                    self._stats['misses'] += 1
+                    self._stats['bytes_from_origin'] += len(entry[0])
+                spills = self._store_locked(url, entry)
+            inflight.entry = entry
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+            inflight.event.set()
+        self._write_spills(spills)
+        return entry[0], entry[1], cache_hit
+
+    def get_stats(self):
+        with self._lock:
+            self._ensure_process_locked()
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['disk_entries'] = len(self._disk)
+            stats['disk_bytes'] = self._disk_bytes
+
+        total = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / total, 4) if total else 0.0
+        # 命中缓存的字节即为少回源的字节
+        stats['bytes_saved'] = stats['bytes_from_cache']
+        return stats
+
+
+segment_cache = SegmentCache()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+上游源排序（多源故障切换）
+
+流代理在进程内记录每个上游地址最近的首字节耗时（EWMA）与失败时间，
+切换时优先选择近期未失败、延迟更低的源；没有差异时保持配置顺序。
+"""
+
+import threading
+import time
+
+# 失败后在该时间内排到未失败源之后（秒）
+FAILURE_COOLDOWN_SECONDS = 60
+# 首字节耗时每高出该值（毫秒），排序后移一位
+LATENCY_STEP_MS = 500
+EWMA_ALPHA = 0.3
+
+_lock = threading.Lock()
+_sources = {}
+
+
+def _source_stats(url):
+    stats = _sources.get(url)
+    if stats is None:
+        stats = _sources.setdefault(url, {
+            'ewma_ttfb_ms': None,
+            'successes': 0,
+            'failures': 0,
+            'last_failure': None
+        })
+    return stats
+
+
+def record_success(url, ttfb_ms):
+    """记录一次成功连接及首字节耗时"""
+    with _lock:
+        stats = _source_stats(url)
+        stats['successes'] += 1
+        previous = stats['ewma_ttfb_ms']
+        stats['ewma_ttfb_ms'] = ttfb_ms if previous is None else previous + EWMA_ALPHA * (ttfb_ms - previous)
+
+
+def record_failure(url):
+    """记录一次连接失败、中断或停滞"""
+    with _lock:
+        stats = _source_stats(url)
+        stats['failures'] += 1
+        stats['last_failure'] = time.monotonic()
+
+
+def rank_sources(urls):
+    """
+    按近期失败、首字节耗时与配置顺序排序
+    参数:
+        urls: 按配置优先级排列的地址列表（不健康的主源已由调用方后移）
+    返回:
+        list: 排序后的地址列表
+    """
+    now = time.monotonic()
+    with _lock:
+        snapshot = {url: dict(_sources[url]) for url in urls if url in _sources}
+
+    def sort_key(item):
+        index, url = item
+        stats = snapshot.get(url)
+        if stats is None:
+            return (False, index)
+        recently_failed = (
+            stats['last_failure'] is not None and now - stats['last_failure'] < FAILURE_COOLDOWN_SECONDS
+        )
+        latency_penalty = (stats['ewma_ttfb_ms'] or 0) / LATENCY_STEP_MS
+        return (recently_failed, index + latency_penalty)
+
+    return [url for _, url in sorted(enumerate(urls), key=sort_key)]
+
+
+def get_source_stats(url):
+    with _lock:
+        stats = _sources.get(url)
+        return dict(stats) if stats is not None else None
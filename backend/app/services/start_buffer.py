@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+关键帧对齐的起播缓冲（秒切台）
+
+共享上游在转发的同时记录最近的 PAT/PMT，以及从最近一个视频随机访问点开始的全部 TS 包。
+新观众加入时先收到这段数据，播放器无需等待下一组 PAT/PMT 与 IDR 即可出画面。
+"""
+
+from app.services.mpegts import (
+    PAT_PID,
+    TS_PACKET_SIZE,
+    TS_SYNC_BYTE,
+    find_sync,
+    find_video_stream,
+    is_keyframe_start,
+    parse_pat,
+    parse_pmt
+)
+
+# 超过该字节数仍未对齐到 TS 包时视为非 TS 流，停止解析
+MAX_SYNC_PROBE_BYTES = 64 * 1024
+
+
+class KeyframeStartBuffer:
+    """单个共享上游的起播缓冲（仅由上游读取线程 / 任务写入）"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max(TS_PACKET_SIZE, int(max_bytes))
+        self.disabled = False
+        self._aligned = False
+        self._probe_bytes = 0
+        # 对齐后尚未凑满一个 TS 包的尾部数据（已随上一块转发给观众）
+        self._carry = b''
+
+        self._pat = None
+        self._pmt_pids = set()
+        self._pmts = {}
+        self._video_pid = None
+        self._codec = None
+
+        self._gop = []
+        self._gop_bytes = 0
+        self._gop_started = False
+        self._snapshot = None
+
+    @property
+    def gop_bytes(self):
+        return self._gop_bytes if self._gop_started else 0
+
+    def _reset_gop(self):
+        self._gop = []
+        self._gop_bytes = 0
+        self._gop_started = False
+
+    def feed(self, chunk):
+        """写入一块上游数据"""
+        if self.disabled:
+            return
+        self._snapshot = None
+        data = self._carry + chunk
+        position = 0
+
+        if not self._aligned:
+            position = find_sync(data)
+            if position < 0:
+                self._probe_bytes += len(chunk)
+                if self._probe_bytes > MAX_SYNC_PROBE_BYTES:
+                    self.disabled = True
+                    self._carry = b''
+                    return
+                # 保留末尾几包长度的数据，与下一块拼接后继续查找
+                self._carry = data[-TS_PACKET_SIZE * 3:]
+                return
+            self._aligned = True
+
+        span_start = position
+        length = len(data)
+        while position + TS_PACKET_SIZE <= length:
+            if data[position] != TS_SYNC_BYTE:
+                # 失去同步：丢弃当前 GOP，下一块重新对齐
+                self._aligned = False
+                self._reset_gop()
+                self._carry = data[position + 1:]
+                return
+
+            header1 = data[position + 1]
+            pid = ((header1 & 0x1F) << 8) | data[position + 2]
+            if pid == PAT_PID:
+                packet = data[position:position + TS_PACKET_SIZE]
+                pmt_pids = parse_pat(packet)
+                if pmt_pids:
+                    self._pat = packet
+                    self._pmt_pids = set(pmt_pids)
+            elif pid in self._pmt_pids:
+                packet = data[position:position + TS_PACKET_SIZE]
+                pmt = parse_pmt(packet)
+                if pmt:
+                    self._pmts[pid] = packet
+                    if self._video_pid is None:
+                        self._video_pid, self._codec = find_video_stream(pmt)
+            elif pid == self._video_pid and (header1 & 0x40 or data[position + 3] & 0x20):
+                # 仅检查 PES 起始包或带适配域的视频包
+                if is_keyframe_start(data[position:position + TS_PACKET_SIZE], self._codec):
+                    self._reset_gop()
+                    self._gop_started = True
+                    span_start = position
+            position += TS_PACKET_SIZE
+
+        if self._gop_started and position > span_start:
+            self._gop.append(data[span_start:position])
+            self._gop_bytes += position - span_start
+            if self._gop_bytes > self.max_bytes:
+                # GOP 过长，放弃本组，等待下一个关键帧
+                self._reset_gop()
+        self._carry = data[position:]
+
+    def snapshot(self):
+        """
+        获取起播数据：PAT + PMT + 最近关键帧起的 TS 包 + 未完整的尾包
+        尾包的剩余部分就在下一块实时数据开头，观众收到后可无缝衔接
+        返回:
+            bytes: 起播数据，尚未见到完整的 PAT/PMT/关键帧时返回 b''
+        """
+        if self.disabled or not self._gop_started or self._pat is None or not self._pmts:
+            return b''
+        if self._snapshot is None:
+            self._snapshot = b''.join([self._pat, *self._pmts.values(), *self._gop, self._carry])
+        return self._snapshot
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+播放鉴权参数（订阅 Token / 签名地址）
+
+签名地址形如 /api/proxy/stream/<id>?u=<uid>&exp=<ts>&sig=<hmac>，以 JWT 密钥签名，
+校验时只需计算 HMAC，不查询 users 表。签名内容包含用户当前订阅 Token 的摘要作为吊销纪元，
+重置 Token 后该用户此前签发的地址全部失效。
+"""
+
+import hashlib
+import hmac
+import math
+import time
+
+from app.config import get_signed_stream_url_ttl_seconds, get_signed_stream_urls_enabled
+from app.utils.jwt import derive_signing_key
+
+# 签名地址的过期时间按该粒度向上取整，同一时段内生成的订阅内容保持不变
+EXPIRY_ROUNDING_SECONDS = 3600
+
+# HLS 改写地址中 u / sig 已用于上游地址，签名鉴权参数改用以下名称携带
+_HLS_SIGNED_PARAM_NAMES = {'u': 'uid', 'exp': 'exp', 'sig': 'auth'}
+
+
+def _token_epoch(user_token):
+    """订阅 Token 摘要：Token 重置后变化，使旧签名失效"""
+    return hashlib.sha256((user_token or '').encode('utf-8')).hexdigest()[:16]
+
+
+def _signature(user_id, user_token, channel_id, expires_at):
+    message = f"{user_id}\n{channel_id}\n{expires_at}\n{_token_epoch(user_token)}".encode('utf-8')
+    return hmac.new(derive_signing_key('stream'), message, hashlib.sha256).hexdigest()[:32]
+
+
+def get_signed_expiry(now=None):
+    """当前时刻签发的签名地址的过期时间戳（按 EXPIRY_ROUNDING_SECONDS 向上取整）"""
+    now = time.time() if now is None else now
+    expires_at = now + get_signed_stream_url_ttl_seconds()
+    return int(math.ceil(expires_at / EXPIRY_ROUNDING_SECONDS) * EXPIRY_ROUNDING_SECONDS)
+
+
+def sign_stream_params(user_id, user_token, channel_id, now=None, expires_at=None):
+    """
+    生成签名播放参数
+    参数:
+        expires_at: 指定过期时间戳（同一份订阅内的地址共用），缺省时按当前时刻计算
+    返回:
+        dict: {'u': 用户 ID, 'exp': 过期时间戳, 'sig': 签名}
+    """
+    if expires_at is None:
+        expires_at = get_signed_expiry(now)
+    return {
+        'u': str(user_id),
+        'exp': str(expires_at),
+        'sig': _signature(user_id, user_token, channel_id, expires_at)
+    }
+
+
+def build_stream_query(user_id, user_token, channel_id):
+    """订阅中播放地址的鉴权参数：启用签名地址时使用签名参数，否则使用订阅 Token"""
+    if get_signed_stream_urls_enabled():
+        return sign_stream_params(user_id, user_token, channel_id)
+    return {'token': user_token}
+
+
+def parse_signed_params(user_id, expires_at):
+    """
+    解析签名参数中的用户 ID 与过期时间
+    返回:
+        tuple: (user_id, expires_at)，格式错误时返回 (None, None)
+    """
+    try:
+        return int(user_id), int(expires_at)
+    except (TypeError, ValueError):
+        return None, None
+
+
+def verify_signature(user_id, user_token, channel_id, expires_at, signature, now=None):
+    """校验签名与过期时间"""
+    now = time.time() if now is None else now
+    if not signature or expires_at < now:
+        return False
+    return hmac.compare_digest(_signature(user_id, user_token, channel_id, expires_at), signature)
+
+
+def credentials_from_stream_query(args):
+    """从流代理入口地址的查询参数中提取鉴权参数"""
+    if args.get('token'):
+        return {'token': args.get('token')}
+    return {name: args.get(name) for name in ('u', 'exp', 'sig')}
+
+
+def credentials_from_hls_query(args):
+    """从 HLS 改写地址的查询参数中提取鉴权参数"""
+    if args.get('token'):
+        return {'token': args.get('token')}
+    return {name: args.get(hls_name) for name, hls_name in _HLS_SIGNED_PARAM_NAMES.items()}
+
+
+def hls_query_params(credentials):
+    """HLS 改写地址中携带的鉴权参数"""
+    if credentials.get('token'):
+        return {'token': credentials['token']}
+    return {hls_name: credentials.get(name) for name, hls_name in _HLS_SIGNED_PARAM_NAMES.items()}
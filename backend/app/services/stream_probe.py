@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+深度健康探测：码流采样分析
+
+开启 HEALTH_CHECK_DEEP_PROBE 后，健康检测不再以响应状态码或首块数据判定健康，
+而是读取有限的码流样本（HEALTH_CHECK_DEEP_SAMPLE_SECONDS 秒或 HEALTH_CHECK_DEEP_SAMPLE_KB，先到为准）并检查：
+- 0x47 同步字节对齐（返回 HTML 错误页等非 TS 内容时判为异常）；
+- PAT / PMT 是否出现；
+- 连续计数（CC）错误与失步比例；
+- PCR 是否停止走动（画面冻结的码流）。
+同时测得首字节耗时与码率（优先按 PCR 计算，不受上游突发发送影响），写回频道供排序。
+"""
+
+import time
+from collections import Counter, namedtuple
+
+from loguru import logger
+
+from app.config import get_health_check_deep_sample_bytes, get_health_check_deep_sample_seconds
+from app.services.mpegts import (
+    NULL_PID,
+    PAT_PID,
+    TS_PACKET_SIZE,
+    TS_SYNC_BYTE,
+    continuity_counter,
+    discontinuity_indicator,
+    find_sync,
+    has_payload,
+    packet_pcr,
+    packet_pid,
+    parse_pat,
+    parse_pmt
+)
+
+# 每次从上游读取的大小
+SAMPLE_READ_SIZE = 64 * 1024
+# CC 错误与失步次数超过 TS 包数的该比例时判为异常
+MAX_ERROR_RATIO = 0.05
+# PCR 时钟频率
+PCR_CLOCK_HZ = 27000000
+
+# bitrate_kbps / first_byte_ms 仅深度探测时有值
+ProbeResult = namedtuple('ProbeResult', ['is_healthy', 'bitrate_kbps', 'first_byte_ms'])
+
+TsSampleReport = namedtuple(
+    'TsSampleReport',
+    ['synced', 'packets', 'resyncs', 'cc_errors', 'has_pat', 'has_pmt', 'pcr_frozen', 'pcr_bitrate_kbps']
+)
+
+
+def shallow_result(is_healthy):
+    """浅层探测（状态码 / 首块数据）的结果"""
+    return ProbeResult(bool(is_healthy), None, None)
+
+
+UNHEALTHY = shallow_result(False)
+
+
+def _pcr_bitrate_kbps(pcrs):
+    """按同一 PID 上首尾两个 PCR 之间的字节数与时间差计算码率"""
+    if len(pcrs) < 2:
+        return None
+    (first_offset, first_pcr), (last_offset, last_pcr) = pcrs[0], pcrs[-1]
+    if last_pcr <= first_pcr:
+        return None
+    seconds = (last_pcr - first_pcr) / PCR_CLOCK_HZ
+    return int((last_offset - first_offset) * 8 / seconds / 1000)
+
+
+def analyze_ts_sample(data):
+    """
+    分析 TS 样本
+    返回:
+        TsSampleReport
+    """
+    position = find_sync(data)
+    if position < 0:
+        return TsSampleReport(False, 0, 0, 0, False, False, False, None)
+
+    packets = resyncs = cc_errors = 0
+    has_pat = has_pmt = False
+    pmt_pids = set()
+    pcr_pid = None
+    last_cc = {}
+    pcrs_by_pid = {}
+
+    while position + TS_PACKET_SIZE <= len(data):
+        if data[position] != TS_SYNC_BYTE:
+            position = find_sync(data, position + 1)
+            if position < 0:
+                break
+            resyncs += 1
+            continue
+
+        packet = data[position:position + TS_PACKET_SIZE]
+        pid = packet_pid(packet)
+        packets += 1
+
+        if pid == PAT_PID:
+            program_pids = parse_pat(packet)
+            if program_pids:
+                has_pat = True
+                pmt_pids.update(program_pids)
+        elif pid in pmt_pids:
+            pmt = parse_pmt(packet)
+            if pmt is not None:
+                has_pmt = True
+                pcr_pid = pmt['pcr_pid']
+
+        if pid != NULL_PID and has_payload(packet):
+            counter = continuity_counter(packet)
+            previous = last_cc.get(pid)
+            # 允许重复包（计数不变）；带不连续标记的包重新计数
+            if (
+                previous is not None
+                and not discontinuity_indicator(packet)
+                and counter not in (previous, (previous + 1) & 0x0F)
+            ):
+                cc_errors += 1
+            last_cc[pid] = counter
+
+        pcr = packet_pcr(packet)
+        if pcr is not None:
+            pcrs_by_pid.setdefault(pid, []).append((position, pcr))
+
+        position += TS_PACKET_SIZE
+
+    if pcr_pid not in pcrs_by_pid and pcrs_by_pid:
+        # PMT 未出现或 PCR PID 未携带 PCR 时，取携带 PCR 最多的 PID
+        pcr_pid = Counter({pid: len(values) for pid, values in pcrs_by_pid.items()}).most_common(1)[0][0]
+    pcrs = pcrs_by_pid.get(pcr_pid, [])
+    pcr_frozen = len(pcrs) >= 2 and all(pcr == pcrs[0][1] for _, pcr in pcrs)
+
+    return TsSampleReport(
+        True, packets, resyncs, cc_errors, has_pat, has_pmt, pcr_frozen, _pcr_bitrate_kbps(pcrs)
+    )
+
+
+def _sample_problem(report):
+    """返回样本的异常原因，正常时返回 None"""
+    if not report.synced or not report.packets:
+        return '非 MPEG-TS 内容（未找到 0x47 同步字节）'
+    if not report.has_pat:
+        return '缺少 PAT'
+    if not report.has_pmt:
+        return '缺少 PMT'
+    if report.pcr_frozen:
+        return 'PCR 停止走动（画面冻结）'
+    error_count = report.cc_errors + report.resyncs
+    if error_count > report.packets * MAX_ERROR_RATIO:
+        return f'连续计数错误过多（CC 错误 {report.cc_errors}，失步 {report.resyncs}，共 {report.packets} 包）'
+    return None
+
+
+class SampleCollector:
+    """按字节数与时长上限收集码流样本（线程与事件循环探测共用）"""
+
+    def __init__(self, started_at):
+        self._started_at = started_at
+        self._chunks = []
+        self._size = 0
+        self._first_byte_at = None
+        self._last_byte_at = None
+        self._max_bytes = get_health_check_deep_sample_bytes()
+        self.max_seconds = get_health_check_deep_sample_seconds()
+        self.done = False
+
+    def feed(self, chunk):
+        """加入一块数据，样本已足够时返回 True"""
+        now = time.perf_counter()
+        if self._first_byte_at is None:
+            self._first_byte_at = now
+        self._last_byte_at = now
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        self.done = self._size >= self._max_bytes or now - self._first_byte_at >= self.max_seconds
+        return self.done
+
+    def evaluate(self, channel_name):
+        """分析已收集的样本"""
+        if not self._size:
+            return UNHEALTHY
+
+        first_byte_ms = int((self._first_byte_at - self._started_at) * 1000)
+        report = analyze_ts_sample(b''.join(self._chunks))
+        bitrate_kbps = report.pcr_bitrate_kbps
+        elapsed = self._last_byte_at - self._first_byte_at
+        # PCR 冻结时按到达速率估算的码率没有意义（上游可能在突发补发旧数据）
+        if bitrate_kbps is None and not report.pcr_frozen and elapsed > 0:
+            bitrate_kbps = int(self._size * 8 / elapsed / 1000)
+
+        problem = _sample_problem(report)
+        if problem:
+            logger.debug(f"深度探测异常 ({channel_name}): {problem}")
+        return ProbeResult(problem is None, bitrate_kbps, first_byte_ms)
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+频道流共享转发服务（同频道多观众共用一路上游，上游中断或停滞时切换备用源）
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+
+import requests
+from loguru import logger
+
+from app.config import (
+    get_proxy_buffer_size,
+    get_proxy_failover_stall_seconds,
+    get_proxy_relay_buffer_chunks,
+    get_proxy_relay_linger_seconds,
+    get_proxy_start_buffer_enabled,
+    get_proxy_start_buffer_max_bytes
+)
+from app.services.content_type_cache import remember_content_type
+from app.services.host_breaker import allow_request, record_host_failure, record_host_success
+from app.services.metrics import observe_upstream_ttfb
+from app.services.multicast_relay import MulticastReceiver, is_multicast_url, parse_multicast_url
+from app.services.source_ranking import rank_sources, record_failure, record_success
+from app.services.start_buffer import KeyframeStartBuffer
+from app.utils import http_pool
+
+# 观众等待新数据的最长阻塞时间，超时后重新检查上游状态
+SUBSCRIBER_WAIT_SECONDS = 5
+UPSTREAM_TIMEOUT_SECONDS = 30
+DEFAULT_CONTENT_TYPE = 'video/mp2t'
+# 所有源都中断后开始下一轮切换前的等待（秒），逐轮翻倍直至上限
+FAILOVER_BACKOFF_SECONDS = 1
+FAILOVER_BACKOFF_MAX_SECONDS = 30
+# 连续重试轮次上限，超过后结束上游（观众连接随之结束，由播放器重连）
+FAILOVER_MAX_ROUNDS = 8
+# 单个源持续出流超过该时间视为已恢复，重置退避轮次
+FAILOVER_HEALTHY_SECONDS = 60
+
+
+def relay_key(channel_id, stream_urls):
+    """共享上游的键：单一组播源按组播组（每组只加入一次），其余按频道 + 源地址集合"""
+    if len(stream_urls) == 1 and is_multicast_url(stream_urls[0]):
+        return ('multicast',) + parse_multicast_url(stream_urls[0])
+    return (channel_id, tuple(sorted(stream_urls)))
+
+
+def create_start_buffer():
+    if not get_proxy_start_buffer_enabled():
+        return None
+    return KeyframeStartBuffer(get_proxy_start_buffer_max_bytes())
+
+
+class SourceFailover:
+    """
+    多源切换决策（线程版与异步版共享上游共用，只做决策不做 I/O）
+
+    - 源出错或停滞：记为失败并切换到下一个源；该源曾出流时其余源重新参与切换
+    - 源正常结束（EOF）：不记为失败；本轮已无其他源可试时视为流结束，点播或有限长度的源不会被反复重拉
+    - 一轮内所有源都已试过：本轮有源出过流时退避后开始下一轮，否则结束；连续轮次达到上限时结束
+    """
+
+    def __init__(self, stream_urls):
+        self._stream_urls = list(stream_urls)
+        self._tried = set()
+        self._received = False
+        self._last_ended = False
+        self._rounds = 0
+
+    def next_source(self):
+        """
+        选择下一个要连接的源
+        返回:
+            tuple: (源地址, 连接前需等待的秒数)；应结束上游时源地址为 None
+        """
+        delay = 0
+        while True:
+            candidates = [url for url in rank_sources(self._stream_urls) if url not in self._tried]
+            if candidates:
+                source_url = candidates[0]
+                self._tried.add(source_url)
+                return source_url, delay
+
+            if self._last_ended or not self._received or self._rounds >= FAILOVER_MAX_ROUNDS:
+                return None, 0
+            self._rounds += 1
+            self._tried.clear()
+            self._received = False
+            delay = min(FAILOVER_BACKOFF_MAX_SECONDS, FAILOVER_BACKOFF_SECONDS * 2 ** (self._rounds - 1))
+
+    def source_done(self, source_url, received_bytes, elapsed_seconds, error=None):
+        """记录一次源读取的结果，error 为 None 表示上游正常结束"""
+        self._last_ended = error is None
+        if error is not None:
+            record_failure(source_url)
+        if received_bytes and error is not None:
+            # 该源曾正常出流，其余源重新参与切换
+            self._received = True
+            self._tried = {source_url}
+        if received_bytes and elapsed_seconds >= FAILOVER_HEALTHY_SECONDS:
+            self._rounds = 0
+
+
+class StreamRelay:
+    """单个频道的上游读取器 + 环形缓冲区"""
+
+    def __init__(self, hub, key, channel_id, stream_urls):
+        self._hub = hub
+        self.key = key
+        self.channel_id = channel_id
+        # 按优先级排列的源地址，实际连接顺序由 rank_sources 结合近期失败与延迟决定
+        self.stream_urls = list(stream_urls)
+        self.stream_url = self.stream_urls[0]
+
+        self._cond = threading.Condition()
+        self._chunks = deque(maxlen=max(1, int(get_proxy_relay_buffer_chunks())))
+        # 下一个写入块的序号；缓冲区最旧块序号 = _next_seq - len(_chunks)
+        self._next_seq = 0
+        self._viewers = 0
+        self._finished = False
+        self._stop_event = threading.Event()
+        self._linger_timer = None
+        # 上游 HTTP 响应或组播接收器，stop() 时关闭以尽快结束读取
+        self._upstream = None
+        self._thread = None
+        # 上游响应头到达（或连接失败）时置位
+        self._headers_event = threading.Event()
+        self.content_type = None
+
+        # 关键帧起播缓冲，随 _publish 在 _cond 内更新
+        self._start_buffer = create_start_buffer()
+
+        self.bytes_relayed = 0
+        self.lagged_skips = 0
+        self.fast_starts = 0
+        self.failovers = 0
+
+    @property
+    def finished(self):
+        return self._finished
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    def start(self):
+        """启动上游读取线程"""
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"stream-relay-{self.channel_id}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        """读取上游并写入环形缓冲区"""
+        try:
+            self._run_sources(get_proxy_buffer_size())
+        except Exception as e:
+            if not self._stop_event.is_set():
+                logger.error(f"Stream error: {e}")
+        finally:
+            self._upstream = None
+            self._headers_event.set()
+            with self._cond:
+                self._finished = True
+                self._cancel_linger_locked()
+                self._cond.notify_all()
+            # 不持有 _cond 时再访问 hub，保持 hub 锁 -> relay 锁的加锁顺序
+            self._hub._discard(self)
+            logger.debug(f"上游已关闭: channel_id={self.channel_id}, 转发字节={self.bytes_relayed}")
+
+    def _run_sources(self, buffer_size):
+        """依次连接各个源，切换规则见 SourceFailover，切换期间观众连接保持不断"""
+        failover = SourceFailover(self.stream_urls)
+        while not self._stop_event.is_set():
+            source_url, delay = failover.next_source()
+            if source_url is None:
+                return
+            if delay and self._stop_event.wait(delay):
+                return
+            if not allow_request(source_url):
+                # 源所在主机熔断中，直接尝试下一个源
+                logger.debug(f"上游主机熔断中，跳过源: channel_id={self.channel_id}, url={source_url}")
+                continue
+
+            bytes_before = self.bytes_relayed
+            started_at = time.monotonic()
+            error = None
+            try:
+                self._read_source(source_url, buffer_size)
+            except Exception as e:
+                error = e
+            if self._stop_event.is_set():
+                return
+
+            failover.source_done(source_url, self.bytes_relayed - bytes_before, time.monotonic() - started_at, error)
+            if error is None:
+                logger.info(f"上游已结束: channel_id={self.channel_id}, url={source_url}")
+                continue
+            self.failovers += 1
+            logger.warning(f"上游中断，切换源: channel_id={self.channel_id}, url={source_url}, error={error}")
+
+    def _read_source(self, source_url, buffer_size):
+        self.stream_url = source_url
+        with self._cond:
+            # 不同源的 PAT/PMT 与时间戳不连续，起播缓冲重新积累
+            self._start_buffer = create_start_buffer()
+        if is_multicast_url(source_url):
+            self._read_multicast(source_url, buffer_size)
+        else:
+            self._read_http(source_url, buffer_size)
+
+    def _on_upstream_ready(self, content_type):
+        if not self._headers_event.is_set():
+            self.content_type = content_type or DEFAULT_CONTENT_TYPE
+            remember_content_type(self.channel_id, self.stream_url, self.content_type)
+            self._headers_event.set()
+        logger.debug(f"上游已连接: channel_id={self.channel_id}, url={self.stream_url}")
+
+    def _read_http(self, source_url, buffer_size):
+        started_at = time.perf_counter()
+        stall_seconds = get_proxy_failover_stall_seconds()
+        # 读超时即停滞判定时间：超过该时间收不到数据就切换源
+        try:
+            response = http_pool.get(source_url, stream=True, timeout=(UPSTREAM_TIMEOUT_SECONDS, stall_seconds))
+        except requests.exceptions.RequestException:
+            record_host_failure(source_url)
+            raise
+        with response as r:
+            self._upstream = r
+            if r.status_code >= 500:
+                record_host_failure(source_url)
+            r.raise_for_status()
+            record_host_success(source_url)
+            self._on_upstream_ready(r.headers.get('Content-Type'))
+            first_chunk = True
+            for chunk in r.iter_content(chunk_size=buffer_size):
+                if self._stop_event.is_set():
+                    break
+                if chunk:
+                    if first_chunk:
+                        ttfb_seconds = time.perf_counter() - started_at
+                        record_success(source_url, ttfb_seconds * 1000)
+                        observe_upstream_ttfb('http', ttfb_seconds)
+                        first_chunk = False
+                    self._publish(chunk)
+
+    def _read_multicast(self, source_url, buffer_size):
+        started_at = time.perf_counter()
+        stall_seconds = get_proxy_failover_stall_seconds()
+        receiver = MulticastReceiver(source_url, buffer_size)
+        self._upstream = receiver
+        try:
+            self._on_upstream_ready(DEFAULT_CONTENT_TYPE)
+            first_chunk = True
+            chunks = receiver.iter_chunks(
+                self._stop_event,
+                poll_seconds=min(1, stall_seconds),
+                idle_timeout=stall_seconds
+            )
+            for chunk in chunks:
+                if first_chunk:
+                    ttfb_seconds = time.perf_counter() - started_at
+                    record_success(source_url, ttfb_seconds * 1000)
+                    observe_upstream_ttfb('multicast', ttfb_seconds)
+                    first_chunk = False
+                self._publish(chunk)
+        finally:
+            receiver.close()
+
+    def wait_content_type(self, timeout=UPSTREAM_TIMEOUT_SECONDS):
+        """等待上游响应头，返回上游 Content-Type；上游连接失败或超时返回 None"""
+        self._headers_event.wait(timeout)
+        return self.content_type
+
+    def _publish(self, chunk):
+        with self._cond:
+            if self._start_buffer is not None:
+                self._start_buffer.feed(chunk)
+            self._chunks.append(chunk)
+            self._next_seq += 1
+            self.bytes_relayed += len(chunk)
+            self._cond.notify_all()
+
+    def try_attach(self):
+        """
+        增加观众计数
+        返回:
+            tuple: (起始序号, 起播数据)，观众先收到起播数据再从实时位置继续；上游已停止时返回 None
+        """
+        with self._cond:
+            if self._finished or self._stop_event.is_set():
+                return None
+            self._viewers += 1
+            self._cancel_linger_locked()
+            start_burst = self._start_buffer.snapshot() if self._start_buffer is not None else b''
+            if start_burst:
+                self.fast_starts += 1
+            return self._next_seq, start_burst
+
+    def detach(self):
+        """减少观众计数，最后一位观众离开后延迟关闭上游"""
+        with self._cond:
+            self._viewers = max(0, self._viewers - 1)
+            if self._viewers > 0 or self._finished:
+                return
+
+            linger_seconds = get_proxy_relay_linger_seconds()
+            if linger_seconds > 0:
+                self._linger_timer = threading.Timer(linger_seconds, self._stop_if_idle)
+                self._linger_timer.daemon = True
+                self._linger_timer.start()
+                return
+
+        self.stop()
+
+    def _cancel_linger_locked(self):
+        if self._linger_timer is not None:
+            self._linger_timer.cancel()
+            self._linger_timer = None
+
+    def _stop_if_idle(self):
+        with self._cond:
+            self._linger_timer = None
+            if self._viewers > 0 or self._finished:
+                return
+        self.stop()
+
+    def stop(self):
+        """停止上游读取"""
+        with self._cond:
+            if self._viewers > 0:
+                return
+            self._stop_event.set()
+            upstream = self._upstream
+
+        # 先从 hub 摘除，避免新观众挂到即将关闭的上游
+        self._hub._discard(self)
+        if upstream is not None:
+            try:
+                upstream.close()
+            except Exception:
+                pass
+
+    def read(self, cursor):
+        """
+        读取 cursor 之后的缓冲块
+        返回:
+            tuple: (chunks, next_cursor)，上游结束且已读完时 chunks 为 None
+        """
+        with self._cond:
+            while cursor >= self._next_seq and not self._finished:
+                self._cond.wait(SUBSCRIBER_WAIT_SECONDS)
+
+            if cursor >= self._next_seq:
+                return None, cursor
+
+            oldest_seq = self._next_seq - len(self._chunks)
+            if cursor < oldest_seq:
+                # 观众消费过慢，跳到缓冲区最旧数据，避免拖慢上游
+                self.lagged_skips += 1
+                cursor = oldest_seq
+
+            chunks = list(itertools.islice(self._chunks, cursor - oldest_seq, None))
+            return chunks, self._next_seq
+
+    def to_dict(self):
+        return {
+            'channel_id': self.channel_id,
+            'source': 'multicast' if is_multicast_url(self.stream_url) else 'http',
+            'active_url': self.stream_url,
+            'source_count': len(self.stream_urls),
+            'failovers': self.failovers,
+            'viewers': self._viewers,
+            'bytes_relayed': self.bytes_relayed,
+            'lagged_skips': self.lagged_skips,
+            'start_buffer_bytes': self._start_buffer.gop_bytes if self._start_buffer is not None else 0,
+            'fast_starts': self.fast_starts
+        }
+
+
+class RelayHub:
+    """按频道管理共享上游"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._relays = {}
+
+    def _discard(self, relay):
+        with self._lock:
+            if self._relays.get(relay.key) is relay:
+                del self._relays[relay.key]
+
+    def _acquire(self, channel_id, stream_urls):
+        key = relay_key(channel_id, stream_urls)
+        with self._lock:
+            relay = self._relays.get(key)
+            attached = relay.try_attach() if relay is not None else None
+            if attached is None:
+                relay = StreamRelay(self, key, channel_id, stream_urls)
+                self._relays[key] = relay
+                attached = relay.try_attach()
+                relay.start()
+        return relay, attached
+
+    def subscribe(self, channel_id, stream_urls):
+        """订阅频道流（立即挂到共享上游），stream_urls 为按优先级排列的源地址，返回 RelaySubscription"""
+        relay, (cursor, start_burst) = self._acquire(channel_id, stream_urls)
+        return RelaySubscription(relay, cursor, start_burst)
+
+    def get_stats(self):
+        with self._lock:
+            relays = list(self._relays.values())
+        return [relay.to_dict() for relay in relays]
+
+
+class RelaySubscription:
+    """单个观众对共享上游的订阅，可迭代获取数据块，关闭时释放观众计数"""
+
+    def __init__(self, relay, cursor, start_burst=b''):
+        self._relay = relay
+        self._cursor = cursor
+        self._start_burst = start_burst
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    def wait_content_type(self, timeout=UPSTREAM_TIMEOUT_SECONDS):
+        return self._relay.wait_content_type(timeout)
+
+    def __iter__(self):
+        if self._start_burst:
+            start_burst, self._start_burst = self._start_burst, b''
+            yield start_burst
+        while not self._closed:
+            chunks, self._cursor = self._relay.read(self._cursor)
+            if chunks is None:
+                return
+            for chunk in chunks:
+                yield chunk
+
+    def close(self):
+        """幂等释放订阅"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._relay.detach()
+
+
+relay_hub = RelayHub()
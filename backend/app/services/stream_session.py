@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+播放会话服务（流代理鉴权、上游地址解析与观看会话生命周期）
+"""
+
+import uuid
+from loguru import logger
+from app import db
+from app.models.watch_history import WatchHistory
+from app.models.active_connection import ActiveConnection
+from app.config import get_multicast_native_enabled, get_signed_stream_urls_enabled
+from app.services.channel_catalog import get_catalog_channel
+from app.services.content_type_cache import get_cached_content_type
+from app.services.multicast_relay import is_multicast_url
+from app.utils.datetime_utils import to_utc_naive
+from app.services.heartbeat_aggregator import heartbeat_aggregator
+from app.services.stream_auth import hls_query_params, parse_signed_params, verify_signature
+from app.services.stream_urls import extract_rtp_udp_addr
+from app.services.token_cache import get_token_user, get_user_credentials
+from app.services.watch_history_saver import close_active_connection
+
+
+class StreamSessionError(Exception):
+    """播放会话创建失败"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def get_udpxy_url(original_url):
+    """将组播地址转换为 UDPxy 地址"""
+    from app.config import get_udpxy_enabled, get_udpxy_url as get_udpxy_url_config
+
+    if not get_udpxy_enabled():
+        return None
+
+    udpxy_base = get_udpxy_url_config().rstrip('/')
+
+    # 解析 rtp:// 或 udp:// 地址
+    # 格式: rtp://239.0.0.1:5000 或 udp://@239.0.0.1:5000
+    if not original_url.startswith(('rtp://', 'udp://')):
+        return None
+    addr = extract_rtp_udp_addr(original_url)
+
+    # UDPxy URL 格式: http://udpxy:port/udp/239.0.0.1:5000
+    return f"{udpxy_base}/udp/{addr}"
+
+
+def resolve_stream_url(url):
+    """
+    解析实际拉流地址：组播源优先通过 UDPxy 转换，否则由进程内直接加入组播组转发
+    返回:
+        str: 拉流地址；组播源无可用转发方式时返回 None
+    """
+    if not is_multicast_url(url):
+        logger.debug(f"HTTP 源: {url}")
+        return url
+
+    udpxy_url = get_udpxy_url(url)
+    if udpxy_url:
+        logger.info(f"组播源转换: {url} -> {udpxy_url}")
+        return udpxy_url
+    if get_multicast_native_enabled():
+        logger.debug(f"组播源内置转发: {url}")
+        return url
+    return None
+
+
+def authenticate_stream_user(credentials, channel_id):
+    """
+    校验播放鉴权参数（订阅 Token 或签名地址）
+    参数:
+        credentials: {'token': ...} 或签名参数 {'u': ..., 'exp': ..., 'sig': ...}
+    返回:
+        TokenUser: (id, username)
+    异常:
+        StreamSessionError: 鉴权失败
+    """
+    token = credentials.get('token')
+    if token:
+        user = get_token_user(token)
+        if not user:
+            raise StreamSessionError('Token 无效', 401)
+        return user
+
+    user_id, expires_at = parse_signed_params(credentials.get('u'), credentials.get('exp'))
+    if user_id is None or not credentials.get('sig'):
+        raise StreamSessionError('缺少 Token', 401)
+    if not get_signed_stream_urls_enabled():
+        raise StreamSessionError('签名播放地址未启用', 401)
+
+    # 签名校验只依赖缓存中的用户当前 Token（吊销纪元），稳定后不再查询数据库
+    user_credentials = get_user_credentials(user_id)
+    if user_credentials is None:
+        raise StreamSessionError('播放地址无效', 401)
+    user, user_token = user_credentials
+    if not verify_signature(user_id, user_token, channel_id, expires_at, credentials['sig']):
+        raise StreamSessionError('播放地址签名无效或已过期', 401)
+    return user
+
+
+def open_stream_session(credentials, channel_id, connection_id=None):
+    """
+    校验播放鉴权参数与频道，并创建观看记录 + 活跃连接（同事务）
+    参数:
+        credentials: 订阅 Token 或签名参数，见 authenticate_stream_user
+        connection_id: 指定连接 ID（HLS 会话被回收后按原 ID 续建），默认随机生成
+    返回:
+        dict: 会话信息（connection_id、stream_url 等）
+    异常:
+        StreamSessionError: 鉴权失败、频道不可用或会话创建失败
+    """
+    user = authenticate_stream_user(credentials, channel_id)
+
+    # 频道信息取自进程内目录快照，不查询数据库
+    channel = get_catalog_channel(channel_id)
+    if not channel:
+        raise StreamSessionError('频道不存在', 404)
+
+    if not channel.is_active:
+        raise StreamSessionError('频道未启用', 403)
+
+    # 获取实际的流地址（主源 + 备用源）
+    primary_url = resolve_stream_url(channel.url)
+    stream_urls = [primary_url] if primary_url else []
+    for backup_url in channel.backup_urls:
+        resolved_url = resolve_stream_url(backup_url)
+        if resolved_url and resolved_url not in stream_urls:
+            stream_urls.append(resolved_url)
+
+    if not stream_urls:
+        raise StreamSessionError('UDPxy 未配置且未启用内置组播转发，无法播放组播源', 500)
+
+    if primary_url and not channel.is_healthy and len(stream_urls) > 1:
+        # 最近一次健康检测失败的主源排到备用源之后
+        stream_urls.append(stream_urls.pop(0))
+    stream_url = stream_urls[0]
+
+    # 本进程拉流学到的类型优先，其次为健康检测（worker 进程）写入频道的主源类型
+    content_type = get_cached_content_type(channel.id, stream_url)
+    if content_type is None and stream_url == channel.url:
+        content_type = channel.content_type
+
+    connection_id = connection_id or f"{user.id}_{channel_id}_{uuid.uuid4().hex}"
+    start_time_utc = to_utc_naive()
+
+    try:
+        watch_record = WatchHistory(user_id=user.id, channel_id=channel.id, start_time=start_time_utc)
+        db.session.add(watch_record)
+        db.session.flush()
+        watch_record_id = watch_record.id
+
+        active_connection = ActiveConnection(
+            connection_id=connection_id,
+            watch_history_id=watch_record_id,
+            user_id=user.id,
+            channel_id=channel.id,
+            start_time=start_time_utc,
+            last_heartbeat=start_time_utc
+        )
+        db.session.add(active_connection)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"创建活跃连接失败: user_id={user.id}, channel_id={channel.id}, error={e}")
+        raise StreamSessionError('创建观看会话失败', 500) from e
+
+    return {
+        'connection_id': connection_id,
+        'watch_record_id': watch_record_id,
+        'user_id': user.id,
+        'username': user.username,
+        'channel_id': channel.id,
+        'channel_name': channel.name,
+        'stream_url': stream_url,
+        'stream_urls': stream_urls,
+        # 已知的上游 Content-Type，未知时为 None（由本次拉流的响应头决定）
+        'content_type': content_type,
+        'start_time': start_time_utc,
+        # HLS 改写地址沿用本次请求的鉴权方式
+        'auth_params': hls_query_params(credentials)
+    }
+
+
+def resume_stream_session(credentials, channel_id, connection_id, recreate=False):
+    """
+    校验 HLS 后续请求（子播放列表 / 分片）所属的观看会话
+    参数:
+        credentials: 订阅 Token 或签名参数，见 authenticate_stream_user
+        recreate: 活跃连接已被心跳超时回收时是否按原 ID 重新创建（仅播放列表刷新时使用）
+    返回:
+        str: 连接 ID
+    异常:
+        StreamSessionError: 鉴权失败或会话不属于该用户与频道
+    """
+    user = authenticate_stream_user(credentials, channel_id)
+
+    if not connection_id or not connection_id.startswith(f"{user.id}_{channel_id}_"):
+        raise StreamSessionError('播放会话无效', 403)
+
+    if recreate and db.session.get(ActiveConnection, connection_id) is None:
+        open_stream_session(credentials, channel_id, connection_id=connection_id)
+        logger.debug(f"HLS 会话已续建: connection_id={connection_id}")
+
+    return connection_id
+
+
+def close_stream_session(session):
+    """幂等结束观看会话：落历史 + 删除活跃连接（异常仅记录日志）"""
+    connection_id = session['connection_id']
+    heartbeat_aggregator.discard(connection_id)
+    try:
+        result = close_active_connection(
+            connection_id=connection_id,
+            end_time=to_utc_naive(),
+            fallback_watch_history_id=session['watch_record_id']
+        )
+        if result.get('history_updated'):
+            logger.debug(
+                f"观看记录保存: 用户 {session['username']}, 频道 {session['channel_name']}, "
+                f"时长 {result.get('duration', 0)}秒"
+            )
+        elif result.get('history_deleted_short'):
+            logger.debug(
+                f"观看记录已忽略(<5秒): 用户 {session['username']}, 频道 {session['channel_name']}, "
+                f"时长 {result.get('duration', 0)}秒"
+            )
+        return result
+    except Exception as e:
+        logger.error(f"保存观看记录失败: connection_id={connection_id}, error={e}")
+        return None
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+上游地址辅助函数（线程池与事件循环两种健康检测引擎共用）
+"""
+
+
+def extract_rtp_udp_addr(url):
+    """从 URL 中解析 RTP/UDP 地址。"""
+    if not url:
+        return ''
+
+    if url.startswith('rtp://'):
+        return url[6:]
+
+    if url.startswith('udp://'):
+        addr = url[6:]
+        if addr.startswith('@'):
+            return addr[1:]
+        return addr
+
+    return url
+
+
+def probe_target_url(channel_info, udpxy_enabled, udpxy_url):
+    """探测请求实际访问的地址（用于按主机限流与熔断），直连组播返回 None"""
+    protocol = (channel_info.get('protocol') or '').lower()
+    if protocol in ('http', 'https'):
+        return channel_info.get('url')
+    if protocol in ('rtp', 'udp') and udpxy_enabled:
+        return udpxy_url
+    return None
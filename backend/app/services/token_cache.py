@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+订阅 Token -> 用户缓存（进程内，LRU + TTL）
+
+播放器重连时会反复请求流代理与订阅地址，每次都按 Token 查询 users 表。
+这里按 Token 缓存用户 ID 与用户名（签名播放地址另按用户 ID 缓存用户及其当前 Token）；
+重置 Token / 修改用户名时更新 settings 表中的缓存版本号，各进程定期比对版本号，
+发现变化即清空本进程缓存。版本号写入尚未提交期间，本进程查询到的仍可能是旧数据，不写入缓存。
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import get_token_cache_max_entries, get_token_cache_ttl_seconds
+
+# 各进程比对缓存版本号的最小间隔（秒），即其他进程中旧 Token 的最长残留时间
+VERSION_CHECK_INTERVAL_SECONDS = 1.0
+
+TokenUser = namedtuple('TokenUser', ['id', 'username'])
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_entries_by_user_id = OrderedDict()
+# 写入了新版本号、尚未结束的事务
+_pending_transactions = set()
+_state = {
+    'version': None,
+    'version_checked_at': 0.0,
+    # 缓存内容每次失效时递增，查询前后不一致的结果不写入
+    'generation': 0,
+    'hits': 0,
+    'misses': 0
+}
+
+
+def _load_version():
+    from app.models.settings import Settings
+    return Settings.get(Settings.KEY_TOKEN_CACHE_VERSION, '')
+
+
+def _sync_version_locked(now):
+    """按间隔比对数据库中的缓存版本号，变化时清空本进程缓存"""
+    if now - _state['version_checked_at'] < VERSION_CHECK_INTERVAL_SECONDS:
+        return
+    version = _load_version()
+    if version != _state['version']:
+        _entries.clear()
+        _entries_by_user_id.clear()
+        _state['version'] = version
+        _state['generation'] += 1
+    _state['version_checked_at'] = now
+
+
+def _query_user(token):
+    from app.models.users import Users
+    user = Users.query.filter_by(token=token).first()
+    return TokenUser(user.id, user.username) if user else None
+
+
+def _query_user_credentials(user_id):
+    from app import db
+    from app.models.users import Users
+    user = db.session.get(Users, user_id)
+    return (TokenUser(user.id, user.username), user.token) if user else None
+
+
+def _get_cached(entries, key, loader):
+    """读取缓存条目，未命中时调用 loader 查询；loader 返回 None 时不缓存"""
+    ttl_seconds = get_token_cache_ttl_seconds()
+    if ttl_seconds <= 0:
+        return loader(key)
+
+    now = time.monotonic()
+    with _lock:
+        _sync_version_locked(now)
+        generation = _state['generation']
+        entry = entries.get(key)
+        if entry is not None and entry[1] > now:
+            entries.move_to_end(key)
+            _state['hits'] += 1
+            return entry[0]
+        _state['misses'] += 1
+
+    value = loader(key)
+    if value is None:
+        # 无效 Token / 用户不缓存，避免随机请求挤占缓存
+        return None
+
+    with _lock:
+        # 查询期间缓存已失效或有未提交的版本号写入时不写入，防止缓存旧 Token
+        if _state['generation'] == generation and not _pending_transactions:
+            entries[key] = (value, now + ttl_seconds)
+            entries.move_to_end(key)
+            max_entries = get_token_cache_max_entries()
+            while len(entries) > max_entries:
+                entries.popitem(last=False)
+    return value
+
+
+def get_token_user(token):
+    """
+    按订阅 Token 获取用户（需在 app context 内调用）
+    返回:
+        TokenUser: (id, username)，Token 无效时返回 None
+    """
+    if not token:
+        return None
+    return _get_cached(_entries, token, _query_user)
+
+
+def get_user_credentials(user_id):
+    """
+    按用户 ID 获取用户及其当前订阅 Token（签名播放地址校验用，需在 app context 内调用）
+    返回:
+        tuple: (TokenUser, token)，用户不存在时返回 None
+    """
+    return _get_cached(_entries_by_user_id, user_id, _query_user_credentials)
+
+
+def invalidate_token_cache():
+    """
+    清空本进程缓存并更新缓存版本号，其他进程在下次比对时清空各自缓存
+    版本号随调用方的事务一起提交（需在 app context 内调用，由调用方 commit）；
+    事务结束前本进程不写入缓存，结束后（提交或回滚）立即重新比对版本号
+    """
+    from app import db
+    from app.models.settings import Settings
+
+    Settings.touch_version(Settings.KEY_TOKEN_CACHE_VERSION)
+    transaction = db.session().get_transaction()
+    with _lock:
+        _entries.clear()
+        _entries_by_user_id.clear()
+        _state['generation'] += 1
+        _pending_transactions.add(transaction)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _on_transaction_end(_session, transaction):
+    if not _pending_transactions:
+        return
+    with _lock:
+        if transaction not in _pending_transactions:
+            return
+        _pending_transactions.discard(transaction)
+        _state['generation'] += 1
+        _state['version_checked_at'] = 0.0
+
+
+def get_token_cache_stats():
+    with _lock:
+        total = _state['hits'] + _state['misses']
+        return {
+            'entries': len(_entries) + len(_entries_by_user_id),
+            'hits': _state['hits'],
+            'misses': _state['misses'],
+            'hit_ratio': round(_state['hits'] / total, 4) if total else 0.0
+        }
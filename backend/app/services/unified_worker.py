@@ -9,10 +9,18 @@ from loguru import logger
 from app.config import (
     config,
     get_active_heartbeat_timeout_seconds,
+    get_health_check_adaptive_enabled,
+    get_health_check_interval_seconds,
+    get_health_check_poll_seconds,
+    get_history_retention_enabled,
+    get_history_retention_interval_seconds,
     get_history_worker_interval_seconds,
     load_runtime_config_from_db
 )
 from app.services.health_checker import run_health_worker_cycle
+from app.services.history_cleanup import run_history_retention
+from app.services.host_breaker import ensure_sync_started
+from app.services.metrics import track_worker_cycle
 from app.services.watch_history_saver import run_history_worker_cycle
 
 
@@ -21,33 +29,34 @@ def _is_health_worker_enabled():
     return config.get('health_check', {}).get('enabled', True)
 
 
-def _get_health_check_interval_seconds():
-    """读取健康检测间隔（秒）。"""
-    return max(1, int(config.get('health_check', {}).get('interval', 1800)))
-
-
 def start_unified_worker(app):
     """启动统一 worker（阻塞运行）。"""
     history_interval = get_history_worker_interval_seconds()
     health_enabled = _is_health_worker_enabled()
-    health_interval = _get_health_check_interval_seconds()
+    health_adaptive = get_health_check_adaptive_enabled()
+    # 自适应调度下 worker 按轮询周期拉取到期频道，否则每个检测间隔全量检测一次
+    health_interval = get_health_check_poll_seconds() if health_adaptive else get_health_check_interval_seconds()
+    retention_enabled = get_history_retention_enabled()
+    retention_interval = get_history_retention_interval_seconds()
 
     scheduler = BlockingScheduler()
 
     def history_job():
         with app.app_context():
             try:
-                # 统一 worker 进程每轮都刷新运行时配置
-                load_runtime_config_from_db()
-                heartbeat_timeout = get_active_heartbeat_timeout_seconds()
-                result = run_history_worker_cycle(timeout_seconds=heartbeat_timeout)
+                with track_worker_cycle('history'):
+                    # 统一 worker 进程每轮都刷新运行时配置
+                    load_runtime_config_from_db()
+                    heartbeat_timeout = get_active_heartbeat_timeout_seconds()
+                    result = run_history_worker_cycle(timeout_seconds=heartbeat_timeout)
                 if any(result.values()):
                     logger.info(
                         "history-worker执行完成: "
                         f"时长更新={result['saved_updated']}, "
                         f"清理无效活跃={result['saved_cleaned']}, "
                         f"回收僵尸={result['recycled']}, "
-                        f"僵尸落历史={result['recycled_finalized']}"
+                        f"僵尸落历史={result['recycled_finalized']}, "
+                        f"日汇总={result['rolled_up']}"
                     )
             except Exception as e:
                 logger.error(f"history-worker执行失败: {e}")
@@ -55,18 +64,40 @@ def start_unified_worker(app):
     def health_job():
         with app.app_context():
             try:
-                # 统一 worker 进程每轮都刷新运行时配置
-                load_runtime_config_from_db()
-                results = run_health_worker_cycle()
-                logger.info(
-                    "health-worker执行完成: "
-                    f"总计={results['total']}, "
-                    f"正常={results['healthy']}, "
-                    f"异常={results['unhealthy']}"
-                )
+                with track_worker_cycle('health'):
+                    # 统一 worker 进程每轮都刷新运行时配置
+                    load_runtime_config_from_db()
+                    results = run_health_worker_cycle()
+                if results['total'] or not health_adaptive:
+                    logger.info(
+                        "health-worker执行完成: "
+                        f"总计={results['total']}, "
+                        f"正常={results['healthy']}, "
+                        f"异常={results['unhealthy']}, "
+                        f"状态变化={results['changed']}"
+                    )
             except Exception as e:
                 logger.error(f"health-worker执行失败: {e}")
 
+    def retention_job():
+        with app.app_context():
+            try:
+                with track_worker_cycle('retention'):
+                    # 保留天数可在系统设置中修改
+                    load_runtime_config_from_db()
+                    status = run_history_retention()
+                if status and status['deleted']:
+                    logger.info(
+                        "retention-worker执行完成: "
+                        f"删除={status['deleted']}, "
+                        f"保留起始日期={status['cutoff_date']}"
+                    )
+            except Exception as e:
+                logger.error(f"retention-worker执行失败: {e}")
+
+    # 健康检测与流代理进程共用上游主机熔断状态
+    ensure_sync_started(app)
+
     # 启动后先执行一次，减少首次等待时间
     history_job()
     if health_enabled:
@@ -85,6 +116,18 @@ def start_unified_worker(app):
         coalesce=True
     )
 
+    if retention_enabled:
+        scheduler.add_job(
+            retention_job,
+            'interval',
+            seconds=retention_interval,
+            id='history_retention',
+            name='观看历史保留策略清理',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+
     if health_enabled:
         scheduler.add_job(
             health_job,
@@ -101,7 +144,10 @@ def start_unified_worker(app):
         "unified-worker已启动: "
         f"history_interval={history_interval}s, "
         f"health_enabled={health_enabled}, "
-        f"health_interval={health_interval}s"
+        f"health_adaptive={health_adaptive}, "
+        f"health_interval={health_interval}s, "
+        f"retention_enabled={retention_enabled}, "
+        f"retention_interval={retention_interval}s"
     )
     scheduler.start()
     return scheduler
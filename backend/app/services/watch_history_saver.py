@@ -5,12 +5,21 @@
 
 from datetime import timedelta
 from loguru import logger
+from sqlalchemy import and_, case, delete, exists, func, select, update
 from app import db
 from app.models.active_connection import ActiveConnection
+from app.models.watch_daily_rollup import WatchDailyRollup
 from app.models.watch_history import WatchHistory
 from app.utils.datetime_utils import to_utc_naive
 
 MIN_HISTORY_DURATION_SECONDS = WatchHistory.MIN_VALID_DURATION_SECONDS
+# 批量心跳单条 UPDATE 最多携带的连接数（兼容 SQLite 变量数上限）
+HEARTBEAT_BATCH_SIZE = 400
+# history-worker 批量 UPDATE / DELETE 单条语句最多携带的记录数
+WORKER_BATCH_SIZE = 400
+# 日汇总每批处理的已结束记录数（每批一次提交）与每个 worker 周期最多处理的批数
+ROLLUP_BATCH_SIZE = 2000
+ROLLUP_MAX_BATCHES_PER_CYCLE = 10
 
 
 def _calculate_duration_seconds(start_time, end_time, connection_id=None):
@@ -54,6 +63,37 @@ def update_connection_heartbeat(connection_id, heartbeat_time=None):
         return False
 
 
+def update_connection_heartbeats(heartbeats):
+    """
+    批量更新活跃连接心跳时间（每批一条 UPDATE ... CASE，整体一次提交）
+    参数:
+        heartbeats: dict {connection_id: heartbeat_time}
+    返回:
+        int: 实际更新的行数
+    """
+    if not heartbeats:
+        return 0
+
+    items = list(heartbeats.items())
+    updated_rows = 0
+    try:
+        for offset in range(0, len(items), HEARTBEAT_BATCH_SIZE):
+            batch = dict(items[offset:offset + HEARTBEAT_BATCH_SIZE])
+            result = db.session.execute(
+                update(ActiveConnection).where(
+                    ActiveConnection.connection_id.in_(list(batch.keys()))
+                ).values(
+                    last_heartbeat=case(batch, value=ActiveConnection.connection_id)
+                ).execution_options(synchronize_session=False)
+            )
+            updated_rows += result.rowcount or 0
+        db.session.commit()
+        return updated_rows
+    except Exception:
+        db.session.rollback()
+        raise
+
+
 def close_active_connection(connection_id, end_time=None, fallback_watch_history_id=None):
     """结束活跃连接并幂等写入历史"""
     end_time = end_time or to_utc_naive()
@@ -95,42 +135,72 @@ def close_active_connection(connection_id, end_time=None, fallback_watch_history
         raise
 
 
+def _iter_batches(items, batch_size=WORKER_BATCH_SIZE):
+    for offset in range(0, len(items), batch_size):
+        yield items[offset:offset + batch_size]
+
+
+def _bulk_update_durations(durations):
+    """
+    批量单调更新未结束记录的观看时长（只在新时长更大时写入）
+    参数:
+        durations: dict {watch_history_id: duration_seconds}
+    返回:
+        int: 实际更新的行数
+    """
+    updated_rows = 0
+    for batch_ids in _iter_batches(list(durations.keys())):
+        new_duration = case({history_id: durations[history_id] for history_id in batch_ids}, value=WatchHistory.id)
+        result = db.session.execute(
+            update(WatchHistory).where(
+                WatchHistory.id.in_(batch_ids),
+                WatchHistory.end_time.is_(None),
+                func.coalesce(WatchHistory.duration, 0) < new_duration
+            ).values(
+                duration=new_duration
+            ).execution_options(synchronize_session=False)
+        )
+        updated_rows += result.rowcount or 0
+    return updated_rows
+
+
 def save_active_watch_records(now=None):
     """
     定时保存所有活跃观看记录（仅更新 duration，不写 end_time）
+    历史记录不存在或已结束的活跃连接直接删除；其余按单调规则批量更新时长
     返回:
         dict: {'updated': int, 'cleaned': int}
     """
     now = now or to_utc_naive()
-    active_rows = ActiveConnection.query.all()
-    if not active_rows:
-        return {'updated': 0, 'cleaned': 0}
-
-    updated_count = 0
-    cleaned_count = 0
 
     try:
-        for active_conn in active_rows:
-            record = db.session.get(WatchHistory, active_conn.watch_history_id)
-            if not record:
-                db.session.delete(active_conn)
-                cleaned_count += 1
-                continue
-
-            if record.end_time is not None:
-                db.session.delete(active_conn)
-                cleaned_count += 1
-                continue
-
-            calculated_duration = _calculate_duration_seconds(
-                record.start_time,
-                now,
-                connection_id=active_conn.connection_id
-            )
-            old_duration = record.duration or 0
-            record.update_duration_monotonic(calculated_duration)
-            if record.duration != old_duration:
-                updated_count += 1
+        cleaned_count = db.session.execute(
+            delete(ActiveConnection).where(
+                ~exists().where(and_(
+                    WatchHistory.id == ActiveConnection.watch_history_id,
+                    WatchHistory.end_time.is_(None)
+                ))
+            ).execution_options(synchronize_session=False)
+        ).rowcount or 0
+
+        active_rows = db.session.query(
+            ActiveConnection.connection_id,
+            WatchHistory.id,
+            WatchHistory.start_time,
+            WatchHistory.duration
+        ).join(
+            WatchHistory, WatchHistory.id == ActiveConnection.watch_history_id
+        ).filter(
+            WatchHistory.end_time.is_(None)
+        ).all()
+
+        durations = {}
+        for connection_id, history_id, start_time, current_duration in active_rows:
+            calculated_duration = _calculate_duration_seconds(start_time, now, connection_id=connection_id)
+            if calculated_duration > (current_duration or 0):
+                durations[history_id] = calculated_duration
+
+        updated_count = _bulk_update_durations(durations) if durations else 0
 
         if updated_count > 0 or cleaned_count > 0:
             db.session.commit()
@@ -144,6 +214,7 @@ def save_active_watch_records(now=None):
 def cleanup_stale_active_connections(timeout_seconds, now=None):
     """
     回收心跳超时的活跃连接，并将历史标记为结束
+    结束时间取最后一次心跳（已结束的记录沿用原 end_time），时长不足最短有效时长的历史直接删除
     返回:
         dict: {'recycled': int, 'finalized': int}
     """
@@ -151,47 +222,224 @@ def cleanup_stale_active_connections(timeout_seconds, now=None):
     timeout_seconds = max(1, int(timeout_seconds))
     cutoff_time = now - timedelta(seconds=timeout_seconds)
 
-    stale_rows = ActiveConnection.query.filter(
+    stale_rows = db.session.query(
+        ActiveConnection.connection_id,
+        ActiveConnection.last_heartbeat,
+        WatchHistory.id,
+        WatchHistory.start_time,
+        WatchHistory.end_time,
+        WatchHistory.duration
+    ).outerjoin(
+        WatchHistory, WatchHistory.id == ActiveConnection.watch_history_id
+    ).filter(
         ActiveConnection.last_heartbeat < cutoff_time
     ).all()
 
     if not stale_rows:
         return {'recycled': 0, 'finalized': 0}
 
-    recycled_count = 0
-    finalized_count = 0
+    connection_ids = []
+    finalized = {}
+    short_history_ids = []
+    for connection_id, last_heartbeat, history_id, start_time, end_time, current_duration in stale_rows:
+        connection_ids.append(connection_id)
+        if history_id is None:
+            continue
+
+        # 与 _finalize_watch_record 相同：已结束的记录沿用既有 end_time，时长单调不回退
+        final_end_time = end_time or last_heartbeat or now
+        calculated_duration = _calculate_duration_seconds(start_time, final_end_time, connection_id=connection_id)
+        final_duration = max(current_duration or 0, calculated_duration)
+        if final_duration < MIN_HISTORY_DURATION_SECONDS:
+            short_history_ids.append(history_id)
+        else:
+            finalized[history_id] = (final_duration, final_end_time)
 
     try:
-        for active_conn in stale_rows:
-            record = db.session.get(WatchHistory, active_conn.watch_history_id)
-            if record:
-                _finalize_watch_record(
-                    record,
-                    active_conn.last_heartbeat or now,
-                    connection_id=active_conn.connection_id
-                )
-                if (record.duration or 0) < MIN_HISTORY_DURATION_SECONDS:
-                    db.session.delete(record)
-                else:
-                    finalized_count += 1
+        for batch_ids in _iter_batches(list(finalized.keys())):
+            db.session.execute(
+                update(WatchHistory).where(
+                    WatchHistory.id.in_(batch_ids)
+                ).values(
+                    duration=case(
+                        {history_id: finalized[history_id][0] for history_id in batch_ids},
+                        value=WatchHistory.id
+                    ),
+                    end_time=case(
+                        {history_id: finalized[history_id][1] for history_id in batch_ids},
+                        value=WatchHistory.id
+                    )
+                ).execution_options(synchronize_session=False)
+            )
 
-            db.session.delete(active_conn)
-            recycled_count += 1
+        for batch_ids in _iter_batches(short_history_ids):
+            db.session.execute(
+                delete(WatchHistory).where(
+                    WatchHistory.id.in_(batch_ids)
+                ).execution_options(synchronize_session=False)
+            )
+
+        for batch_ids in _iter_batches(connection_ids):
+            db.session.execute(
+                delete(ActiveConnection).where(
+                    ActiveConnection.connection_id.in_(batch_ids)
+                ).execution_options(synchronize_session=False)
+            )
 
         db.session.commit()
-        return {'recycled': recycled_count, 'finalized': finalized_count}
+        return {'recycled': len(connection_ids), 'finalized': len(finalized)}
     except Exception:
         db.session.rollback()
         raise
 
 
+def _claim_rollup_rows(batch_size):
+    """
+    认领一批尚未汇总的已结束记录（置 rolled_up，不提交），返回本事务实际认领的记录
+    支持 UPDATE ... RETURNING 的数据库（SQLite 3.35+）在同一条语句内认领并读取；
+    MySQL 先以加锁读取（读到最新已提交版本）锁定候选记录再认领。
+    并发执行（worker 与手动清理、重试）时每条记录只会被一方认领。
+    """
+    columns = (
+        WatchHistory.id,
+        WatchHistory.watch_date,
+        WatchHistory.channel_id,
+        WatchHistory.user_id,
+        WatchHistory.duration
+    )
+    pending = and_(WatchHistory.rolled_up == db.false(), WatchHistory.end_time.isnot(None))
+
+    if db.engine.dialect.update_returning:
+        candidate_ids = db.session.execute(
+            select(WatchHistory.id).where(pending).order_by(WatchHistory.id).limit(batch_size)
+        ).scalars().all()
+        rows = []
+        for batch_ids in _iter_batches(candidate_ids):
+            rows.extend(db.session.execute(
+                update(WatchHistory).where(
+                    WatchHistory.id.in_(batch_ids),
+                    pending
+                ).values(
+                    rolled_up=True
+                ).returning(*columns).execution_options(synchronize_session=False)
+            ).all())
+        return rows
+
+    rows = db.session.execute(
+        select(*columns).where(pending).order_by(WatchHistory.id).limit(batch_size).with_for_update()
+    ).all()
+    for batch_ids in _iter_batches([row[0] for row in rows]):
+        db.session.execute(
+            update(WatchHistory).where(
+                WatchHistory.id.in_(batch_ids),
+                pending
+            ).values(
+                rolled_up=True
+            ).execution_options(synchronize_session=False)
+        )
+    return rows
+
+
+def _rollup_upsert_statement():
+    """日汇总累加语句：主键不存在时插入，存在时在数据库内累加（不读出再写回）"""
+    table = WatchDailyRollup.__table__
+    if db.engine.dialect.name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+        statement = mysql_insert(table)
+        return statement.on_duplicate_key_update(
+            total_duration=table.c.total_duration + statement.inserted.total_duration,
+            session_count=table.c.session_count + statement.inserted.session_count,
+            updated_at=statement.inserted.updated_at
+        )
+
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+    statement = sqlite_insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.watch_date, table.c.channel_id, table.c.user_id],
+        set_={
+            'total_duration': table.c.total_duration + statement.excluded.total_duration,
+            'session_count': table.c.session_count + statement.excluded.session_count,
+            'updated_at': statement.excluded.updated_at
+        }
+    )
+
+
+def _rollup_batch(batch_size):
+    """
+    认领一批尚未汇总的已结束记录并累加到日汇总表（一次提交）
+    只汇总本事务认领到的记录，并发或重试时不会重复累加
+    返回:
+        int: 本批认领的记录数
+    """
+    try:
+        rows = _claim_rollup_rows(batch_size)
+        if not rows:
+            db.session.commit()
+            return 0
+
+        totals = {}
+        for _, watch_date, channel_id, user_id, duration in rows:
+            # 与统计口径一致：时长不足最短有效时长的记录只标记，不计入汇总
+            if (duration or 0) < MIN_HISTORY_DURATION_SECONDS:
+                continue
+            key = (watch_date, channel_id, user_id)
+            total_duration, session_count = totals.get(key, (0, 0))
+            totals[key] = (total_duration + duration, session_count + 1)
+
+        now = to_utc_naive()
+        rollup_rows = [
+            {
+                'watch_date': watch_date,
+                'channel_id': channel_id,
+                'user_id': user_id,
+                'total_duration': total_duration,
+                'session_count': session_count,
+                'updated_at': now
+            }
+            for (watch_date, channel_id, user_id), (total_duration, session_count) in totals.items()
+        ]
+        if rollup_rows:
+            statement = _rollup_upsert_statement()
+            for batch in _iter_batches(rollup_rows):
+                db.session.execute(statement, batch)
+
+        db.session.commit()
+        return len(rows)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def rollup_finished_watch_records(max_batches=ROLLUP_MAX_BATCHES_PER_CYCLE, batch_size=ROLLUP_BATCH_SIZE):
+    """
+    增量维护日汇总表：分批汇总已结束且尚未汇总的观看记录
+    参数:
+        max_batches: 最多处理的批数，None 表示处理到没有待汇总记录为止
+    返回:
+        int: 本次汇总的记录数
+    """
+    rolled_up_count = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        processed = _rollup_batch(batch_size)
+        rolled_up_count += processed
+        batches += 1
+        if processed < batch_size:
+            break
+    return rolled_up_count
+
+
 def run_history_worker_cycle(timeout_seconds):
-    """执行一次 worker 周期：保存活跃时长 + 回收僵尸连接"""
+    """执行一次 worker 周期：保存活跃时长 + 回收僵尸连接 + 增量日汇总"""
     save_result = save_active_watch_records()
     cleanup_result = cleanup_stale_active_connections(timeout_seconds=timeout_seconds)
+    rolled_up_count = rollup_finished_watch_records()
     return {
         'saved_updated': save_result['updated'],
         'saved_cleaned': save_result['cleaned'],
         'recycled': cleanup_result['recycled'],
-        'recycled_finalized': cleanup_result['finalized']
+        'recycled_finalized': cleanup_result['finalized'],
+        'rolled_up': rolled_up_count
     }
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+上游 HTTP 连接池
+
+所有出站 HTTP 请求（流代理上游、健康检测、UDPxy 探测、URL 导入）统一走这里：
+按 scheme://host:port 复用 requests.Session 与 keep-alive 连接，
+每个主机可单独配置连接池大小，并统计连接复用命中情况。
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from app.config import get_upstream_pool_host_sizes, get_upstream_pool_maxsize
+
+_lock = threading.Lock()
+_sessions = {}
+_stats = {}
+_pid = None
+
+
+def _host_stats(host_key):
+    stats = _stats.get(host_key)
+    if stats is None:
+        stats = _stats.setdefault(host_key, {'requests': 0, 'new_connections': 0})
+    return stats
+
+
+class _CountingPoolMixin:
+    """统计连接获取次数与新建连接次数（命中 = 获取 - 新建）"""
+
+    def _get_conn(self, timeout=None):
+        with _lock:
+            _host_stats(self._pool_stats_key)['requests'] += 1
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        with _lock:
+            _host_stats(self._pool_stats_key)['new_connections'] += 1
+        return super()._new_conn()
+
+    @property
+    def _pool_stats_key(self):
+        return f"{self.scheme}://{self.host}:{self.port}"
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _PooledAdapter(HTTPAdapter):
+    """使用可统计连接池的适配器"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool
+        }
+
+
+def _session_key(url):
+    parts = urlsplit(url)
+    scheme = (parts.scheme or 'http').lower()
+    host = (parts.hostname or '').lower()
+    port = parts.port or (443 if scheme == 'https' else 80)
+    return scheme, host, port
+
+
+def _create_session(host, port):
+    host_sizes = get_upstream_pool_host_sizes()
+    pool_size = host_sizes.get(f"{host}:{port}") or host_sizes.get(host) or get_upstream_pool_maxsize()
+    adapter = _PooledAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(url):
+    """获取目标 URL 所属主机的共享会话"""
+    global _pid
+
+    key = _session_key(url)
+    pid = os.getpid()
+    with _lock:
+        if _pid != pid:
+            # fork 后不复用父进程的连接
+            _sessions.clear()
+            _stats.clear()
+            _pid = pid
+
+        session = _sessions.get(key)
+        if session is None:
+            session = _create_session(key[1], key[2])
+            _sessions[key] = session
+        return session
+
+
+def request(method, url, **kwargs):
+    """通过共享连接池发起请求（参数同 requests.request）"""
+    return get_session(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('allow_redirects', True)
+    return request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+    kwargs.setdefault('allow_redirects', False)
+    return request('HEAD', url, **kwargs)
+
+
+def get_pool_stats():
+    """
+    获取连接池统计
+    返回:
+        dict: {hosts: [...], requests, hits, misses}
+    """
+    with _lock:
+        items = [(host_key, dict(stats)) for host_key, stats in _stats.items()]
+
+    hosts = []
+    total_requests = 0
+    total_misses = 0
+    for host_key, stats in sorted(items):
+        misses = stats['new_connections']
+        hits = max(0, stats['requests'] - misses)
+        total_requests += stats['requests']
+        total_misses += misses
+        hosts.append({
+            'host': host_key,
+            'requests': stats['requests'],
+            'hits': hits,
+            'misses': misses
+        })
+
+    return {
+        'hosts': hosts,
+        'requests': total_requests,
+        'hits': max(0, total_requests - total_misses),
+        'misses': total_misses
+    }
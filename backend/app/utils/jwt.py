@@ -3,6 +3,7 @@
 JWT 工具模块
 """
 
+import hashlib
 from datetime import timedelta
 
 import jwt
@@ -21,9 +22,22 @@ class JwtError(Exception):
         self.error_type = error_type
 
 
+DEFAULT_SECRET_KEY = 'default-jwt-secret-key'
+
+
+def get_jwt_secret_key():
+    """获取 JWT 密钥（未配置时使用默认值）"""
+    return config.get('jwt', {}).get('secret_key') or DEFAULT_SECRET_KEY
+
+
+def derive_signing_key(purpose):
+    """由 JWT 密钥派生指定用途（如 stream / hls）的 HMAC 密钥，不同用途的签名互不通用"""
+    return hashlib.sha256(f"{purpose}:{get_jwt_secret_key()}".encode('utf-8')).digest()
+
+
 def _jwt_config():
     jwt_config = config.get('jwt', {})
-    secret = jwt_config.get('secret_key') or 'default-jwt-secret-key'
+    secret = get_jwt_secret_key()
     algorithm = jwt_config.get('algorithm', 'HS256')
     access_hours = max(1, int(jwt_config.get('access_expires_hours', 24)))
     refresh_days = max(1, int(jwt_config.get('refresh_expires_days', 7)))
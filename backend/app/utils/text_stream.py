@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+大文本响应（订阅、频道导出）的流式输出与 gzip 压缩
+
+文本片段按块编码后逐块发送，不在内存中拼接完整内容；
+客户端 Accept-Encoding 声明支持 gzip 时边生成边压缩。
+"""
+
+import zlib
+
+from flask import Response
+
+# 合并发送的块大小（字节）
+STREAM_CHUNK_SIZE = 64 * 1024
+# gzip 压缩级别：M3U / TXT 文本在 6 级已有约 10 倍压缩比，更高级别收益很小
+GZIP_LEVEL = 6
+
+
+def accepts_gzip(request_obj):
+    """客户端是否接受 gzip 编码"""
+    return request_obj.accept_encodings['gzip'] > 0
+
+
+def iter_lines(lines):
+    """把逐行文本转换为以换行分隔的片段（末行不追加换行，与 '\\n'.join 一致）"""
+    separator = ''
+    for line in lines:
+        yield separator + line
+        separator = '\n'
+
+
+def iter_text_chunks(pieces, chunk_size=STREAM_CHUNK_SIZE):
+    """把文本片段编码为 UTF-8 并合并为约 chunk_size 字节的块"""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_gzip(chunks, level=GZIP_LEVEL):
+    """流式 gzip 压缩"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def text_response(body, mimetype, filename, gzipped=False):
+    """
+    生成文本下载响应
+    参数:
+        body: bytes，或逐块产出 bytes 的可迭代对象（流式输出）
+        gzipped: body 是否已是 gzip 编码
+    """
+    response = Response(
+        body,
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"'
+        }
+    )
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def streamed_text_response(pieces, mimetype, filename, compress=False):
+    """把文本片段流式输出为下载响应，compress 为 True 时使用 gzip 编码"""
+    chunks = iter_text_chunks(pieces)
+    if compress:
+        chunks = iter_gzip(chunks)
+    return text_response(chunks, mimetype, filename, gzipped=compress)
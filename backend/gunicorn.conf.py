@@ -48,3 +48,17 @@ daemon = False
 
 # 预加载应用
 preload_app = True
+
+
+def on_starting(server):
+    """启动时清理已退出进程遗留的多进程指标文件"""
+    from app.services.metrics import cleanup_multiprocess_dir
+    removed = cleanup_multiprocess_dir()
+    if removed:
+        server.log.info(f"已清理过期指标文件: {removed} 个")
+
+
+def child_exit(server, worker):
+    """worker 退出后移除其实时仪表，避免 /metrics 继续汇总已退出进程的活跃连接数"""
+    from app.services.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
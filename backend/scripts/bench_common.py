@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+压测脚本公共部分：本地 TS 上游、临时数据库中的测试频道、启动待测流代理进程
+
+各压测脚本在 backend/ 下运行，使用临时 SQLite 库，不影响正式数据。
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TS_PACKET_SIZE = 188
+PID_PMT = 0x100
+PID_VIDEO = 0x101
+
+
+def ts_packet(pid, payload=b'', pusi=False, rai=False, cc=0):
+    """构造一个 188 字节 TS 包，rai=True 时带随机访问标志（关键帧）"""
+    first = 0x40 if pusi else 0
+    if rai:
+        header = bytes([0x47, first | (pid >> 8), pid & 0xFF, 0x30 | cc, 1, 0x40])
+    else:
+        header = bytes([0x47, first | (pid >> 8), pid & 0xFF, 0x10 | cc])
+    packet = header + payload
+    return packet + b'\xff' * (TS_PACKET_SIZE - len(packet))
+
+
+PAT = ts_packet(0, bytes([0x00, 0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01, 0xE1, 0x00, 0, 0, 0, 0]), pusi=True)
+PMT = ts_packet(PID_PMT, bytes([
+    0x00, 0x02, 0xB0, 0x12, 0x00, 0x01, 0xC1, 0x00, 0x00, 0xE1, 0x01, 0xF0, 0x00,
+    0x1B, 0xE1, 0x01, 0xF0, 0x00, 0, 0, 0, 0
+]), pusi=True)
+PES_IDR = bytes([0, 0, 1, 0xE0, 0, 0, 0x80, 0, 0, 0, 0, 0, 1, 0x65])
+
+
+def run_origin(port, bitrate, gop_seconds):
+    """按码率匀速输出 TS 直播流，每个 GOP 开头输出 PAT、PMT 与关键帧（阻塞运行）"""
+    packets_per_second = bitrate / 8 / TS_PACKET_SIZE
+    packets_per_tick = max(1, int(packets_per_second / 100))
+    gop_packets = max(1, int(gop_seconds * packets_per_second))
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp2t')
+            self.end_headers()
+            sent = cc = 0
+            started_at = time.monotonic()
+            try:
+                while True:
+                    packets = []
+                    for _ in range(packets_per_tick):
+                        if sent % gop_packets == 0:
+                            packets += [PAT, PMT, ts_packet(PID_VIDEO, PES_IDR, pusi=True, rai=True, cc=cc)]
+                        else:
+                            packets.append(ts_packet(PID_VIDEO, b'\xaa' * 10, cc=cc))
+                        cc = (cc + 1) & 15
+                        sent += 1
+                    self.wfile.write(b''.join(packets))
+                    self.wfile.flush()
+                    time.sleep(max(0.0, started_at + sent / packets_per_second - time.monotonic()))
+            except OSError:
+                pass
+            self.close_connection = True
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def prepare_environment():
+    """使用临时 SQLite 库，需在导入 app 之前调用"""
+    data_dir = tempfile.mkdtemp(prefix='iptv-bench-')
+    os.environ['DATABASE_TYPE'] = 'sqlite'
+    os.environ['DATABASE_PATH'] = os.path.join(data_dir, 'bench.db')
+    os.environ.setdefault('GUNICORN_LOG_LEVEL', 'warning')
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return data_dir
+
+
+def create_bench_channel(url):
+    """创建测试频道，返回 (频道 ID, 管理员订阅 Token)"""
+    from app import create_app, db
+    from app.models.channel import Channel
+    from app.models.users import Users
+
+    app = create_app()
+    with app.app_context():
+        channel = Channel(name='bench', url=url)
+        channel.detect_protocol()
+        db.session.add(channel)
+        db.session.commit()
+        return channel.id, Users.query.filter_by(username='admin').first().token
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"端口 {port} 未就绪")
+
+
+def start_origin(bitrate, gop_seconds=2.0):
+    """在子进程中启动 TS 上游，返回 (进程, 直播地址)"""
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), 'origin', str(port), str(bitrate), str(gop_seconds)
+    ])
+    wait_port(port)
+    return process, f"http://127.0.0.1:{port}/live.ts"
+
+
+def start_proxy(mode, log_path=os.devnull):
+    """
+    启动待测流代理
+    参数:
+        mode: gthread（Gunicorn 线程模式，gunicorn.conf.py）或 async（stream_server.py）
+    返回:
+        tuple: (进程, 端口)
+    """
+    port = free_port()
+    env = dict(os.environ)
+    if mode == 'gthread':
+        env['SERVER_PORT'] = str(port)
+        command = ['gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', os.devnull, 'run:app']
+    elif mode == 'async':
+        env['STREAM_SERVER_PORT'] = str(port)
+        command = [sys.executable, 'stream_server.py']
+    else:
+        raise ValueError(f"未知模式: {mode}")
+    log = open(log_path, 'ab')
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=log, start_new_session=True)
+    wait_port(port)
+    return process, port
+
+
+def stop_processes(*processes):
+    for process in processes:
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                process.kill()
+
+
+def process_tree_pids(pid):
+    """进程及其子进程（Gunicorn worker）的 PID 列表（读取 /proc）"""
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if parent == pid:
+            pids.append(int(entry))
+    return pids
+
+
+def cpu_seconds(pids):
+    """进程累计 CPU 时间（秒，含已回收子进程）"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        total += sum(int(value) for value in fields[11:15])
+    return total / ticks
+
+
+def stream_request(channel_id, token):
+    return f"GET /api/proxy/stream/{channel_id}?token={token} HTTP/1.1\r\nHost: bench\r\n\r\n".encode()
+
+
+if __name__ == '__main__' and len(sys.argv) >= 3 and sys.argv[1] == 'origin':
+    run_origin(int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+压测：全量健康检测耗时（线程池引擎 vs 异步引擎）
+
+本地模拟上游在多个端口上响应 HEAD（固定延迟，每 10 个频道有 1 个返回 404），
+另加一个不可达频道；分别以 HEALTH_CHECK_ENGINE=thread 与 async 执行 check_all_channels，
+比较耗时并核对两种引擎的逐频道结果一致。
+
+用法（在 backend/ 下运行）:
+    python scripts/bench_health_probe.py --channels 1000 --hosts 50
+"""
+
+import argparse
+import asyncio
+import sys
+import threading
+import time
+
+from aiohttp import web
+from loguru import logger
+
+import bench_common
+
+
+def _start_origin(hosts, latency_seconds):
+    """在后台事件循环中启动模拟上游，返回端口列表"""
+    async def head(request):
+        await asyncio.sleep(latency_seconds)
+        if int(request.match_info['n']) % 10 == 0:
+            return web.Response(status=404)
+        return web.Response(body=b'', content_type='video/mp2t')
+
+    ports = [bench_common.free_port() for _ in range(hosts)]
+    ready = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        origin = web.Application()
+        origin.router.add_route('HEAD', '/s/{n}', head)
+        runner = web.AppRunner(origin, access_log=None)
+        loop.run_until_complete(runner.setup())
+        for port in ports:
+            loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port, backlog=4096).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait(10)
+    return ports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='全量健康检测压测')
+    parser.add_argument('--channels', type=int, default=1000)
+    parser.add_argument('--hosts', type=int, default=50, help='模拟上游的主机（端口）数')
+    parser.add_argument('--latency', type=float, default=0.2, help='上游 HEAD 响应延迟（秒）')
+    args = parser.parse_args()
+
+    bench_common.prepare_environment()
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    from app import create_app, db
+    from app.config import config
+    from app.models.channel import Channel
+    from app.services.health_checker import check_all_channels
+
+    ports = _start_origin(args.hosts, args.latency)
+    app = create_app()
+    with app.app_context():
+        for index in range(args.channels):
+            port = ports[index % len(ports)]
+            channel = Channel(name=f'bench-{index}', url=f'http://127.0.0.1:{port}/s/{index}')
+            channel.detect_protocol()
+            db.session.add(channel)
+        dead = Channel(name='bench-dead', url='http://127.0.0.1:1/live.ts')
+        dead.detect_protocol()
+        db.session.add(dead)
+        db.session.commit()
+
+    config['health_check']['timeout'] = 2
+    config['health_check']['max_retries'] = 0
+    results = {}
+    for engine in ('thread', 'async'):
+        config['health_check']['engine'] = engine
+        with app.app_context():
+            started_at = time.perf_counter()
+            summary = check_all_channels()
+            elapsed = time.perf_counter() - started_at
+            results[engine] = {channel.id: channel.is_healthy for channel in Channel.query.all()}
+        print(
+            f"engine={engine}: {elapsed:.2f}s, total={summary['total']} "
+            f"healthy={summary['healthy']} unhealthy={summary['unhealthy']}"
+        )
+    print(f"per-channel results identical: {results['thread'] == results['async']}")
+
+
+if __name__ == '__main__':
+    main()
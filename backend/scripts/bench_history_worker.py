@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+压测：history-worker 一个周期的耗时与 SQL 语句数
+
+在临时库中生成 N 条观看记录及对应的活跃连接（约一半心跳超时、少量缺失或已结束的历史记录），
+依次执行时长刷新、僵尸连接回收与增量日汇总，统计各阶段耗时和执行的 SQL 语句数。
+
+用法（在 backend/ 下运行）:
+    python scripts/bench_history_worker.py --sessions 10000
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import timedelta
+
+from loguru import logger
+
+import bench_common
+
+HEARTBEAT_TIMEOUT_SECONDS = 90
+
+
+def _seed(db, sessions, now):
+    from app.models.active_connection import ActiveConnection
+    from app.models.watch_history import WatchHistory
+
+    rng = random.Random(7)
+    records = []
+    for index in range(sessions):
+        start_time = now - timedelta(seconds=rng.randint(-5, 4000), microseconds=rng.randint(0, 999999))
+        record = WatchHistory(user_id=1 + index % 50, channel_id=1 + index % 300, start_time=start_time)
+        record.duration = rng.choice([0, 3, 10, 100000, rng.randint(0, 4000)])
+        if rng.random() < 0.1:
+            record.end_time = start_time + timedelta(seconds=rng.randint(0, 50))
+        records.append(record)
+    db.session.add_all(records)
+    db.session.flush()
+
+    connections = []
+    for index, record in enumerate(records):
+        if rng.random() < 0.05:
+            continue
+        # 少量活跃连接指向不存在的历史记录
+        history_id = record.id if rng.random() > 0.03 else 10 ** 9 + index
+        if index % 2:
+            last_heartbeat = now - timedelta(seconds=rng.randint(0, 200))
+        else:
+            last_heartbeat = record.start_time + timedelta(seconds=rng.randint(-3, 10))
+        connections.append(ActiveConnection(
+            connection_id=f'bench-{index}',
+            watch_history_id=history_id,
+            user_id=record.user_id,
+            channel_id=record.channel_id,
+            start_time=record.start_time,
+            last_heartbeat=last_heartbeat
+        ))
+    db.session.add_all(connections)
+    db.session.commit()
+    return len(records), len(connections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='history-worker 周期压测')
+    parser.add_argument('--sessions', type=int, default=10000, help='生成的观看记录数')
+    args = parser.parse_args()
+
+    bench_common.prepare_environment()
+    # 生成的数据中包含负时长等异常记录，不输出逐条告警
+    logger.remove()
+    logger.add(sys.stderr, level='ERROR')
+    from sqlalchemy import event
+
+    from app import create_app, db
+    from app.services.watch_history_saver import (
+        cleanup_stale_active_connections,
+        rollup_finished_watch_records,
+        save_active_watch_records
+    )
+    from app.utils.datetime_utils import to_utc_naive
+
+    app = create_app()
+    with app.app_context():
+        now = to_utc_naive().replace(microsecond=0)
+        records, connections = _seed(db, args.sessions, now)
+        print(f"seeded {records} watch_history rows, {connections} active_connections")
+
+        statements = [0]
+        event.listen(db.engine, 'before_cursor_execute', lambda *_: statements.__setitem__(0, statements[0] + 1))
+        run_at = now + timedelta(seconds=30)
+        phases = [
+            ('save', lambda: save_active_watch_records(now=run_at)),
+            ('cleanup', lambda: cleanup_stale_active_connections(HEARTBEAT_TIMEOUT_SECONDS, now=run_at)),
+            ('rollup', lambda: rollup_finished_watch_records(max_batches=None))
+        ]
+        for name, run in phases:
+            db.session.remove()
+            statements[0] = 0
+            started_at = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - started_at
+            print(f"{name}: {elapsed * 1000:.0f}ms, {statements[0]} statements, result={result}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+压测：换台起播耗时
+
+频道已有一位观众在看时，新观众反复加入，统计首字节耗时与可解码起播耗时
+（收到 PAT、PMT 后第一个带随机访问标志的视频包）。上游每 2 秒一个 GOP，
+对比开启 / 关闭关键帧起播缓冲（PROXY_START_BUFFER_ENABLED）。
+
+用法（在 backend/ 下运行）:
+    PROXY_START_BUFFER_ENABLED=true python scripts/bench_startup_latency.py --mode async
+    PROXY_START_BUFFER_ENABLED=false python scripts/bench_startup_latency.py --mode gthread
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+import bench_common
+
+
+def _http_body(data):
+    """去掉响应头并按需解开 chunked 编码"""
+    head, _, body = data.partition(b'\r\n\r\n')
+    if b'chunked' not in head.lower():
+        return body
+    result = b''
+    while body:
+        line, separator, rest = body.partition(b'\r\n')
+        if not separator:
+            break
+        size = int(line.split(b';')[0] or b'0', 16)
+        result += rest[:size]
+        if size == 0 or len(rest) < size + 2:
+            break
+        body = rest[size + 2:]
+    return result
+
+
+def _decodable(body):
+    """按 188 字节包遍历，依次见到 PAT、PMT 与视频关键帧即可解码起播"""
+    index = body.find(b'\x47')
+    seen_pat = seen_pmt = False
+    while 0 <= index and index + bench_common.TS_PACKET_SIZE <= len(body):
+        packet = body[index:index + bench_common.TS_PACKET_SIZE]
+        if packet[0] != 0x47:
+            index = body.find(b'\x47', index + 1)
+            continue
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if pid == 0:
+            seen_pat = True
+        elif pid == bench_common.PID_PMT and seen_pat:
+            seen_pmt = True
+        elif pid == bench_common.PID_VIDEO and seen_pmt and (packet[3] & 0x20) and packet[4] > 0 and (packet[5] & 0x40):
+            return True
+        index += bench_common.TS_PACKET_SIZE
+    return False
+
+
+async def _open_stream(port, request):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    await writer.drain()
+    return reader, writer
+
+
+async def _keep_watching(port, request):
+    reader, _ = await _open_stream(port, request)
+    while await reader.read(65536):
+        pass
+
+
+async def _zap(port, request):
+    started_at = time.perf_counter()
+    reader, writer = await _open_stream(port, request)
+    data = b''
+    first_byte = None
+    try:
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                return None
+            if first_byte is None:
+                first_byte = time.perf_counter() - started_at
+            data += chunk
+            if _decodable(_http_body(data)):
+                return first_byte, time.perf_counter() - started_at, len(data)
+    finally:
+        writer.close()
+
+
+async def _measure(port, request, rounds):
+    keeper = asyncio.create_task(_keep_watching(port, request))
+    await asyncio.sleep(3)
+    results = []
+    for _ in range(rounds):
+        # 随机时间点加入，覆盖 GOP 内的不同位置
+        await asyncio.sleep(random.uniform(0.3, 2.3))
+        result = await asyncio.wait_for(_zap(port, request), 10)
+        if result:
+            results.append(result)
+    keeper.cancel()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='换台起播耗时压测')
+    parser.add_argument('--mode', choices=['gthread', 'async'], default='async')
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--bitrate', type=int, default=2000000, help='上游码率（bit/s）')
+    parser.add_argument('--gop-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    bench_common.prepare_environment()
+    origin, url = bench_common.start_origin(args.bitrate, args.gop_seconds)
+    proxy = None
+    try:
+        channel_id, token = bench_common.create_bench_channel(url)
+        proxy, port = bench_common.start_proxy(args.mode)
+        time.sleep(2)
+        request = bench_common.stream_request(channel_id, token)
+        results = asyncio.run(_measure(port, request, args.rounds))
+    finally:
+        bench_common.stop_processes(*(process for process in (proxy, origin) if process is not None))
+
+    if not results:
+        print('no successful zaps')
+        return
+    starts = sorted(result[1] for result in results)
+    first_bytes = sorted(result[0] for result in results)
+    print(
+        f"mode={args.mode} start_buffer={os.getenv('PROXY_START_BUFFER_ENABLED', 'default')} n={len(results)}: "
+        f"first byte p50 {statistics.median(first_bytes) * 1000:.0f}ms; "
+        f"decodable start p50 {statistics.median(starts) * 1000:.0f}ms "
+        f"p90 {starts[int(len(starts) * 0.9)] * 1000:.0f}ms max {starts[-1] * 1000:.0f}ms; "
+        f"bytes until decodable p50 {int(statistics.median(result[2] for result in results))}"
+    )
+
+
+if __name__ == '__main__':
+    main()
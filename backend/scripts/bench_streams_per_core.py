@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+压测：单核可同时转发的观看连接数
+
+同一频道 N 个观众并发观看，统计实际持续收到数据的观众数、总吞吐与服务进程 CPU 占用。
+对比 Gunicorn 线程模式（每连接占一个线程）与异步流代理（stream_server.py）。
+
+用法（在 backend/ 下运行）:
+    python scripts/bench_streams_per_core.py --mode async --viewers 1000
+    python scripts/bench_streams_per_core.py --mode gthread --viewers 50
+"""
+
+import argparse
+import asyncio
+import time
+
+import bench_common
+
+
+async def _viewer(port, request, received, index):
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request)
+        await writer.drain()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            received[index] += len(data)
+    except (OSError, asyncio.CancelledError):
+        pass
+
+
+async def _measure(port, request, viewers, seconds, pids, ramp_seconds):
+    received = [0] * viewers
+    tasks = [asyncio.create_task(_viewer(port, request, received, index)) for index in range(viewers)]
+    await asyncio.sleep(ramp_seconds)
+
+    baseline = list(received)
+    cpu_before = bench_common.cpu_seconds(pids)
+    started_at = time.monotonic()
+    await asyncio.sleep(seconds)
+    cpu_after = bench_common.cpu_seconds(pids)
+    elapsed = time.monotonic() - started_at
+
+    delta = [after - before for after, before in zip(received, baseline)]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        'streaming': sum(1 for value in delta if value > 0),
+        'mb_per_second': sum(delta) / elapsed / 1e6,
+        'cpu_percent': 100 * (cpu_after - cpu_before) / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='单核并发观看连接数压测')
+    parser.add_argument('--mode', choices=['gthread', 'async'], default='async')
+    parser.add_argument('--viewers', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=15, help='统计时长（秒）')
+    parser.add_argument('--ramp-seconds', type=float, default=5, help='开始统计前的建连时间（秒）')
+    parser.add_argument('--bitrate', type=int, default=256000, help='上游码率（bit/s）')
+    args = parser.parse_args()
+
+    bench_common.prepare_environment()
+    origin, url = bench_common.start_origin(args.bitrate)
+    proxy = None
+    try:
+        channel_id, token = bench_common.create_bench_channel(url)
+        proxy, port = bench_common.start_proxy(args.mode)
+        # Gunicorn worker 在主进程就绪后才全部拉起
+        time.sleep(2)
+        pids = bench_common.process_tree_pids(proxy.pid)
+        request = bench_common.stream_request(channel_id, token)
+        result = asyncio.run(_measure(port, request, args.viewers, args.seconds, pids, args.ramp_seconds))
+    finally:
+        bench_common.stop_processes(*(process for process in (proxy, origin) if process is not None))
+
+    print(
+        f"mode={args.mode} viewers={args.viewers}: "
+        f"streaming {result['streaming']}/{args.viewers}, "
+        f"aggregate {result['mb_per_second']:.2f} MB/s, "
+        f"server CPU {result['cpu_percent']:.0f}% of one core"
+    )
+
+
+if __name__ == '__main__':
+    main()
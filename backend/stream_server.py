@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+异步流代理启动入口（asyncio 承载 /api/proxy/stream/<id>，管理 API 仍由 Gunicorn 提供）
+"""
+
+from app import create_app
+from app.services.async_stream_server import run_stream_server
+
+
+def main():
+    app = create_app()
+    run_stream_server(app)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共配置：使用临时 SQLite 库，提供本地上游服务与 Flask 应用夹具
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# 配置在导入 app.config 时读取，需在导入应用前设置
+_DATA_DIR = tempfile.mkdtemp(prefix='iptv-test-')
+os.environ['DATABASE_TYPE'] = 'sqlite'
+os.environ['DATABASE_PATH'] = os.path.join(_DATA_DIR, 'test.db')
+os.environ.setdefault('PROXY_RELAY_LINGER_SECONDS', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+class OriginServer:
+    """本地 HTTP 上游，按路径分发到测试提供的处理函数并统计请求次数"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.hits = {}
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                origin.hits[self.path] = origin.hits.get(self.path, 0) + 1
+                handler = origin.routes.get(self.path)
+                if handler is None:
+                    self.send_error(404)
+                    return
+                try:
+                    handler(self)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                self.close_connection = True
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self._server.server_address[1]}{path}"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def origin():
+    servers = []
+
+    def start(routes):
+        server = OriginServer(routes)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    return create_app()
+
+
+@pytest.fixture(scope='session')
+def auth_headers(app):
+    """完成默认管理员首次改密后的登录请求头"""
+    client = app.test_client()
+    login = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin123'}).get_json()
+    client.post(
+        '/api/auth/change-password',
+        json={'old_password': 'admin123', 'new_password': 'admin1234'},
+        headers={'Authorization': f"Bearer {login['access_token']}"}
+    )
+    login = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin1234'}).get_json()
+    return {'Authorization': f"Bearer {login['access_token']}"}
+
+
+@pytest.fixture
+def stream_credentials(app):
+    """管理员的订阅 Token 播放凭据"""
+    from app.models.users import Users
+    from app.services.stream_auth import credentials_from_stream_query
+
+    with app.app_context():
+        token = Users.query.filter_by(username='admin').first().token
+    return credentials_from_stream_query({'token': token})
+
+
+@pytest.fixture
+def make_channel(app):
+    """创建频道并返回 ID"""
+    from app import db
+    from app.models.channel import Channel
+    from app.services.channel_catalog import bump_catalog_version
+
+    def create(url, name='test', backup_urls=None):
+        with app.app_context():
+            channel = Channel(name=name, url=url)
+            channel.detect_protocol()
+            if backup_urls:
+                channel.set_backup_urls(backup_urls)
+            db.session.add(channel)
+            bump_catalog_version()
+            db.session.commit()
+            return channel.id
+
+    return create
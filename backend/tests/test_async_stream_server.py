@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+异步流代理：无 .m3u8 后缀的 HLS 源改走播放列表改写，源切换规则与线程版一致
+"""
+
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.services.async_stream_server import create_stream_server
+
+HLS_TYPE = 'application/vnd.apple.mpegurl'
+BODY_SIZE = 376000
+
+
+def _playlist(handler):
+    body = b'#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXTINF:2.0,\nseg-1.ts\n'
+    handler.send_response(200)
+    handler.send_header('Content-Type', HLS_TYPE)
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def _finite_body(handler):
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'video/mp2t')
+    handler.send_header('Content-Length', str(BODY_SIZE))
+    handler.end_headers()
+    handler.wfile.write(b'\x47' * BODY_SIZE)
+
+
+def _get(app, path):
+    async def fetch():
+        client = TestClient(TestServer(create_stream_server(app)))
+        await client.start_server()
+        try:
+            response = await client.get(path)
+            body = await asyncio.wait_for(response.read(), 15)
+            return response.status, response.headers.get('Content-Type', ''), body
+        finally:
+            await client.close()
+
+    return asyncio.run(fetch())
+
+
+def test_hls_content_type_without_suffix_is_rewritten(app, origin, make_channel, stream_credentials):
+    server = origin({'/live': _playlist})
+    channel_id = make_channel(server.url('/live'), name='async-hls')
+
+    status, content_type, body = _get(app, f"/api/proxy/stream/{channel_id}?token={stream_credentials['token']}")
+
+    assert status == 200
+    assert content_type.startswith(HLS_TYPE)
+    # 分片地址改写为经代理的地址，而不是原样转发上游播放列表
+    assert b'/api/proxy/hls/' in body
+    assert b'\nseg-1.ts\n' not in body
+
+
+def test_finite_source_is_not_re_pulled(app, origin, make_channel, stream_credentials):
+    server = origin({'/vod.ts': _finite_body})
+    channel_id = make_channel(server.url('/vod.ts'), name='async-vod')
+
+    status, _, body = _get(app, f"/api/proxy/stream/{channel_id}?token={stream_credentials['token']}")
+
+    assert status == 200
+    assert len(body) == BODY_SIZE
+    assert server.hits['/vod.ts'] == 1
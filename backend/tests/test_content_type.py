@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+上游 Content-Type：健康检测学到的类型经频道字段共享给流代理，地址修改与目录版本变化后失效
+"""
+
+from app import db
+from app.config import config
+from app.models.channel import Channel
+from app.services.content_type_cache import clear_content_types, get_cached_content_type, remember_content_type
+from app.services.health_checker import check_channel_health
+from app.services.stream_session import close_stream_session, open_stream_session
+
+HLS_TYPE = 'application/vnd.apple.mpegurl'
+
+
+def _playlist(handler):
+    body = b'#EXTM3U\n#EXT-X-TARGETDURATION:2\n'
+    handler.send_response(200)
+    handler.send_header('Content-Type', HLS_TYPE)
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def _open_session_content_type(app, credentials, channel_id):
+    with app.app_context():
+        session = open_stream_session(credentials, channel_id)
+        close_stream_session(session)
+    return session['content_type']
+
+
+def test_health_probe_type_reaches_stream_sessions(app, origin, make_channel, stream_credentials, monkeypatch):
+    monkeypatch.setitem(config['health_check'], 'deep_probe', True)
+    server = origin({'/live': _playlist})
+    channel_id = make_channel(server.url('/live'))
+
+    with app.app_context():
+        check_channel_health(db.session.get(Channel, channel_id), max_retries=0)
+        assert db.session.get(Channel, channel_id).content_type == HLS_TYPE
+
+    # 流代理运行在其他进程，本进程缓存中没有健康检测学到的值
+    clear_content_types()
+    assert _open_session_content_type(app, stream_credentials, channel_id) == HLS_TYPE
+
+
+def test_url_edit_drops_learned_type(app, origin, make_channel, auth_headers, stream_credentials):
+    server = origin({'/live': _playlist})
+    old_url = server.url('/live')
+    new_url = server.url('/other.ts')
+    channel_id = make_channel(old_url)
+    with app.app_context():
+        channel = db.session.get(Channel, channel_id)
+        channel.content_type = HLS_TYPE
+        db.session.commit()
+    remember_content_type(channel_id, old_url, HLS_TYPE)
+
+    response = app.test_client().put(f'/api/channels/{channel_id}', json={'url': new_url}, headers=auth_headers)
+
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(Channel, channel_id).content_type is None
+    assert _open_session_content_type(app, stream_credentials, channel_id) is None
+
+
+def test_catalog_version_change_clears_cache(app, origin, make_channel, stream_credentials):
+    server = origin({'/live': _playlist})
+    channel_id = make_channel(server.url('/live'))
+    _open_session_content_type(app, stream_credentials, channel_id)
+    remember_content_type(channel_id, server.url('/live'), HLS_TYPE)
+    assert _open_session_content_type(app, stream_credentials, channel_id) == HLS_TYPE
+
+    # 频道编辑后目录版本变化，下次启动流比对版本时清空缓存
+    make_channel(server.url('/another'), name='another')
+
+    assert _open_session_content_type(app, stream_credentials, channel_id) is None
+    assert get_cached_content_type(channel_id, server.url('/live')) is None
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+频道导出：键集分批读取保持分组与排序顺序，批次之间不占用数据库连接
+"""
+
+from app import db
+from app.models.channel import Channel
+from app.models.channel_group import ChannelGroup
+from app.services import import_export
+
+
+def _make_group_channels(app):
+    with app.app_context():
+        group = ChannelGroup(name='导出分组', sort_order=-1)
+        db.session.add(group)
+        db.session.flush()
+        # 相同 sort_order 的频道按 id 排序
+        for index, sort_order in enumerate([2, 0, 1, 1, 0, 1, 3]):
+            db.session.add(Channel(
+                name=f'export-{index}',
+                url=f'http://127.0.0.1:9/{index}.ts',
+                group_id=group.id,
+                sort_order=sort_order
+            ))
+        db.session.commit()
+        return [
+            channel.name for channel in
+            Channel.query.filter_by(group_id=group.id).order_by(Channel.sort_order, Channel.id)
+        ]
+
+
+def test_export_batches_keep_order_and_release_connections(app, auth_headers, monkeypatch):
+    monkeypatch.setattr(import_export, 'EXPORT_BATCH_SIZE', 2)
+    expected = _make_group_channels(app)
+    with app.app_context():
+        pool = db.engine.pool
+    checked_out = []
+    iter_txt_lines = import_export._iter_export_txt_lines
+
+    def sampled_lines():
+        # 每输出一行（相当于等待客户端接收）时记录被占用的连接数
+        for line in iter_txt_lines():
+            checked_out.append(pool.checkedout())
+            yield line
+
+    monkeypatch.setattr(import_export, '_iter_export_txt_lines', sampled_lines)
+
+    response = app.test_client().get('/api/import-export/export?format=txt', headers=auth_headers)
+    lines = response.get_data(as_text=True).splitlines()
+    start = lines.index('导出分组,#genre#') + 1
+    names = []
+    for line in lines[start:]:
+        if line.endswith(',#genre#'):
+            break
+        names.append(line.split(',')[0])
+    assert names == expected
+    assert not any(checked_out)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+上游主机熔断：一个进程熔断的主机经共享表同步到其他进程，任一进程探测成功后各进程随之恢复
+"""
+
+import pytest
+
+from app.services import host_breaker
+from app.services.host_breaker import (
+    allow_request,
+    get_host_breaker_stats,
+    host_key,
+    record_host_failure,
+    record_host_success,
+    sync_shared_state
+)
+
+URL = 'http://10.255.0.1:8080/live.ts'
+
+
+@pytest.fixture
+def breaker(app, monkeypatch):
+    """以清空进程内状态模拟另一个进程，返回切换进程的函数"""
+    monkeypatch.setattr(host_breaker, '_hosts', {})
+    monkeypatch.setattr(host_breaker, '_pending_writes', {})
+
+    def switch_process():
+        host_breaker._hosts.clear()
+        host_breaker._pending_writes.clear()
+
+    yield switch_process
+    record_host_success(URL)
+    with app.app_context():
+        sync_shared_state()
+
+
+def _open_breaker():
+    for _ in range(20):
+        record_host_failure(URL)
+        if not allow_request(URL):
+            return
+    raise AssertionError('熔断未打开')
+
+
+def test_open_breaker_is_shared_across_processes(app, breaker):
+    _open_breaker()
+    with app.app_context():
+        sync_shared_state()
+
+    breaker()
+    assert allow_request(URL)
+
+    with app.app_context():
+        sync_shared_state()
+
+    assert not allow_request(URL)
+    assert get_host_breaker_stats()['hosts'][host_key(URL)]['state'] == 'open'
+
+
+def test_recovery_in_one_process_closes_others(app, breaker, monkeypatch):
+    _open_breaker()
+    with app.app_context():
+        sync_shared_state()
+    worker_hosts = host_breaker._hosts
+
+    # 另一个进程读取共享状态，熔断到期后半开探测成功
+    monkeypatch.setattr(host_breaker, '_hosts', {})
+    with app.app_context():
+        sync_shared_state()
+    host_breaker._hosts[host_key(URL)]['open_until'] = 0
+    assert allow_request(URL)
+    record_host_success(URL)
+    with app.app_context():
+        sync_shared_state()
+
+    # 回到最初熔断的进程，同步后随之恢复
+    monkeypatch.setattr(host_breaker, '_hosts', worker_hosts)
+    assert not allow_request(URL)
+    with app.app_context():
+        sync_shared_state()
+    assert allow_request(URL)
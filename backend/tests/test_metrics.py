@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+流量指标：转发字节同时按频道与按用户计数
+"""
+
+import re
+
+from app.models.users import Users
+
+BODY_SIZE = 188 * 1000
+
+
+def _finite_body(handler):
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'video/mp2t')
+    handler.send_header('Content-Length', str(BODY_SIZE))
+    handler.end_headers()
+    handler.wfile.write(b'\x47' * BODY_SIZE)
+
+
+def _counter(text, name, label, value):
+    match = re.search(rf'^{name}{{{label}="{value}"}} ([0-9.e+]+)$', text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_stream_bytes_are_counted_per_user(app, origin, make_channel, stream_credentials, auth_headers):
+    server = origin({'/vod.ts': _finite_body})
+    channel_id = make_channel(server.url('/vod.ts'), name='metrics')
+    with app.app_context():
+        user_id = Users.query.filter_by(username='admin').first().id
+    client = app.test_client()
+    before = _counter(client.get('/metrics', headers=auth_headers).get_data(as_text=True),
+                      'iptv_stream_user_bytes_total', 'user_id', user_id)
+
+    response = client.get(f"/api/proxy/stream/{channel_id}?token={stream_credentials['token']}")
+    assert len(response.get_data()) == BODY_SIZE
+
+    text = client.get('/metrics', headers=auth_headers).get_data(as_text=True)
+    assert _counter(text, 'iptv_stream_user_bytes_total', 'user_id', user_id) - before == BODY_SIZE
+    assert _counter(text, 'iptv_stream_channel_bytes_total', 'channel_id', channel_id) == BODY_SIZE
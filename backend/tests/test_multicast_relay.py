@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+组播接收：经本机回环发送 RTP / 裸 UDP 组播，校验重排去重、停滞判定与共享上游转发
+"""
+
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from app.config import config
+from app.services.multicast_relay import MulticastReceiver
+from app.services.stream_relay import RelayHub
+
+LOOPBACK = '127.0.0.1'
+TS_PACKET = 188
+
+
+def _ts_payload(index):
+    # 每个数据报 7 个 TS 包，包内容带上序号便于校验顺序
+    packet = b'\x47' + index.to_bytes(4, 'big') + b'\x00' * (TS_PACKET - 5)
+    return packet * 7
+
+
+def _rtp(sequence_number, payload):
+    return struct.pack('!BBHII', 0x80, 33, sequence_number & 0xFFFF, sequence_number * 3600, 0x1234) + payload
+
+
+class MulticastSender:
+    """向回环网卡发送组播数据报"""
+
+    def __init__(self, group, port):
+        self.address = (group, port)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(LOOPBACK))
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+    def send(self, packets, interval=0.0):
+        for packet in packets:
+            self._sock.sendto(packet, self.address)
+            if interval:
+                time.sleep(interval)
+
+    def send_in_background(self, packets, interval, delay=0.3):
+        def run():
+            time.sleep(delay)
+            self.send(packets, interval)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self._sock.close()
+
+
+@pytest.fixture
+def multicast(monkeypatch):
+    """返回 (组播地址, 发送器)；环境不支持回环组播时跳过"""
+    group, port = '239.255.77.1', 15077
+    monkeypatch.setitem(config.setdefault('multicast', {}), 'interface', LOOPBACK)
+    try:
+        probe = MulticastReceiver(f'udp://@{group}:{port}', TS_PACKET, interface=LOOPBACK)
+    except OSError as e:
+        pytest.skip(f"无法加入组播组: {e}")
+    sender = MulticastSender(group, port)
+    probe._sock.settimeout(1)
+    sender.send([b'\x47' + b'\x00' * (TS_PACKET - 1)])
+    try:
+        probe._sock.recv(2048)
+    except socket.timeout:
+        sender.close()
+        pytest.skip('回环组播不可用')
+    finally:
+        probe.close()
+    yield (group, port), sender
+    sender.close()
+
+
+def _collect(receiver, stop_event, expected_bytes, idle_timeout=3):
+    data = b''
+    for chunk in receiver.iter_chunks(stop_event, poll_seconds=0.2, idle_timeout=idle_timeout):
+        data += chunk
+        if len(data) >= expected_bytes:
+            break
+    return data
+
+
+def test_rtp_packets_are_reordered_and_deduplicated(multicast):
+    (group, port), sender = multicast
+    receiver = MulticastReceiver(f'rtp://{group}:{port}', 4096, interface=LOOPBACK)
+    try:
+        # 乱序且带重复包
+        order = [0, 2, 1, 3, 3, 5, 4, 6, 7, 7, 9, 8]
+        sender.send_in_background([_rtp(60000 + seq, _ts_payload(seq)) for seq in order], interval=0.005)
+        data = _collect(receiver, threading.Event(), 10 * 7 * TS_PACKET)
+    finally:
+        receiver.close()
+
+    assert data == b''.join(_ts_payload(seq) for seq in range(10))
+
+
+def test_raw_udp_ts_is_passed_through(multicast):
+    (group, port), sender = multicast
+    receiver = MulticastReceiver(f'udp://@{group}:{port}', 4096, interface=LOOPBACK)
+    try:
+        sender.send_in_background([_ts_payload(seq) for seq in range(5)], interval=0.005)
+        data = _collect(receiver, threading.Event(), 5 * 7 * TS_PACKET)
+    finally:
+        receiver.close()
+
+    assert data == b''.join(_ts_payload(seq) for seq in range(5))
+
+
+def test_silent_group_raises_stall_timeout(multicast):
+    (group, port), _ = multicast
+    receiver = MulticastReceiver(f'udp://@{group}:{port}', 4096, interface=LOOPBACK)
+    try:
+        started_at = time.monotonic()
+        with pytest.raises(TimeoutError):
+            _collect(receiver, threading.Event(), 1, idle_timeout=1)
+    finally:
+        receiver.close()
+
+    assert time.monotonic() - started_at < 3
+
+
+def test_relay_hub_shares_one_membership(multicast):
+    (group, port), sender = multicast
+    url = f'rtp://{group}:{port}'
+    hub = RelayHub()
+    first = hub.subscribe(100, [url])
+    second = hub.subscribe(101, [url])
+    received = [b'', b'']
+    expected = 20 * 7 * TS_PACKET
+
+    def consume(index, subscription):
+        for chunk in subscription:
+            received[index] += chunk
+            if len(received[index]) >= expected:
+                return
+
+    # 不同频道引用同一组播组时共用一路上游（只加入一次组播组）
+    assert len(hub.get_stats()) == 1
+
+    readers = [threading.Thread(target=consume, args=(index, sub), daemon=True) for index, sub in enumerate((first, second))]
+    for reader in readers:
+        reader.start()
+    sender.send_in_background([_rtp(seq, _ts_payload(seq)) for seq in range(20)], interval=0.01, delay=0.5)
+    for reader in readers:
+        reader.join(10)
+    first.close()
+    second.close()
+
+    assert received[0][:expected] == received[1][:expected] == b''.join(_ts_payload(seq) for seq in range(20))
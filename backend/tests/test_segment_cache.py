@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+HLS 分片缓存：回源失败传给等待者、清理已退出进程的目录、磁盘上限按整个目录计算
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from app.services import segment_cache as segment_cache_module
+from app.services.segment_cache import SegmentCache
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def test_leader_failure_is_shared_with_waiters():
+    cache = SegmentCache()
+    url = 'http://127.0.0.1:9/seg-1.ts'
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        raise UpstreamError('upstream down')
+
+    errors = []
+
+    def request():
+        try:
+            cache.get_or_fetch(url, fetch)
+        except UpstreamError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        time.sleep(0.01)
+    # 等待其余请求进入等待状态后再让首个请求失败
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(errors) == 8
+
+
+@pytest.fixture
+def disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(segment_cache_module, 'get_hls_segment_cache_dir', lambda: str(tmp_path))
+    monkeypatch.setattr(segment_cache_module, 'get_hls_segment_cache_memory_bytes', lambda: 100)
+    monkeypatch.setattr(segment_cache_module, 'get_hls_segment_cache_disk_bytes', lambda: 1000)
+    return tmp_path
+
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_disk_budget_covers_whole_dir_and_drops_dead_dirs(disk_cache):
+    dead_dir = disk_cache / str(_exited_pid())
+    dead_dir.mkdir()
+    (dead_dir / 'old').write_bytes(b'x' * 5000)
+    # 仍在运行的其他进程（父进程）占用 600 字节
+    live_dir = disk_cache / str(os.getppid())
+    live_dir.mkdir()
+    (live_dir / 'seg').write_bytes(b'x' * 600)
+
+    cache = SegmentCache()
+    for index in range(4):
+        url = f'http://127.0.0.1:9/seg-{index}.ts'
+        cache.get_or_fetch(url, lambda: (b'\x47' * 300, 'video/mp2t'))
+
+    stats = cache.get_stats()
+    assert not dead_dir.exists()
+    assert live_dir.exists()
+    assert 0 < stats['disk_bytes'] <= 1000 - 600
+    own_dir = disk_cache / str(os.getpid())
+    assert sum(path.stat().st_size for path in own_dir.iterdir()) == stats['disk_bytes']
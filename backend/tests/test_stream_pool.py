@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+观看期间不占用数据库连接：500 路并发观看对 10 个连接的连接池全部成功启动
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+from sqlalchemy.pool import QueuePool
+from werkzeug.serving import make_server
+
+from app import db
+
+STREAMS = 500
+POOL_SIZE = 10
+HOLD_SECONDS = 3
+
+
+def _live_ts(handler):
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'video/mp2t')
+    handler.end_headers()
+    for _ in range(6000):
+        handler.wfile.write(b'\x47' + bytes(187))
+        handler.wfile.flush()
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def small_pool(app):
+    """把连接池换成 pool_size=10、无溢出、5 秒超时，结束后恢复"""
+    with app.app_context():
+        engine = db.engine
+        old_pool = engine.pool
+        engine.pool = QueuePool(
+            old_pool._creator,
+            pool_size=POOL_SIZE,
+            max_overflow=0,
+            timeout=5,
+            _dispatch=old_pool.dispatch,
+            dialect=old_pool._dialect
+        )
+    yield engine.pool
+    engine.pool.dispose()
+    engine.pool = old_pool
+
+
+@pytest.fixture
+def proxy_server(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_port
+    server.shutdown()
+
+
+def test_concurrent_streams_do_not_hold_pool_connections(
+    origin, make_channel, stream_credentials, small_pool, proxy_server
+):
+    server = origin({'/live.ts': _live_ts})
+    channel_id = make_channel(server.url('/live.ts'), name='pool-test')
+    token = stream_credentials['token']
+    sockets = []
+    started = [0]
+    lock = threading.Lock()
+
+    def viewer():
+        try:
+            sock = socket.create_connection(('127.0.0.1', proxy_server))
+            sock.settimeout(30)
+            sock.sendall(f'GET /api/proxy/stream/{channel_id}?token={token} HTTP/1.1\r\nHost: test\r\n\r\n'.encode())
+            data = b''
+            while len(data) < 4000:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        except OSError:
+            return
+        with lock:
+            sockets.append(sock)
+            if b' 200 ' in data.split(b'\r\n', 1)[0] and len(data) >= 4000:
+                started[0] += 1
+
+    threads = [threading.Thread(target=viewer) for _ in range(STREAMS)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+
+        # 全部观看保持期间（心跳在后台聚合落库），连接池几乎空闲
+        hold_peak = 0
+        deadline = time.monotonic() + HOLD_SECONDS
+        while time.monotonic() < deadline:
+            hold_peak = max(hold_peak, small_pool.checkedout())
+            time.sleep(0.02)
+    finally:
+        for sock in sockets:
+            sock.close()
+
+    assert started[0] == STREAMS
+    assert hold_peak < POOL_SIZE
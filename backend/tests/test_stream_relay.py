@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+共享上游的源切换：正常结束不重拉、出错按退避重连、5xx 计入主机熔断
+"""
+
+import threading
+import time
+
+from app.services import stream_relay
+from app.services.host_breaker import get_host_breaker_stats, host_key
+from app.services.stream_relay import RelayHub
+
+BODY_SIZE = 376000
+
+
+def _finite_body(handler):
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'video/mp2t')
+    handler.send_header('Content-Length', str(BODY_SIZE))
+    handler.end_headers()
+    handler.wfile.write(b'\x47' * BODY_SIZE)
+
+
+def _truncated_body(handler):
+    # 声明的长度大于实际发送的数据，连接提前断开即为上游出错
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'video/mp2t')
+    handler.send_header('Content-Length', str(BODY_SIZE))
+    handler.end_headers()
+    handler.wfile.write(b'\x47' * 18800)
+
+
+def _server_error(handler):
+    handler.send_response(503)
+    handler.send_header('Content-Length', '0')
+    handler.end_headers()
+
+
+def _read_all(subscription, timeout):
+    """在后台线程读取订阅，超时后关闭订阅，返回读取的字节数"""
+    received = [0]
+
+    def consume():
+        for chunk in subscription:
+            received[0] += len(chunk)
+
+    reader = threading.Thread(target=consume, daemon=True)
+    reader.start()
+    reader.join(timeout)
+    subscription.close()
+    reader.join(5)
+    return received[0], not reader.is_alive()
+
+
+def test_finite_source_is_relayed_once(origin):
+    server = origin({'/vod.ts': _finite_body})
+    subscription = RelayHub().subscribe(1, [server.url('/vod.ts')])
+
+    received, ended = _read_all(subscription, timeout=8)
+
+    assert ended
+    assert received == BODY_SIZE
+    assert server.hits['/vod.ts'] == 1
+
+
+def test_clean_end_switches_to_untried_backup(origin):
+    server = origin({'/a.ts': _finite_body, '/b.ts': _finite_body})
+    subscription = RelayHub().subscribe(2, [server.url('/a.ts'), server.url('/b.ts')])
+
+    received, ended = _read_all(subscription, timeout=8)
+
+    assert ended
+    assert received == 2 * BODY_SIZE
+    assert server.hits == {'/a.ts': 1, '/b.ts': 1}
+
+
+def test_broken_source_reconnects_with_backoff(origin, monkeypatch):
+    monkeypatch.setattr(stream_relay, 'FAILOVER_MAX_ROUNDS', 3)
+    server = origin({'/live.ts': _truncated_body})
+    subscription = RelayHub().subscribe(3, [server.url('/live.ts')])
+
+    started_at = time.monotonic()
+    received, ended = _read_all(subscription, timeout=15)
+    elapsed = time.monotonic() - started_at
+
+    # 首次连接 + 3 轮重试（退避 1、2、4 秒）后结束
+    assert ended
+    assert server.hits['/live.ts'] == 4
+    assert elapsed >= 7
+    assert 0 < received <= 4 * 18800
+
+
+def test_server_error_counts_as_host_failure(origin):
+    server = origin({'/down.ts': _server_error})
+    url = server.url('/down.ts')
+
+    for channel_id in range(10, 15):
+        received, ended = _read_all(RelayHub().subscribe(channel_id, [url]), timeout=5)
+        assert ended
+        assert received == 0
+
+    hosts = get_host_breaker_stats()['hosts']
+    assert hosts[host_key(url)]['state'] == 'open'
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+订阅 Token 缓存：重置 Token 的事务提交前，其他请求查到的旧 Token 不会被写入缓存
+"""
+
+import threading
+
+from app import db
+from app.models.users import Users
+from app.services.token_cache import get_token_user, invalidate_token_cache
+
+
+def _lookup_in_thread(app, token):
+    result = []
+
+    def run():
+        with app.app_context():
+            result.append(get_token_user(token))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(10)
+    return result[0]
+
+
+def test_old_token_is_not_cached_before_reset_commits(app, stream_credentials):
+    old_token = stream_credentials['token']
+    with app.app_context():
+        user = Users.query.filter_by(username='admin').first()
+        user_id = user.id
+        assert get_token_user(old_token).id == user_id
+
+        new_token = user.generate_token()
+        invalidate_token_cache()
+        # 提交前其他请求仍从数据库读到旧 Token
+        assert _lookup_in_thread(app, old_token).id == user_id
+        db.session.commit()
+
+    assert _lookup_in_thread(app, old_token) is None
+    assert _lookup_in_thread(app, new_token).id == user_id
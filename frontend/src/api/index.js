@@ -239,8 +239,11 @@ const api = {
     // 观看历史
     history: {
         cleanup: () => http.post('/history/cleanup'),
+        getCleanupStatus: () => http.get('/history/cleanup/status'),
         getStats: () => http.get('/history/stats'),
-        getList: (page = 1, perPage = 20) => http.get('/history/list', { params: { page, per_page: perPage } })
+        getList: (cursor = null, perPage = 20, withTotal = false) => http.get('/history/list', {
+            params: { cursor: cursor || undefined, per_page: perPage, with_total: withTotal || undefined }
+        })
     }
 }
 